@@ -27,14 +27,26 @@
 
 
 import os
-import shutil
-import subprocess
-import tarfile
+import re
 
+from testrunner.local import testdata
 from testrunner.local import testsuite
 from testrunner.objects import testcase
 
 
+# With context.benchmark_results, Octane prints the score of each benchmark
+# suite, the other benchmarks print the time they took in milliseconds.
+OCTANE_RUNNER = """
+BenchmarkSuite.RunSuites({
+  NotifyResult: function(name, result) { print(name + ": " + result); },
+  NotifyError: function(name, error) { print(name + ": " + error); }
+});
+"""
+TIMER_START = "var benchmark_start_time = Date.now();"
+TIMER_END = "print('Time: ' + (Date.now() - benchmark_start_time));"
+RESULT_PATTERN = re.compile(r"^([^:]+): ([0-9.]+)$", re.MULTILINE)
+
+
 class BenchmarksTestSuite(testsuite.TestSuite):
 
   def __init__(self, name, root):
@@ -103,74 +115,65 @@ class BenchmarksTestSuite(testsuite.TestSuite):
     return tests
 
   def GetFlagsForTestCase(self, testcase, context):
+    # The results are only printed for run-benchmarks.py, so that plain test
+    # runs keep their commands.
+    timer_start = []
+    timer_end = []
+    octane_runner = "BenchmarkSuite.RunSuites({});"
+    if context.benchmark_results:
+      timer_start = ["-e", TIMER_START]
+      timer_end = ["-e", TIMER_END]
+      octane_runner = OCTANE_RUNNER
     result = []
     result += context.mode_flags
     if testcase.path.startswith("kraken"):
       result.append(os.path.join(self.testroot, "%s-data.js" % testcase.path))
+      result += timer_start
       result.append(os.path.join(self.testroot, "%s.js" % testcase.path))
+      result += timer_end
     elif testcase.path.startswith("octane"):
       result.append(os.path.join(self.testroot, "octane/base.js"))
       result.append(os.path.join(self.testroot, "%s.js" % testcase.path))
-      result += ["-e", "BenchmarkSuite.RunSuites({});"]
+      result += ["-e", octane_runner]
     elif testcase.path.startswith("sunspider"):
+      result += timer_start
       result.append(os.path.join(self.testroot, "%s.js" % testcase.path))
+      result += timer_end
     return testcase.flags + result
 
+  def GetBenchmarkResult(self, testcase):
+    results = RESULT_PATTERN.findall(testcase.output.stdout)
+    if not results:
+      return None
+    if testcase.path.startswith("octane"):
+      return (float(results[-1][1]), "score", True)
+    return (float(results[-1][1]), "ms", False)
+
   def GetSourceForTest(self, testcase):
     filename = os.path.join(self.testroot, testcase.path + ".js")
     with open(filename) as f:
       return f.read()
 
-  def _DownloadIfNecessary(self, url, revision, target_dir):
-    # Maybe we're still up to date?
-    revision_file = "CHECKED_OUT_%s" % target_dir
-    checked_out_revision = None
-    if os.path.exists(revision_file):
-      with open(revision_file) as f:
-        checked_out_revision = f.read()
-    if checked_out_revision == revision:
-      return
-
-    # If we have a local archive file with the test data, extract it.
-    if os.path.exists(target_dir):
-      shutil.rmtree(target_dir)
-    archive_file = "downloaded_%s_%s.tar.gz" % (target_dir, revision)
-    if os.path.exists(archive_file):
-      with tarfile.open(archive_file, "r:gz") as tar:
-        tar.extractall()
-      with open(revision_file, "w") as f:
-        f.write(revision)
-      return
-
-    # No cached copy. Check out via SVN, and pack as .tar.gz for later use.
+  def _Archive(self, url, revision, target_dir):
     command = "svn co %s -r %s %s" % (url, revision, target_dir)
-    code = subprocess.call(command, shell=True)
-    if code != 0:
-      raise Exception("Error checking out %s benchmark" % target_dir)
-    with tarfile.open(archive_file, "w:gz") as tar:
-      tar.add("%s" % target_dir)
-    with open(revision_file, "w") as f:
-      f.write(revision)
-
-  def DownloadData(self):
-    old_cwd = os.getcwd()
-    os.chdir(os.path.abspath(self.root))
-
-    self._DownloadIfNecessary(
-        ("http://svn.webkit.org/repository/webkit/trunk/PerformanceTests/"
-         "SunSpider/tests/sunspider-1.0/"),
-        "153700", "sunspider")
-
-    self._DownloadIfNecessary(
-        ("http://kraken-mirror.googlecode.com/svn/trunk/kraken/tests/"
-         "kraken-1.1/"),
-        "8", "kraken")
-
-    self._DownloadIfNecessary(
-        "http://octane-benchmark.googlecode.com/svn/trunk/",
-        "22", "octane")
-
-    os.chdir(old_cwd)
+    return testdata.DataArchive(
+        target_dir, "downloaded_%s_%s.tar.gz" % (target_dir, revision),
+        self.root, testdata.PackCheckout(command, target_dir, target_dir))
+
+  def GetDataArchives(self):
+    return [
+        self._Archive(
+            ("http://svn.webkit.org/repository/webkit/trunk/PerformanceTests/"
+             "SunSpider/tests/sunspider-1.0/"),
+            "153700", "sunspider"),
+        self._Archive(
+            ("http://kraken-mirror.googlecode.com/svn/trunk/kraken/tests/"
+             "kraken-1.1/"),
+            "8", "kraken"),
+        self._Archive(
+            "http://octane-benchmark.googlecode.com/svn/trunk/",
+            "22", "octane"),
+    ]
 
   def VariantFlags(self, testcase, default_flags):
     # Both --nocrankshaft and --stressopt are very slow.
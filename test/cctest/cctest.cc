@@ -104,15 +104,16 @@ void CcTest::DisableAutomaticDispose() {
 }
 
 
+// Prints one line per test: file/name<dependency, followed by
+// <uninitialized for tests that run without an isolate.
 static void PrintTestList(CcTest* current) {
   if (current == NULL) return;
   PrintTestList(current->prev());
-  if (current->dependency() != NULL) {
-    printf("%s/%s<%s\n",
-           current->file(), current->name(), current->dependency());
-  } else {
-    printf("%s/%s<\n", current->file(), current->name());
-  }
+  const char* dependency = current->dependency();
+  printf("%s/%s<%s%s\n",
+         current->file(), current->name(),
+         dependency != NULL ? dependency : "",
+         current->initialize() ? "" : "<uninitialized");
 }
 
 
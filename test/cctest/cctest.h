@@ -91,6 +91,7 @@ class CcTest {
   const char* name() { return name_; }
   const char* dependency() { return dependency_; }
   bool enabled() { return enabled_; }
+  bool initialize() { return initialize_; }
 
   static v8::Isolate* isolate() {
     CHECK(isolate_ != NULL);
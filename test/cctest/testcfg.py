@@ -25,15 +25,40 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import hashlib
+import json
 import os
 import shutil
 
 from testrunner.local import commands
 from testrunner.local import testsuite
 from testrunner.local import utils
+from testrunner.objects import output
 from testrunner.objects import testcase
 
 
+LIST_CACHE_FILE = "cctest.list.json"
+
+# Files whose tests are known to run correctly one after another in the
+# same cctest process. They neither create an isolate nor change flags.
+# Tests of other files are never batched.
+BATCHABLE_FILES = set([
+  "test-bignum",
+  "test-bignum-dtoa",
+  "test-circular-queue",
+  "test-conversions",
+  "test-diy-fp",
+  "test-double",
+  "test-dtoa",
+  "test-fast-dtoa",
+  "test-fixed-dtoa",
+  "test-hashmap",
+  "test-list",
+  "test-strtod",
+  "test-utils",
+])
+
+
 class CcTestSuite(testsuite.TestSuite):
 
   def __init__(self, name, root):
@@ -43,27 +68,79 @@ class CcTestSuite(testsuite.TestSuite):
     if os.path.exists(self.serdes_dir):
       shutil.rmtree(self.serdes_dir, True)
     os.makedirs(self.serdes_dir)
+    # Files with tests that depend on each other, e.g. through the
+    # serialization file. Their tests are never batched.
+    self.files_with_dependencies = set()
+    # Tests that run without an initialized isolate. cctest can't run them
+    # after other tests in the same process, so they are never batched.
+    self.uninitialized_tests = set()
 
-  def ListTests(self, context):
+  def _HashFile(self, filename):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+      while True:
+        chunk = f.read(1 << 20)
+        if not chunk:
+          break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+  def _ListTestDescriptions(self, context):
+    """Returns the output of 'cctest --list'. It is cached next to the
+    binary and only recomputed when the contents of the binary change."""
     shell = os.path.abspath(os.path.join(context.shell_dir, self.shell()))
     if utils.IsWindows():
       shell += ".exe"
-    output = commands.Execute(context.command_prefix +
-                              [shell, "--list"] +
-                              context.extra_flags)
-    if output.exit_code != 0:
-      print output.stdout
-      print output.stderr
+    cache_file = os.path.join(context.shell_dir, LIST_CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_file):
+      try:
+        with open(cache_file) as f:
+          cache = json.load(f)
+      except ValueError:
+        cache = {}
+    key = " ".join(context.command_prefix + context.extra_flags)
+    stat = os.stat(shell)
+    stat = [stat.st_size, stat.st_mtime]
+    entry = cache.get(key)
+    if entry and entry["stat"] == stat:
+      return str(entry["tests"])
+    digest = self._HashFile(shell)
+    if entry and entry["hash"] == digest:
+      entry["stat"] = stat
+    else:
+      output = commands.Execute(context.command_prefix +
+                                [shell, "--list"] +
+                                context.extra_flags)
+      if output.exit_code != 0:
+        print output.stdout
+        print output.stderr
+        return None
+      entry = {"hash": digest, "stat": stat, "tests": output.stdout}
+      cache[key] = entry
+    with open(cache_file, "w") as f:
+      json.dump(cache, f)
+    return str(entry["tests"])
+
+  def ListTests(self, context):
+    test_descs = self._ListTestDescriptions(context)
+    if test_descs is None:
       return []
     tests = []
-    for test_desc in output.stdout.strip().split():
+    for test_desc in test_descs.strip().split():
       if test_desc.find('<') < 0:
         # Native Client output can contain a few non-test arguments
         # before the tests. Skip these.
         continue
-      raw_test, dependency = test_desc.split('<')
+      # Each test is listed as file/name<dependency, optionally followed by
+      # <uninitialized.
+      parts = test_desc.split('<')
+      raw_test, dependency = parts[:2]
+      if "uninitialized" in parts[2:]:
+        self.uninitialized_tests.add(raw_test)
       if dependency != '':
         dependency = raw_test.split('/')[0] + '/' + dependency
+        self.files_with_dependencies.add(raw_test.split('/')[0])
       else:
         dependency = None
       test = testcase.TestCase(self, raw_test, dependency=dependency)
@@ -78,6 +155,31 @@ class CcTestSuite(testsuite.TestSuite):
     return (testcase.flags + [testcase.path] + context.mode_flags +
             ["--testing_serialization_file=" + serialization_file])
 
+  def GetBatchKey(self, testcase):
+    filename = testcase.path.split('/')[0]
+    if (filename not in BATCHABLE_FILES or testcase.dependency is not None or
+        filename in self.files_with_dependencies or
+        testcase.path in self.uninitialized_tests):
+      return None
+    return (filename, tuple(testcase.flags))
+
+  def GetFlagsForBatch(self, testcases, context):
+    return (testcases[0].flags + [ t.path for t in testcases ] +
+            context.mode_flags)
+
+  def GetBatchOutputs(self, testcases, batch_output):
+    # cctest doesn't report the results of single tests, so this only maps
+    # batches in which all tests passed.
+    if (batch_output.exit_code != 0 or batch_output.HasTimedOut() or
+        not "Ran %d tests." % len(testcases) in batch_output.stdout):
+      return None
+    return [ output.Output(0, False, "", "") for t in testcases ]
+
+  def SplitBatch(self, testcases):
+    # A crashing test takes down the whole process, so run each test of a
+    # failed batch on its own.
+    return [ [t] for t in testcases ]
+
   def shell(self):
     return "cctest"
 
@@ -41,6 +41,7 @@ INVALID_FLAGS = ["--enable-slow-asserts"]
 class MessageTestSuite(testsuite.TestSuite):
   def __init__(self, name, root):
     super(MessageTestSuite, self).__init__(name, root)
+    self.expectations = {}  # Test path -> list of (line, regexp or None)
 
   def ListTests(self, context):
     tests = []
@@ -84,25 +85,38 @@ class MessageTestSuite(testsuite.TestSuite):
             string.find("Native Client module will be loaded") > 0 or
             string.find("NaClHostDescOpen:") > 0)
 
+  def _GetExpectations(self, testpath):
+    """Returns the expected output lines of a test. They are read once per
+    test, and only lines with a '*' wildcard are compiled into a regexp."""
+    if testpath not in self.expectations:
+      expected_path = os.path.join(self.root, testpath + ".out")
+      env = { "basename": os.path.basename(testpath + ".js") }
+      expectations = []
+      # Can't use utils.ReadLinesFrom() here because it strips whitespace.
+      with open(expected_path) as f:
+        for line in f:
+          if line.startswith("#") or not line.strip(): continue
+          expected = line.rstrip() % env
+          regexp = None
+          if "*" in expected:
+            pattern = re.escape(expected).replace("\\*", ".*")
+            regexp = re.compile("^%s$" % pattern)
+          expectations.append((expected, regexp))
+      self.expectations[testpath] = expectations
+    return self.expectations[testpath]
+
   def IsFailureOutput(self, output, testpath):
-    expected_path = os.path.join(self.root, testpath + ".out")
-    expected_lines = []
-    # Can't use utils.ReadLinesFrom() here because it strips whitespace.
-    with open(expected_path) as f:
-      for line in f:
-        if line.startswith("#") or not line.strip(): continue
-        expected_lines.append(line)
+    expectations = self._GetExpectations(testpath)
     raw_lines = output.stdout.splitlines()
     actual_lines = [ s for s in raw_lines if not self._IgnoreLine(s) ]
-    env = { "basename": os.path.basename(testpath + ".js") }
-    if len(expected_lines) != len(actual_lines):
+    if len(expectations) != len(actual_lines):
       return True
-    for (expected, actual) in itertools.izip_longest(
-        expected_lines, actual_lines, fillvalue=''):
-      pattern = re.escape(expected.rstrip() % env)
-      pattern = pattern.replace("\\*", ".*")
-      pattern = "^%s$" % pattern
-      if not re.match(pattern, actual):
+    for ((expected, regexp), actual) in itertools.izip(expectations,
+                                                        actual_lines):
+      if regexp is None:
+        if expected != actual:
+          return True
+      elif not regexp.match(actual):
         return True
     return False
 
@@ -27,10 +27,8 @@
 
 
 import os
-import shutil
-import subprocess
-import tarfile
 
+from testrunner.local import testdata
 from testrunner.local import testsuite
 from testrunner.objects import testcase
 
@@ -116,48 +114,13 @@ class MozillaTestSuite(testsuite.TestSuite):
       return True
     return "FAILED!" in output.stdout
 
-  def DownloadData(self):
-    old_cwd = os.getcwd()
-    os.chdir(os.path.abspath(self.root))
-
-    # Maybe we're still up to date?
-    versionfile = "CHECKED_OUT_VERSION"
-    checked_out_version = None
-    if os.path.exists(versionfile):
-      with open(versionfile) as f:
-        checked_out_version = f.read()
-    if checked_out_version == MOZILLA_VERSION:
-      os.chdir(old_cwd)
-      return
-
-    # If we have a local archive file with the test data, extract it.
-    directory_name = "data"
-    if os.path.exists(directory_name):
-      os.rename(directory_name, "data.old")
-    archive_file = "downloaded_%s.tar.gz" % MOZILLA_VERSION
-    if os.path.exists(archive_file):
-      with tarfile.open(archive_file, "r:gz") as tar:
-        tar.extractall()
-      with open(versionfile, "w") as f:
-        f.write(MOZILLA_VERSION)
-      os.chdir(old_cwd)
-      return
-
-    # No cached copy. Check out via CVS, and pack as .tar.gz for later use.
+  def GetDataArchives(self):
     command = ("cvs -d :pserver:anonymous@cvs-mirror.mozilla.org:/cvsroot"
                " co -D %s mozilla/js/tests" % MOZILLA_VERSION)
-    code = subprocess.call(command, shell=True)
-    if code != 0:
-      os.chdir(old_cwd)
-      raise Exception("Error checking out Mozilla test suite!")
-    os.rename(os.path.join("mozilla", "js", "tests"), directory_name)
-    shutil.rmtree("mozilla")
-    with tarfile.open(archive_file, "w:gz") as tar:
-      tar.add("data")
-    with open(versionfile, "w") as f:
-      f.write(MOZILLA_VERSION)
-    os.chdir(old_cwd)
-
+    return [testdata.DataArchive(
+        "mozilla", "downloaded_%s.tar.gz" % MOZILLA_VERSION, self.root,
+        testdata.PackCheckout(command, os.path.join("mozilla", "js", "tests"),
+                              "data"))]
 
 def GetSuite(name, root):
   return MozillaTestSuite(name, root)
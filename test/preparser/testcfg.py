@@ -26,14 +26,46 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import json
 import os
 import re
 
 from testrunner.local import testsuite
 from testrunner.local import utils
+from testrunner.objects import output
 from testrunner.objects import testcase
 
 
+# Longer sources are run in their own process.
+MAX_BATCHED_SOURCE_LENGTH = 1000
+# Runs each source of a batch as a script in a fresh realm and prints a
+# result line per source. The d8 functions are captured up front so that
+# tests which redefine globals can't interfere.
+BATCH_HARNESS = """
+(function(sources) {
+  var write = print;
+  var create = Realm.create;
+  var evaluate = Realm.eval;
+  var dispose = Realm.dispose;
+  for (var i = 0; i < sources.length; i++) {
+    var realm = create();
+    var result = "ok";
+    try {
+      evaluate(realm, sources[i]);
+    } catch (e) {
+      result = "throws";
+      try {
+        result += " " + String(e).replace(/\\n/g, " ");
+      } catch (e2) { }
+    }
+    dispose(realm);
+    write("### " + i + " " + result);
+  }
+})(%s);
+"""
+BATCH_RESULT_PATTERN = re.compile(r"^### (\d+) (ok|throws)(.*)$")
+
+
 class PreparserTestSuite(testsuite.TestSuite):
   def __init__(self, name, root):
     super(PreparserTestSuite, self).__init__(name, root)
@@ -112,6 +144,37 @@ class PreparserTestSuite(testsuite.TestSuite):
     with open(testcase.flags[0]) as f:
       return f.read()
 
+  def GetBatchKey(self, testcase):
+    flags = testcase.flags
+    if (testcase.dependency is None and len(flags) >= 2 and
+        flags[0] == "-e" and flags[2:] in ([], ["--throws"]) and
+        len(flags[1]) <= MAX_BATCHED_SOURCE_LENGTH):
+      return "-e"
+    return None
+
+  def GetFlagsForBatch(self, testcases, context):
+    sources = [ t.flags[1] for t in testcases ]
+    return ["-e", BATCH_HARNESS % json.dumps(sources)]
+
+  def GetBatchOutputs(self, testcases, batch_output):
+    if batch_output.exit_code != 0 or batch_output.HasTimedOut():
+      return None
+    results = {}
+    for line in batch_output.stdout.splitlines():
+      match = BATCH_RESULT_PATTERN.match(line)
+      if match:
+        results[int(match.group(1))] = (match.group(2), match.group(3))
+    if len(results) != len(testcases):
+      return None
+    outputs = []
+    for (i, test) in enumerate(testcases):
+      (result, message) = results[i]
+      # Mimic d8, which fails unless the script throws iff --throws is set.
+      throws = "--throws" in test.flags
+      exit_code = 0 if (result == "throws") == throws else 1
+      outputs.append(output.Output(exit_code, False, message.strip(), ""))
+    return outputs
+
   def VariantFlags(self, testcase, default_flags):
     return [[]];
 
@@ -26,12 +26,9 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-import hashlib
 import os
-import sys
-import tarfile
-import urllib
 
+from testrunner.local import testdata
 from testrunner.local import testsuite
 from testrunner.objects import testcase
 
@@ -88,35 +85,14 @@ class Test262TestSuite(testsuite.TestSuite):
       return True
     return "FAILED!" in output.stdout
 
-  def DownloadData(self):
+  def GetDataArchives(self):
     revision = TEST_262_ARCHIVE_REVISION
-    archive_url = TEST_262_URL % revision
-    archive_name = os.path.join(self.root, "test262-%s.tar.bz2" % revision)
-    directory_name = os.path.join(self.root, "data")
-    directory_old_name = os.path.join(self.root, "data.old")
-    if not os.path.exists(archive_name):
-      print "Downloading test data from %s ..." % archive_url
-      urllib.urlretrieve(archive_url, archive_name)
-      if os.path.exists(directory_name):
-        os.rename(directory_name, directory_old_name)
-    if not os.path.exists(directory_name):
-      print "Extracting test262-%s.tar.bz2 ..." % revision
-      md5 = hashlib.md5()
-      with open(archive_name, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), ""):
-          md5.update(chunk)
-      if md5.hexdigest() != TEST_262_ARCHIVE_MD5:
-        os.remove(archive_name)
-        raise Exception("Hash mismatch of test data file")
-      archive = tarfile.open(archive_name, "r:bz2")
-      if sys.platform in ("win32", "cygwin"):
-        # Magic incantation to allow longer path names on Windows.
-        archive.extractall(u"\\\\?\\%s" % self.root)
-      else:
-        archive.extractall(self.root)
-      os.rename(os.path.join(self.root, "test262-%s" % revision),
-                directory_name)
-
+    return [testdata.DataArchive(
+        "test262", "test262-%s.tar.bz2" % revision,
+        os.path.join(self.root, "data"),
+        testdata.DownloadUrl(TEST_262_URL % revision),
+        md5=TEST_262_ARCHIVE_MD5, strip_prefix="test262-%s/" % revision,
+        seed_dirs=[self.root])]
 
 def GetSuite(name, root):
   return Test262TestSuite(name, root)
@@ -25,7 +25,6 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import itertools
 import os
 import re
 
@@ -42,6 +41,7 @@ class WebkitTestSuite(testsuite.TestSuite):
 
   def __init__(self, name, root):
     super(WebkitTestSuite, self).__init__(name, root)
+    self.expectations = {}  # Test path -> list of expected lines
 
   def ListTests(self, context):
     tests = []
@@ -111,49 +111,39 @@ class WebkitTestSuite(testsuite.TestSuite):
             string.find("Native Client module will be loaded") > 0 or
             string.find("NaClHostDescOpen:") > 0)
 
+  def _GetExpectations(self, testpath):
+    """Returns the expected output lines of a test, read once per test."""
+    if testpath not in self.expectations:
+      file_name = os.path.join(self.root, testpath) + "-expected.txt"
+      with file(file_name, "r") as expected:
+        self.expectations[testpath] = [
+            line.strip() for line in expected
+            if not line.startswith("#") and line.strip() ]
+    return self.expectations[testpath]
+
+  def _FirstOutputBlock(self, lines):
+    """Returns the first block of output lines, or None if there is none.
+    With stress test separators, the first block is the one between the
+    first two separators. Without any, it is the complete output."""
+    first_separator = None
+    for (index, line) in enumerate(lines):
+      if line.startswith("=="):
+        if first_separator is not None:
+          return lines[first_separator + 1:index]
+        first_separator = index
+    if first_separator is None:
+      return lines
+    return None
+
   def IsFailureOutput(self, output, testpath):
     if super(WebkitTestSuite, self).IsFailureOutput(output, testpath):
       return True
-    file_name = os.path.join(self.root, testpath) + "-expected.txt"
-    with file(file_name, "r") as expected:
-      expected_lines = expected.readlines()
-
-    def ExpIterator():
-      for line in expected_lines:
-        if line.startswith("#") or not line.strip(): continue
-        yield line.strip()
-
-    def ActIterator(lines):
-      for line in lines:
-        if self._IgnoreLine(line.strip()): continue
-        yield line.strip()
-
-    def ActBlockIterator():
-      """Iterates over blocks of actual output lines."""
-      lines = output.stdout.splitlines()
-      start_index = 0
-      found_eqeq = False
-      for index, line in enumerate(lines):
-        # If a stress test separator is found:
-        if line.startswith("=="):
-          # Iterate over all lines before a separator except the first.
-          if not found_eqeq:
-            found_eqeq = True
-          else:
-            yield ActIterator(lines[start_index:index])
-          # The next block of ouput lines starts after the separator.
-          start_index = index + 1
-      # Iterate over complete output if no separator was found.
-      if not found_eqeq:
-        yield ActIterator(lines)
-
-    for act_iterator in ActBlockIterator():
-      for (expected, actual) in itertools.izip_longest(
-          ExpIterator(), act_iterator, fillvalue=''):
-        if expected != actual:
-          return True
+    block = self._FirstOutputBlock(output.stdout.splitlines())
+    if block is None:
       return False
-
+    actual_lines = [ line.strip() for line in block
+                     if not self._IgnoreLine(line.strip()) ]
+    return actual_lines != self._GetExpectations(testpath)
 
 def GetSuite(name, root):
   return WebkitTestSuite(name, root)
@@ -27,8 +27,10 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import bisect
 import os
 import re
+import struct
 import subprocess
 import tempfile
 
@@ -43,6 +45,7 @@ _COMMON_DISASM_OPTIONS = ["-M", "intel-mnemonic", "-C"]
 
 _DISASM_HEADER_RE = re.compile(r"[a-f0-9]+\s+<.*:$")
 _DISASM_LINE_RE = re.compile(r"\s*([a-f0-9]+):\s*(\S.*)")
+_DISASM_BLOB_SECTION_RE = re.compile(r"Disassembly of section \.c(\d+):$")
 
 # Keys must match constants in Logger::LogCodeInfo.
 _ARCH_MAP = {
@@ -52,6 +55,27 @@ _ARCH_MAP = {
   "mips": "-m mips"  # Not supported by our objdump build.
 }
 
+# ELF machines of the object files code blobs are disassembled in. These
+# are 32-bit even for x64 (as for the x32 ABI) so that addresses outside the
+# blobs wrap around as when disassembling them as raw binaries.
+_ELF_MACHINE_MAP = {
+  "ia32": 3,
+  "x64": 62,
+  "arm": 40,
+  "mips": 8
+}
+_ELF_HEADER_FORMAT = "<4sBBBB8xHHIIIIIHHHHHH"
+_ELF_SECTION_FORMAT = "<IIIIIIIIII"
+
+# Most code blobs and bytes of them disassembled by one objdump invocation,
+# staying clear of extended ELF section numbers.
+_MAX_BATCH_BLOBS = 0xfe00
+_MAX_BATCH_SIZE = 16 * 1024 * 1024
+
+# Code ranges of a file this close are disassembled by one objdump
+# invocation.
+_MAX_RANGE_GAP = 64 * 1024
+
 
 def GetDisasmLines(filename, offset, size, arch, inplace, arch_flags=""):
   tmp_name = None
@@ -76,14 +100,126 @@ def GetDisasmLines(filename, offset, size, arch, inplace, arch_flags=""):
                              stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT)
   out, err = process.communicate()
+  if tmp_name:
+    os.unlink(tmp_name)
+  return _ParseDisasmLines(out)
+
+
+def GetDisasmLinesOfBlobs(blobs, arch, arch_flags=""):
+  """Disassembles |blobs|, strings of code, with as few objdump invocations
+  as possible and returns the list of disassembled lines of each, with
+  addresses relative to the start of the blob.
+
+  The blobs are written to an object file as sections of their own, so
+  that each is decoded from its start and at address 0."""
+  assert arch in _ARCH_MAP, "Unsupported architecture '%s'" % arch
+  arch_flags = (arch_flags + " " + _ARCH_MAP[arch]).split()
+  results = []
+  first = 0
+  while first < len(blobs):
+    size = len(blobs[first])
+    end = first + 1
+    while (end < len(blobs) and end - first < _MAX_BATCH_BLOBS and
+           size + len(blobs[end]) <= _MAX_BATCH_SIZE):
+      size += len(blobs[end])
+      end += 1
+    (fd, tmp_name) = tempfile.mkstemp(".o")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(_ElfObject(blobs[first:end], _ELF_MACHINE_MAP[arch]))
+      out = _RunObjdump(arch_flags + ["-d", tmp_name])
+    finally:
+      os.unlink(tmp_name)
+    blob_lines = [ [] for _ in xrange(end - first) ]
+    lines = None
+    for line in out.split("\n"):
+      match = _DISASM_BLOB_SECTION_RE.match(line)
+      if match:
+        lines = blob_lines[int(match.group(1))]
+        continue
+      match = _DISASM_LINE_RE.match(line)
+      if match and lines is not None:
+        lines.append((int(match.group(1), 16), match.group(2)))
+    results.extend(blob_lines)
+    first = end
+  return results
+
+
+def GetDisasmLinesOfRanges(filename, ranges, arch_flags=""):
+  """Disassembles in place the code of the object file |filename| at
+  |ranges|, a list of (address, size) tuples, with an objdump invocation
+  per cluster of close ranges and returns the list of disassembled lines of
+  each."""
+  order = sorted(xrange(len(ranges)), key=lambda i: ranges[i])
+  results = [None] * len(ranges)
+  first = 0
+  while first < len(order):
+    (start, size) = ranges[order[first]]
+    stop = start + size
+    end = first + 1
+    while end < len(order) and ranges[order[end]][0] <= stop + _MAX_RANGE_GAP:
+      stop = max(stop, sum(ranges[order[end]]))
+      end += 1
+    lines = _ParseDisasmLines(_RunObjdump(arch_flags.split() + [
+        "--start-address=%d" % start, "--stop-address=%d" % stop, "-d",
+        filename]))
+    lines.sort(key=lambda line: line[0])
+    cluster = [ ranges[i] for i in order[first:end] ]
+    for i, range_lines in zip(order[first:end], _SliceLines(lines, cluster)):
+      results[i] = range_lines
+    first = end
+  return results
+
+
+def _ElfObject(blobs, machine):
+  """Returns a 32-bit relocatable ELF object file with a code section .c<i>
+  for each of |blobs|."""
+  header_size = struct.calcsize(_ELF_HEADER_FORMAT)
+  section_size = struct.calcsize(_ELF_SECTION_FORMAT)
+  names = ["\0.shstrtab\0"]
+  name_offsets = []
+  names_size = len(names[0])
+  for i in xrange(len(blobs)):
+    names.append(".c%d\0" % i)
+    name_offsets.append(names_size)
+    names_size += len(names[-1])
+  names_offset = header_size + sum(len(blob) for blob in blobs)
+  padding = (-(names_offset + names_size)) % 4
+  count = len(blobs) + 2
+  contents = [struct.pack(_ELF_HEADER_FORMAT, "\x7fELF", 1, 1, 1, 0,
+                          1, machine, 1, 0, 0,
+                          names_offset + names_size + padding, 0,
+                          header_size, 0, 0, section_size, count, 1)]
+  contents.extend(blobs)
+  contents.extend(names)
+  contents.append("\0" * (padding + section_size))
+  # The section names, of type SHT_STRTAB.
+  contents.append(struct.pack(_ELF_SECTION_FORMAT, 1, 3, 0, 0, names_offset,
+                              names_size, 0, 0, 1, 0))
+  offset = header_size
+  for (blob, name_offset) in zip(blobs, name_offsets):
+    # Of type SHT_PROGBITS, flags SHF_ALLOC | SHF_EXECINSTR.
+    contents.append(struct.pack(_ELF_SECTION_FORMAT, name_offset, 1, 6, 0,
+                                offset, len(blob), 0, 0, 1, 0))
+    offset += len(blob)
+  return "".join(contents)
+
+
+def _RunObjdump(args):
+  process = subprocess.Popen([OBJDUMP_BIN] + _COMMON_DISASM_OPTIONS + args,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+  out, err = process.communicate()
+  return out
+
+
+def _ParseDisasmLines(out):
   lines = out.split("\n")
   header_line = 0
   for i, line in enumerate(lines):
     if _DISASM_HEADER_RE.match(line):
       header_line = i
       break
-  if tmp_name:
-    os.unlink(tmp_name)
   split_lines = []
   for line in lines[header_line + 1:]:
     match = _DISASM_LINE_RE.match(line)
@@ -91,3 +227,12 @@ def GetDisasmLines(filename, offset, size, arch, inplace, arch_flags=""):
       line_address = int(match.group(1), 16)
       split_lines.append((line_address, match.group(2)))
   return split_lines
+
+
+def _SliceLines(lines, ranges):
+  """Splits |lines|, sorted by address, into the lines of each of |ranges|,
+  a list of (address, size) tuples."""
+  addresses = [ address for (address, _) in lines ]
+  return [ lines[bisect.bisect_left(addresses, start):
+                 bisect.bisect_left(addresses, start + size)]
+           for (start, size) in ranges ]
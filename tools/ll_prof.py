@@ -27,18 +27,30 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import array
 import bisect
 import collections
 import ctypes
 import disasm
+import gzip
+import hashlib
+import heapq
+import itertools
 import mmap
+import multiprocessing
 import optparse
 import os
 import re
+import struct
 import subprocess
 import sys
 import time
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 
 USAGE="""usage: %prog [OPTION]...
 
@@ -75,12 +87,26 @@ Examples:
 
   # Print flat profile. Use custom log names.
   $ %prog --log=foo.log --snapshot-log=snap-foo.log --trace=foo.data --snapshot
+
+  # Print the symbols whose share of the ticks changed the most since a
+  # baseline run, e.g. before a change to V8.
+  $ %prog --baseline-log=before.log --baseline-trace=before.data
 """
 
 
 JS_ORIGIN = "js"
 JS_SNAPSHOT_ORIGIN = "js-snapshot"
 
+# Arrays of addresses need 64 bits, lists are used where "L" has less.
+ADDRESS_TYPECODE = "L" if array.array("L").itemsize >= 8 else None
+
+
+def _AddressArray(addresses=()):
+  if ADDRESS_TYPECODE is None:
+    return list(addresses)
+  return array.array(ADDRESS_TYPECODE, addresses)
+
+
 class Code(object):
   """Code object."""
 
@@ -90,9 +116,11 @@ class Code(object):
   FULL_CODEGEN = 2
   OPTIMIZED = 3
 
-  def __init__(self, name, start_address, end_address, origin, origin_offset):
-    self.id = Code._id
-    Code._id += 1
+  def __init__(self, name, start_address, end_address, origin, origin_offset,
+               id=None):
+    if id is None:
+      id = Code.NewId()
+    self.id = id
     self.name = name
     self.other_names = None
     self.start_address = start_address
@@ -111,6 +139,12 @@ class Code(object):
     else:
       self.codetype = Code.UNKNOWN
 
+  @staticmethod
+  def NewId():
+    id = Code._id
+    Code._id += 1
+    return id
+
   def AddName(self, name):
     assert self.name != name
     if self.other_names is None:
@@ -128,19 +162,23 @@ class Code(object):
   def IsUsed(self):
     return self.self_ticks > 0 or self.callee_ticks is not None
 
-  def Tick(self, pc):
-    self.self_ticks += 1
+  def Tick(self, pc, count=1):
+    self.AddTicks(pc - self.start_address, count)
+
+  def AddTicks(self, offset, count):
+    self.self_ticks += count
     if self.self_ticks_map is None:
       self.self_ticks_map = collections.defaultdict(lambda: 0)
-    offset = pc - self.start_address
-    self.self_ticks_map[offset] += 1
+    self.self_ticks_map[offset] += count
 
-  def CalleeTick(self, callee):
+  def CalleeTick(self, callee, count=1):
     if self.callee_ticks is None:
       self.callee_ticks = collections.defaultdict(lambda: 0)
-    self.callee_ticks[callee] += 1
+    self.callee_ticks[callee] += count
 
-  def PrintAnnotated(self, arch, options):
+  def PrintAnnotated(self, lines):
+    """Prints |lines|, the disassembled lines of the code, with the share of
+    its ticks at each, see CodeDisassembler."""
     if self.self_ticks_map is None:
       ticks_map = []
     else:
@@ -150,8 +188,6 @@ class Code(object):
     ticks_map.sort(key=lambda t: t[0])
     ticks_offsets = [t[0] for t in ticks_map]
     ticks_counts = [t[1] for t in ticks_map]
-    # Get a list of disassembled lines and their addresses.
-    lines = self._GetDisasmLines(arch, options)
     if len(lines) == 0:
       return
     # Print annotated lines.
@@ -166,14 +202,13 @@ class Code(object):
       # Ticks (reported pc values) are not always precise, i.e. not
       # necessarily point at instruction starts. So we have to search
       # for ticks that touch the current instruction line.
-      j = bisect.bisect_left(ticks_offsets, end_offset)
-      count = 0
-      for offset, cnt in reversed(zip(ticks_offsets[:j], ticks_counts[:j])):
-        if offset < start_offset:
-          break
-        count += cnt
+      count = sum(ticks_counts[
+          bisect.bisect_left(ticks_offsets, start_offset):
+          bisect.bisect_left(ticks_offsets, end_offset)])
       total_count += count
-      count = 100.0 * count / self.self_ticks
+      if count:
+        # Code with callee ticks only has no ticks to share.
+        count = 100.0 * count / self.self_ticks
       if count >= 0.01:
         print "%15.2f %x: %s" % (count, lines[i][0], lines[i][1])
       else:
@@ -190,126 +225,353 @@ class Code(object):
       self.end_address - self.start_address,
       self.origin)
 
-  def _GetDisasmLines(self, arch, options):
-    if self.origin == JS_ORIGIN or self.origin == JS_SNAPSHOT_ORIGIN:
-      inplace = False
-      filename = options.log + ".ll"
-    else:
-      inplace = True
-      filename = self.origin
-    return disasm.GetDisasmLines(filename,
-                                 self.origin_offset,
-                                 self.end_address - self.start_address,
-                                 arch,
-                                 inplace)
-
-
-class CodePage(object):
-  """Group of adjacent code objects."""
-
-  SHIFT = 20  # 1M pages
-  SIZE = (1 << SHIFT)
-  MASK = ~(SIZE - 1)
-
-  @staticmethod
-  def PageAddress(address):
-    return address & CodePage.MASK
-
-  @staticmethod
-  def PageId(address):
-    return address >> CodePage.SHIFT
-
-  @staticmethod
-  def PageAddressFromId(id):
-    return id << CodePage.SHIFT
-
-  def __init__(self, address):
-    self.address = address
-    self.code_objects = []
-
-  def Add(self, code):
-    self.code_objects.append(code)
-
-  def Remove(self, code):
-    self.code_objects.remove(code)
-
-  def Find(self, pc):
-    code_objects = self.code_objects
-    for i, code in enumerate(code_objects):
-      if code.start_address <= pc < code.end_address:
-        code_objects[0], code_objects[i] = code, code_objects[0]
-        return code
-    return None
-
-  def __iter__(self):
-    return self.code_objects.__iter__()
-
 
 class CodeMap(object):
-  """Code object map."""
+  """Code object map.
+
+  Code is kept as records in parallel arrays: the start and end addresses,
+  the end of the addresses it is found at and the id of its code object.
+  Code added with AddRecord(), e.g. by the log reader, costs little more
+  than that, as its code object is only made once it is needed, see
+  GetCode(). The records of removed code are reused.
+
+  Lookups bisect a sorted array of disjoint address ranges, each mapped to
+  the innermost (latest starting) record covering it. The array is rebuilt
+  lazily, so that all changes made between two batches of lookups, e.g.
+  while reading the code log up to the next GC, cost one rebuild. Until
+  then, code added since the last rebuild is kept in a sorted array of its
+  own and removed code is remembered by record. As long as no code
+  overlaps, a rebuild only applies these changes to the index.
+  """
+
+  # Rebuild once the code added since the last rebuild outnumbers the
+  # ranges in the index and this.
+  MIN_ADDED_BEFORE_REBUILD = 1024
+
+  # States of records.
+  _FREE = 0
+  _LIVE = 1
+  _REMOVED = 2  # Not reused while the index or pinned ranges refer to it.
 
   def __init__(self):
-    self.pages = {}
+    self.starts = _AddressArray()
+    self.ends = _AddressArray()
+    self.limits = _AddressArray()
+    self.ids = array.array("l")  # Ids of the code objects, in order added.
+    self.keys = array.array("l")  # Passed to the sources of the records.
+    self.sources = []  # See AddRecord(), None for code added with Add().
+    self.states = bytearray()
+    self.free = []
+    self.count = 0  # Live records.
+    # Record -> code object, for the ones made. Kept for removed records
+    # until they are reused.
+    self.code_objects = {}
+    self.freed_used_code = []  # Used code objects of reused records.
+    self.range_starts = _AddressArray()
+    self.range_ends = _AddressArray()
+    self.range_records = array.array("l")
+    self.range_shadows = bytearray()  # Whether a range hides other code.
+    self.index_shadows = False  # Whether any range does.
+    self.added_starts = _AddressArray()
+    self.added_records = array.array("l")
+    self.added_overlap = False
+    self.removed = {}  # Record -> start address when it left the index.
+    self.pins = collections.deque()  # Generations of pinned ranges.
+    self.retired = collections.deque()  # (Generation, record) of removed.
+    self.generation = 0
     self.min_address = 1 << 64
     self.max_address = -1
 
-  def Add(self, code, max_pages=-1):
-    page_id = CodePage.PageId(code.start_address)
-    limit_id = CodePage.PageId(code.end_address + CodePage.SIZE - 1)
-    pages = 0
-    while page_id < limit_id:
-      if max_pages >= 0 and pages > max_pages:
-        print >>sys.stderr, \
-            "Warning: page limit (%d) reached for %s [%s]" % (
-            max_pages, code.name, code.origin)
-        break
-      if page_id in self.pages:
-        page = self.pages[page_id]
-      else:
-        page = CodePage(CodePage.PageAddressFromId(page_id))
-        self.pages[page_id] = page
-      page.Add(code)
-      page_id += 1
-      pages += 1
-    self.min_address = min(self.min_address, code.start_address)
-    self.max_address = max(self.max_address, code.end_address)
-
-  def Remove(self, code):
-    page_id = CodePage.PageId(code.start_address)
-    limit_id = CodePage.PageId(code.end_address + CodePage.SIZE - 1)
-    removed = False
-    while page_id < limit_id:
-      if page_id not in self.pages:
-        page_id += 1
-        continue
-      page = self.pages[page_id]
-      page.Remove(code)
-      removed = True
-      page_id += 1
-    return removed
+  def Add(self, code, max_size=None):
+    """Adds a code object and returns its record."""
+    limit = code.end_address
+    if (max_size is not None and
+        code.end_address - code.start_address > max_size):
+      print >>sys.stderr, \
+          "Warning: size limit (%d) reached for %s [%s]" % (
+          max_size, code.name, code.origin)
+      limit = code.start_address + max_size
+    record = self._NewRecord(code.start_address, code.end_address, limit,
+                             code.id, None, 0)
+    self.code_objects[record] = code
+    return record
+
+  def AddRecord(self, start_address, end_address, source, key):
+    """Adds code without making its code object and returns its record.
+    The object is made by |source|.MakeCode(key, start_address, end_address,
+    id) when needed, and |source|.CodeName(key) returns its name."""
+    return self._NewRecord(start_address, end_address, end_address,
+                           Code.NewId(), source, key)
+
+  def Remove(self, record):
+    if self.states[record] != CodeMap._LIVE:
+      return False
+    self.states[record] = CodeMap._REMOVED
+    self.count -= 1
+    self._Unadd(record)
+    return True
+
+  def Move(self, record, start_address):
+    """Moves the code of |record| to |start_address|."""
+    self._Unadd(record)
+    delta = start_address - self.starts[record]
+    self.starts[record] = start_address
+    self.ends[record] += delta
+    self.limits[record] += delta
+    code = self.code_objects.get(record)
+    if code is not None:
+      code.start_address = start_address
+      code.end_address = self.ends[record]
+    self._Add(record)
+
+  def GetCode(self, record):
+    """Returns the code object of |record|, making it if needed."""
+    code = self.code_objects.get(record)
+    if code is None:
+      code = self._MakeCode(record)
+      self.code_objects[record] = code
+    return code
+
+  def GetName(self, record):
+    code = self.code_objects.get(record)
+    if code is not None:
+      return code.name
+    return self.sources[record].CodeName(self.keys[record])
+
+  def CodeCount(self):
+    return self.count
 
   def AllCode(self):
-    for page in self.pages.itervalues():
-      for code in page:
-        if CodePage.PageAddress(code.start_address) == page.address:
-          yield code
+    """Yields the code objects of all code. Those not made yet are made
+    anew each time."""
+    for record in xrange(len(self.states)):
+      if self.states[record] == CodeMap._LIVE:
+        code = self.code_objects.get(record)
+        yield code if code is not None else self._MakeCode(record)
 
   def UsedCode(self):
-    for code in self.AllCode():
-      if code.IsUsed():
+    # Code gets used through its code object.
+    for (record, code) in self.code_objects.iteritems():
+      if self.states[record] == CodeMap._LIVE and code.IsUsed():
+        yield code
+
+  def RemovedUsedCode(self):
+    """Yields the used code objects of removed code."""
+    for code in self.freed_used_code:
+      yield code
+    for (record, code) in self.code_objects.iteritems():
+      if self.states[record] != CodeMap._LIVE and code.IsUsed():
         yield code
 
   def Print(self):
     for code in self.AllCode():
       print code
 
+  def GetIndex(self):
+    """Returns the start and end addresses of the disjoint address ranges of
+    the code in the map, sorted, and the record for each."""
+    if self.added_starts or self.removed:
+      self._Rebuild()
+    return (self.range_starts, self.range_ends, self.range_records)
+
+  def Pin(self):
+    """Keeps the records in the index from being reused for other code until
+    the matching Unpin(). Pins are released in the order they are taken."""
+    self.generation += 1
+    self.pins.append(self.generation)
+
+  def Unpin(self):
+    self.pins.popleft()
+    while self.retired and (not self.pins or
+                            self.retired[0][0] < self.pins[0]):
+      self._Free(self.retired.popleft()[1])
+
   def Find(self, pc):
-    if pc < self.min_address or pc >= self.max_address:
+    record = self.FindRecord(pc)
+    if record is None:
       return None
-    page_id = CodePage.PageId(pc)
-    if page_id not in self.pages:
+    return self.GetCode(record)
+
+  def FindRecord(self, pc):
+    if pc < self.min_address or pc >= self.max_address:
       return None
-    return self.pages[page_id].Find(pc)
+    if (self.added_overlap or
+        len(self.added_starts) > max(len(self.range_starts),
+                                     CodeMap.MIN_ADDED_BEFORE_REBUILD)):
+      self._Rebuild()
+    record = None
+    i = bisect.bisect_right(self.range_starts, pc) - 1
+    if i >= 0 and pc < self.range_ends[i]:
+      record = self.range_records[i]
+      if record in self.removed:
+        if self.range_shadows[i]:
+          # Code hidden by the removed code may cover |pc|.
+          self._Rebuild()
+          return self.FindRecord(pc)
+        record = None
+    # Code added since the last rebuild doesn't overlap, so only the last
+    # one starting at or before |pc| can cover it.
+    i = bisect.bisect_right(self.added_starts, pc) - 1
+    if i >= 0:
+      added = self.added_records[i]
+      if (pc < self.limits[added] and
+          (record is None or (self.starts[added], self.ids[added]) >
+                             (self.starts[record], self.ids[record]))):
+        record = added
+    return record
+
+  def _NewRecord(self, start_address, end_address, limit, id, source, key):
+    if self.free:
+      record = self.free.pop()
+      self.starts[record] = start_address
+      self.ends[record] = end_address
+      self.limits[record] = limit
+      self.ids[record] = id
+      self.keys[record] = key
+      self.sources[record] = source
+    else:
+      record = len(self.states)
+      self.starts.append(start_address)
+      self.ends.append(end_address)
+      self.limits.append(limit)
+      self.ids.append(id)
+      self.keys.append(key)
+      self.sources.append(source)
+      self.states.append(CodeMap._FREE)
+    self.states[record] = CodeMap._LIVE
+    self.count += 1
+    self._Add(record)
+    return record
+
+  def _Add(self, record):
+    start = self.starts[record]
+    limit = self.limits[record]
+    i = bisect.bisect_right(self.added_starts, start)
+    if ((i > 0 and self.limits[self.added_records[i - 1]] > start) or
+        (i < len(self.added_starts) and self.added_starts[i] < limit)):
+      self.added_overlap = True
+    self.added_starts.insert(i, start)
+    self.added_records.insert(i, record)
+    self.min_address = min(self.min_address, start)
+    self.max_address = max(self.max_address, limit)
+
+  def _Unadd(self, record):
+    start = self.starts[record]
+    i = bisect.bisect_left(self.added_starts, start)
+    while i < len(self.added_starts) and self.added_starts[i] == start:
+      if self.added_records[i] == record:
+        del self.added_starts[i]
+        del self.added_records[i]
+        break
+      i += 1
+    # The record may also have been added before the last rebuild.
+    self.removed.setdefault(record, start)
+
+  def _MakeCode(self, record):
+    return self.sources[record].MakeCode(self.keys[record],
+                                         self.starts[record],
+                                         self.ends[record],
+                                         self.ids[record])
+
+  def _Free(self, record):
+    self.states[record] = CodeMap._FREE
+    self.sources[record] = None
+    code = self.code_objects.pop(record, None)
+    if code is not None and code.IsUsed():
+      self.freed_used_code.append(code)
+    self.free.append(record)
+
+  def _Rebuild(self):
+    if not (self.index_shadows or self.added_overlap) and self._Merge():
+      return
+    starts = self.starts
+    limits = self.limits
+    ids = self.ids
+    records = [ record for record in xrange(len(self.states))
+                if self.states[record] == CodeMap._LIVE ]
+    records.sort(key=lambda record: (starts[record], ids[record]))
+    boundaries = set(starts[record] for record in records)
+    boundaries.update(limits[record] for record in records)
+    boundaries = sorted(boundaries)
+    range_starts = []
+    range_ends = []
+    range_records = []
+    range_shadows = []
+    # Sweep over the boundaries with a heap of the records covering the
+    # current one, innermost first. Code that ended below the top of the
+    # heap is only dropped once it reaches the top, so shadowing is
+    # overestimated at times.
+    covering = []
+    next_record = 0
+    for i in xrange(len(boundaries) - 1):
+      address = boundaries[i]
+      while (next_record < len(records) and
+             starts[records[next_record]] <= address):
+        record = records[next_record]
+        heapq.heappush(covering, (-starts[record], -ids[record], record))
+        next_record += 1
+      while covering and limits[covering[0][2]] <= address:
+        heapq.heappop(covering)
+      if not covering:
+        continue
+      record = covering[0][2]
+      shadows = len(covering) > 1
+      if (range_records and range_records[-1] == record and
+          range_ends[-1] == address):
+        range_ends[-1] = boundaries[i + 1]
+        range_shadows[-1] = range_shadows[-1] or shadows
+        continue
+      range_starts.append(address)
+      range_ends.append(boundaries[i + 1])
+      range_records.append(record)
+      range_shadows.append(shadows)
+    self.range_starts = _AddressArray(range_starts)
+    self.range_ends = _AddressArray(range_ends)
+    self.range_records = array.array("l", range_records)
+    self.range_shadows = bytearray(range_shadows)
+    self.index_shadows = any(range_shadows)
+    self._ClearChanges()
+
+  def _Merge(self):
+    """Updates the index in place with the changes since the last rebuild,
+    which is only possible if no code overlaps. Returns whether that was
+    the case."""
+    for (record, start) in self.removed.iteritems():
+      i = bisect.bisect_left(self.range_starts, start)
+      if (i < len(self.range_starts) and
+          self.range_records[i] == record):
+        del self.range_starts[i]
+        del self.range_ends[i]
+        del self.range_records[i]
+        del self.range_shadows[i]
+    for record in self.added_records:
+      start = self.starts[record]
+      end = self.limits[record]
+      if end == start:
+        continue
+      i = bisect.bisect_left(self.range_starts, start)
+      if ((i > 0 and self.range_ends[i - 1] > start) or
+          (i < len(self.range_starts) and self.range_starts[i] < end)):
+        return False
+      self.range_starts.insert(i, start)
+      self.range_ends.insert(i, end)
+      self.range_records.insert(i, record)
+      self.range_shadows.insert(i, False)
+    self._ClearChanges()
+    return True
+
+  def _ClearChanges(self):
+    for record in self.removed:
+      if self.states[record] != CodeMap._REMOVED:
+        continue  # Moved.
+      if self.pins:
+        self.retired.append((self.generation, record))
+      else:
+        self._Free(record)
+    self.added_starts = _AddressArray()
+    self.added_records = array.array("l")
+    self.added_overlap = False
+    self.removed = {}
 
 
 class CodeInfo(object):
@@ -345,7 +607,12 @@ class SnapshotLogReader(object):
 
 
 class LogReader(object):
-  """V8 low-level (binary) log reader."""
+  """V8 low-level (binary) log reader.
+
+  Created code is added to the code map as records of the events creating
+  it, see MakeCode(), so that its name is only read from the log when it
+  is needed.
+  """
 
   _ARCH_TO_POINTER_TYPE_MAP = {
     "ia32": ctypes.c_uint32,
@@ -367,6 +634,7 @@ class LogReader(object):
     self.code_map = code_map
     self.snapshot_pos_to_name = snapshot_pos_to_name
     self.address_to_snapshot_name = {}
+    self.snapshot_names = {}  # Event position -> name of snapshot code.
 
     self.arch = self.log[:self.log.find("\0")]
     self.log_pos += len(self.arch) + 1
@@ -400,33 +668,30 @@ class LogReader(object):
         return
 
       if tag == LogReader._CODE_CREATE_TAG:
-        event = self.code_create_struct.from_buffer(self.log, self.log_pos)
-        self.log_pos += ctypes.sizeof(event)
+        key = self.log_pos
+        event = self.code_create_struct.from_buffer(self.log, key)
+        self.log_pos += ctypes.sizeof(event) + event.name_size + \
+            event.code_size
         start_address = event.code_address
         end_address = start_address + event.code_size
-        if start_address in self.address_to_snapshot_name:
-          name = self.address_to_snapshot_name[start_address]
-          origin = JS_SNAPSHOT_ORIGIN
-        else:
-          name = self.log[self.log_pos:self.log_pos + event.name_size]
-          origin = JS_ORIGIN
-        self.log_pos += event.name_size
-        origin_offset = self.log_pos
-        self.log_pos += event.code_size
-        code = Code(name, start_address, end_address, origin, origin_offset)
-        conficting_code = self.code_map.Find(start_address)
-        if conficting_code:
-          if not (conficting_code.start_address == code.start_address and
-            conficting_code.end_address == code.end_address):
-            self.code_map.Remove(conficting_code)
+        snapshot_name = self.address_to_snapshot_name.get(start_address)
+        conficting_record = self.code_map.FindRecord(start_address)
+        if conficting_record is not None:
+          if not (self.code_map.starts[conficting_record] == start_address and
+                  self.code_map.ends[conficting_record] == end_address):
+            self.code_map.Remove(conficting_record)
           else:
-            LogReader._HandleCodeConflict(conficting_code, code)
+            if snapshot_name is None:
+              snapshot_name = self._ReadName(key)
+            self._HandleCodeConflict(conficting_record, snapshot_name)
             # TODO(vitalyr): this warning is too noisy because of our
             # attempts to reconstruct code log from the snapshot.
             # print >>sys.stderr, \
             #     "Warning: Skipping duplicate code log entry %s" % code
             continue
-        self.code_map.Add(code)
+        if snapshot_name is not None:
+          self.snapshot_names[key] = snapshot_name
+        self.code_map.AddRecord(start_address, end_address, self, key)
         continue
 
       if tag == LogReader._CODE_MOVE_TAG:
@@ -437,30 +702,28 @@ class LogReader(object):
         if old_start_address == new_start_address:
           # Skip useless code move entries.
           continue
-        code = self.code_map.Find(old_start_address)
-        if not code:
+        record = self.code_map.FindRecord(old_start_address)
+        if record is None:
           print >>sys.stderr, "Warning: Not found %x" % old_start_address
           continue
-        assert code.start_address == old_start_address, \
-            "Inexact move address %x for %s" % (old_start_address, code)
-        self.code_map.Remove(code)
-        size = code.end_address - code.start_address
-        code.start_address = new_start_address
-        code.end_address = new_start_address + size
-        self.code_map.Add(code)
+        assert self.code_map.starts[record] == old_start_address, \
+            "Inexact move address %x for %s" % (
+            old_start_address, self.code_map.GetCode(record))
+        self.code_map.Move(record, new_start_address)
         continue
 
       if tag == LogReader._CODE_DELETE_TAG:
         event = self.code_delete_struct.from_buffer(self.log, self.log_pos)
         self.log_pos += ctypes.sizeof(event)
         old_start_address = event.address
-        code = self.code_map.Find(old_start_address)
-        if not code:
+        record = self.code_map.FindRecord(old_start_address)
+        if record is None:
           print >>sys.stderr, "Warning: Not found %x" % old_start_address
           continue
-        assert code.start_address == old_start_address, \
-            "Inexact delete address %x for %s" % (old_start_address, code)
-        self.code_map.Remove(code)
+        assert self.code_map.starts[record] == old_start_address, \
+            "Inexact delete address %x for %s" % (
+            old_start_address, self.code_map.GetCode(record))
+        self.code_map.Remove(record)
         continue
 
       if tag == LogReader._SNAPSHOT_POSITION_TAG:
@@ -476,27 +739,51 @@ class LogReader(object):
 
       assert False, "Unknown tag %s" % tag
 
+  def MakeCode(self, key, start_address, end_address, id):
+    """Makes the code object of the code created by the event at |key|, see
+    CodeMap.AddRecord()."""
+    name = self.snapshot_names.get(key)
+    origin = JS_SNAPSHOT_ORIGIN
+    if name is None:
+      name = self._ReadName(key)
+      origin = JS_ORIGIN
+    event = self.code_create_struct.from_buffer(self.log, key)
+    origin_offset = key + ctypes.sizeof(event) + event.name_size
+    return Code(name, start_address, end_address, origin, origin_offset, id)
+
+  def CodeName(self, key):
+    name = self.snapshot_names.get(key)
+    if name is None:
+      name = self._ReadName(key)
+    return name
+
+  def ReadCode(self, origin_offset, size):
+    """Returns the instructions of generated code logged at |origin_offset|,
+    see MakeCode()."""
+    return self.log[origin_offset:origin_offset + size]
+
   def Dispose(self):
     self.log.close()
     self.log_file.close()
 
+  def _ReadName(self, key):
+    event = self.code_create_struct.from_buffer(self.log, key)
+    name_offset = key + ctypes.sizeof(event)
+    return self.log[name_offset:name_offset + event.name_size]
+
+  def _HandleCodeConflict(self, record, name):
+    if self.code_map.GetName(record) == name:
+      return
+    # Code object may be shared by a few functions. Collect the full
+    # set of names.
+    self.code_map.GetCode(record).AddName(name)
+
   @staticmethod
   def _DefineStruct(fields):
     class Struct(ctypes.Structure):
       _fields_ = fields
     return Struct
 
-  @staticmethod
-  def _HandleCodeConflict(old_code, new_code):
-    assert (old_code.start_address == new_code.start_address and
-            old_code.end_address == new_code.end_address), \
-        "Conficting code log entries %s and %s" % (old_code, new_code)
-    if old_code.name == new_code.name:
-      return
-    # Code object may be shared by a few functions. Collect the full
-    # set of names.
-    old_code.AddName(new_code.name)
-
 
 class Descriptor(object):
   """Descriptor of a structure in the binary trace log."""
@@ -617,11 +904,16 @@ PERF_SAMPLE_EVENT_IP_FORMAT = "u64"
 PERF_RECORD_MMAP = 1
 PERF_RECORD_SAMPLE = 9
 
+# Callchains mark where their kernel and user parts start with values from
+# this up.
+PERF_CONTEXT_MAX = (1 << 64) - 4095
+
 
 class TraceReader(object):
   """Perf (linux-2.6/tools/perf) trace file reader."""
 
   _TRACE_HEADER_MAGIC = 4993446653023372624
+  _EVENT_TYPE_AND_SIZE = struct.Struct("=I2xH")
 
   def __init__(self, trace_name):
     self.trace_file = open(trace_name, "r")
@@ -645,6 +937,75 @@ class TraceReader(object):
     if self.callchain_supported:
       self.ip_struct = Descriptor.CTYPE_MAP[PERF_SAMPLE_EVENT_IP_FORMAT]
       self.ip_size = ctypes.sizeof(self.ip_struct)
+    self.words = None
+    self.sample_runs = None
+    self.sample_offsets = None
+    if numpy is not None:
+      self._IndexEvents()
+
+  def _IndexEvents(self):
+    """Scans the event headers once to find the sample events, so that runs
+    of them can be decoded at once by ReadSamples(). Leaves self.words
+    unset if the trace doesn't allow that."""
+    sample_body = self.sample_event_body_desc.ctype
+    if (not hasattr(sample_body, "ip") or self.offset % 8 != 0 or
+        self.header_size % 8 != 0):
+      return
+    sample_offsets = []
+    # The offset of the first event of each run of sample events -> the
+    # range of the run in sample_offsets and the offset of the next event.
+    sample_runs = {}
+    run_start = None
+    offset = self.offset
+    while offset < self.limit:
+      (type, size) = TraceReader._EVENT_TYPE_AND_SIZE.unpack_from(
+          self.trace, offset)
+      if size == 0 or size % 8 != 0:
+        return
+      if type == PERF_RECORD_SAMPLE:
+        if run_start is None:
+          (run_start, run_first) = (offset, len(sample_offsets))
+        sample_offsets.append(offset)
+      elif run_start is not None:
+        sample_runs[run_start] = (run_first, len(sample_offsets), offset)
+        run_start = None
+      offset += size
+    if run_start is not None:
+      sample_runs[run_start] = (run_first, len(sample_offsets), self.limit)
+    self.sample_runs = sample_runs
+    self.sample_offsets = numpy.array(sample_offsets, dtype=numpy.int64)
+    self.words = numpy.frombuffer(self.trace, dtype=numpy.uint64,
+                                  count=self.trace.size() // 8)
+
+  def ReadSampleRun(self, offset):
+    """Skips the run of sample events starting at |offset|. Returns the range
+    [first, end) of their indices for DecodeSamples(), or None if the trace
+    can't be decoded like this."""
+    if self.words is None:
+      return None
+    (first, end, self.offset) = self.sample_runs[offset]
+    return (first, end)
+
+  def DecodeSamples(self, first, end):
+    """Decodes the sample events with indices in [first, end) without
+    creating an object per event. Returns the pcs of the samples, the
+    lengths of their callchains, and the concatenated callchains as NumPy
+    arrays."""
+    words = self.words
+    sample_body = self.sample_event_body_desc.ctype
+    # Offsets of the sample bodies in 64-bit words.
+    bodies = (self.sample_offsets[first:end] + self.header_size) // 8
+    pcs = words[bodies + sample_body.ip.offset // 8]
+    if not self.callchain_supported:
+      return (pcs, None, None)
+    lengths = words[bodies + sample_body.nr.offset // 8].astype(numpy.int64)
+    # The callchain follows the body, gather it for all samples at once.
+    chain_starts = bodies + ctypes.sizeof(sample_body) // 8
+    total = int(lengths.sum())
+    run_offsets = numpy.cumsum(lengths) - lengths
+    chain_words = (numpy.repeat(chain_starts - run_offsets, lengths) +
+                   numpy.arange(total))
+    return (pcs, lengths, words[chain_words])
 
   def ReadEventHeader(self):
     if self.offset >= self.limit:
@@ -677,6 +1038,8 @@ class TraceReader(object):
     return sample
 
   def Dispose(self):
+    # Views of the mmap must not outlive it.
+    self.words = None
     self.trace.close()
     self.trace_file.close()
 
@@ -689,26 +1052,315 @@ class TraceReader(object):
     return Descriptor(fields)
 
 
-OBJDUMP_SECTION_HEADER_RE = re.compile(
-  r"^\s*\d+\s(\.\S+)\s+[a-f0-9]")
-OBJDUMP_SYMBOL_LINE_RE = re.compile(
-  r"^([a-f0-9]+)\s(.{7})\s(\S+)\s+([a-f0-9]+)\s+(?:\.hidden\s+)?(.*)$")
-OBJDUMP_DYNAMIC_SYMBOLS_START_RE = re.compile(
-  r"^DYNAMIC SYMBOL TABLE")
 OBJDUMP_SKIP_RE = re.compile(
   r"^.*ld\.so\.cache$")
+CXXFILT_BIN = "c++filt"
 KERNEL_ALLSYMS_FILE = "/proc/kallsyms"
 PERF_KERNEL_ALLSYMS_RE = re.compile(
   r".*kallsyms.*")
 KERNEL_ALLSYMS_LINE_RE = re.compile(
-  r"^([a-f0-9]+)\s(?:t|T)\s(\S+)$")
+  r"^([a-f0-9]+)\s(?:t|T)\s(\S+)$", re.MULTILINE)
+# Kernel symbols extend up to the next one, which can be far away.
+KERNEL_SYMBOL_MAX_SIZE = 16 << 20
+
+
+# Reference: /usr/include/elf.h
+ELF_MAGIC = "\x7fELF"
+ELF_CLASS_64 = "\x02"
+ELF_DATA_LSB = "\x01"
+ELF_ET_REL = 1
+ELF_PT_NOTE = 4
+ELF_SHT_SYMTAB = 2
+ELF_SHT_DYNSYM = 11
+ELF_SHF_EXECINSTR = 0x4
+ELF_SHN_LORESERVE = 0xff00
+ELF_STT_SECTION = 3
+ELF_STT_FILE = 4
+ELF_NT_GNU_BUILD_ID = 3
+
+
+class ElfFile(object):
+  """Reads the section headers, symbol tables and build id of an ELF file
+  directly from a mapping of it.
+
+  Raises ValueError if the file isn't a valid ELF file.
+  """
+
+  def __init__(self, filename):
+    with open(filename, "rb") as f:
+      self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      if self.data[:4] != ELF_MAGIC:
+        raise ValueError("%s is not an ELF file" % filename)
+      self.endian = "<" if self.data[5] == ELF_DATA_LSB else ">"
+      (self.type,) = self._Unpack("H", 16)
+      if self.data[4] == ELF_CLASS_64:
+        (self.phoff, self.shoff) = self._Unpack("QQ", 32)
+        (self.phentsize, self.phnum, self.shentsize, self.shnum,
+         self.shstrndx) = self._Unpack("HHHHH", 54)
+        # p_type, p_offset, p_filesz.
+        self.program_header_format = "I4xQ16xQ"
+        # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link,
+        # sh_info, sh_addralign, sh_entsize.
+        self.section_header_format = "IIQQQQIIQQ"
+        # st_name, st_info, st_other, st_shndx, st_value, st_size.
+        self.symbol_format = "IBBHQQ"
+        # Name, value, size, info and section index fields.
+        self.symbol_fields = (0, 4, 5, 1, 3)
+      else:
+        (self.phoff, self.shoff) = self._Unpack("II", 28)
+        (self.phentsize, self.phnum, self.shentsize, self.shnum,
+         self.shstrndx) = self._Unpack("HHHHH", 42)
+        self.program_header_format = "II8xI"
+        self.section_header_format = "IIIIIIIIII"
+        # st_name, st_value, st_size, st_info, st_other, st_shndx.
+        self.symbol_format = "IIIBBH"
+        self.symbol_fields = (0, 1, 2, 3, 5)
+      self.sections = self._ReadSectionHeaders()
+    except struct.error:
+      self.Dispose()
+      raise ValueError("%s is truncated" % filename)
+    except:
+      self.Dispose()
+      raise
+
+  def CodeSymbols(self, dynamic=True):
+    """Returns the symbols in code sections as a list of (offset, size, name,
+    relative) tuples, the absolute ones first, each sorted by offset.
+    Relative symbols need the address of the mapping added to their offset:
+    those of the dynamic symbol table (only read if |dynamic|) and of
+    relocatable files."""
+    code_sections = set(i for (i, section) in enumerate(self.sections)
+                        if section[2] & ELF_SHF_EXECINSTR)
+    symbols = []
+    for section in self.sections:
+      if section[1] == ELF_SHT_SYMTAB:
+        relative = self.type == ELF_ET_REL
+      elif section[1] == ELF_SHT_DYNSYM and dynamic:
+        relative = True
+      else:
+        continue
+      symbols.extend(self._ReadSymbols(section, code_sections, relative))
+    # Keep symbols at the same address in table order, the last one wins.
+    symbols.sort(key=lambda s: (s[3], s[0]))
+    return symbols
+
+  def BuildId(self):
+    """Returns the GNU build id as a hex string, or None."""
+    try:
+      for i in xrange(self.phnum):
+        (type, offset, size) = self._Unpack(self.program_header_format,
+                                            self.phoff + i * self.phentsize)
+        if type != ELF_PT_NOTE:
+          continue
+        end = offset + size
+        while offset + 12 <= end:
+          (namesz, descsz, note_type) = self._Unpack("III", offset)
+          name_offset = offset + 12
+          desc_offset = name_offset + ((namesz + 3) & ~3)
+          if (note_type == ELF_NT_GNU_BUILD_ID and
+              self.data[name_offset:name_offset + namesz] == "GNU\0"):
+            return self.data[desc_offset:desc_offset + descsz].encode("hex")
+          offset = desc_offset + ((descsz + 3) & ~3)
+    except struct.error:
+      pass
+    return None
+
+  def Dispose(self):
+    self.data.close()
+
+  def _ReadSectionHeaders(self):
+    if self.shoff == 0:
+      return []
+    count = self.shnum
+    if count == 0:
+      # More sections than fit the header, their number is in the size of
+      # the first section header.
+      count = self._Unpack(self.section_header_format, self.shoff)[5]
+    return [ self._Unpack(self.section_header_format,
+                          self.shoff + i * self.shentsize)
+             for i in xrange(count) ]
+
+  def _ReadSymbols(self, section, code_sections, relative):
+    (offset, size, link, entsize) = (section[4], section[5], section[6],
+                                     section[9])
+    if entsize == 0 or link >= len(self.sections):
+      return []
+    strings = self.sections[link][4]
+    count = size // entsize
+    field_count = len(self.symbol_format)
+    if entsize == struct.calcsize("=" + self.symbol_format):
+      # Unpack the whole table at once.
+      fields = self._Unpack(self.symbol_format * count, offset)
+    else:
+      fields = []
+      for i in xrange(count):
+        fields.extend(self._Unpack(self.symbol_format, offset + i * entsize))
+    (name_field, value_field, size_field, info_field,
+     shndx_field) = self.symbol_fields
+    data = self.data
+    symbols = []
+    for i in xrange(0, count * field_count, field_count):
+      shndx = fields[i + shndx_field]
+      if shndx >= ELF_SHN_LORESERVE or shndx not in code_sections:
+        continue
+      if fields[i + info_field] & 0xf in (ELF_STT_SECTION, ELF_STT_FILE):
+        continue
+      name = strings + fields[i + name_field]
+      symbols.append((fields[i + value_field], fields[i + size_field],
+                      data[name:data.find("\0", name)], relative))
+    return symbols
+
+  def _Unpack(self, format, offset):
+    return struct.unpack_from(self.endian + format, self.data, offset)
+
+def ReadElfBuildId(filename):
+  """Returns the GNU build id of the ELF file |filename| as a hex string, or
+  None if it doesn't have one."""
+  try:
+    elf = ElfFile(filename)
+  except (IOError, mmap.error, ValueError):
+    return None
+  try:
+    return elf.BuildId()
+  finally:
+    elf.Dispose()
+
+
+def DemangleSymbols(symbols):
+  """Returns |symbols|, (offset, size, name, relative) tuples, with their C++
+  names demangled by c++filt. They are left as they are without it."""
+  mangled = [ i for (i, symbol) in enumerate(symbols)
+              if symbol[2].startswith("_Z") ]
+  if not mangled:
+    return symbols
+  try:
+    process = subprocess.Popen([CXXFILT_BIN],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    out, _ = process.communicate(
+        "".join(symbols[i][2] + "\n" for i in mangled))
+  except OSError:
+    return symbols
+  names = out.split("\n")
+  if process.returncode != 0 or len(names) <= len(mangled):
+    return symbols
+  symbols = list(symbols)
+  for (i, name) in itertools.izip(mangled, names):
+    (offset, size, _, relative) = symbols[i]
+    symbols[i] = (offset, size, name, relative)
+  return symbols
+
+
+def LibraryKey(filename):
+  """Returns a string telling versions of the library |filename| apart: its
+  path, size, modification time and build id, or None if it is missing."""
+  try:
+    stat = os.stat(filename)
+  except OSError:
+    return None
+  return "%s\0%d\0%r\0%s" % (os.path.abspath(filename), stat.st_size,
+                              stat.st_mtime, ReadElfBuildId(filename))
+
+
+class SymbolCache(object):
+  """Caches the symbol tables read from libraries in a directory, keyed by
+  the path, size, modification time and build id of the library.
+
+  Each table is stored in a file that is mapped when read: a header with
+  the number of symbols, arrays of their offsets, sizes, flags and name
+  offsets, and the names.
+  """
+
+  _MAGIC = "V8LLSYM2"
+  _RELATIVE = 1  # Flag of symbols relative to the address of the mapping.
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def Get(self, filename):
+    """Returns the cached symbols of |filename| as for Put(), or None."""
+    path = self._CachePath(filename)
+    if path is None or not os.path.exists(path):
+      return None
+    try:
+      with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        return SymbolCache._Unpack(data)
+      finally:
+        data.close()
+    except (IOError, mmap.error, ValueError, struct.error):
+      return None
+
+  def Put(self, filename, symbols):
+    """Caches |symbols|, a list of (offset, size, name, relative) tuples, for
+    |filename|."""
+    path = self._CachePath(filename)
+    if path is None:
+      return
+    count = len(symbols)
+    names = [ s[2] for s in symbols ]
+    name_offsets = [0]
+    for name in names:
+      name_offsets.append(name_offsets[-1] + len(name))
+    flags = [ SymbolCache._RELATIVE if s[3] else 0 for s in symbols ]
+    try:
+      if not os.path.exists(self.directory):
+        os.makedirs(self.directory)
+      temp_path = "%s.%d" % (path, os.getpid())
+      with open(temp_path, "wb") as f:
+        f.write(SymbolCache._MAGIC)
+        f.write(struct.pack("=Q", count))
+        f.write(struct.pack("=%dQ" % count, *[ s[0] for s in symbols ]))
+        f.write(struct.pack("=%dQ" % count, *[ s[1] for s in symbols ]))
+        f.write(struct.pack("=%dQ" % (count + 1), *name_offsets))
+        f.write(struct.pack("=%dB" % count, *flags))
+        f.write("".join(names))
+      os.rename(temp_path, path)
+    except (IOError, OSError), e:
+      print >>sys.stderr, "Warning: Can't cache symbols of %s: %s" % (
+          filename, e)
+
+  def _CachePath(self, filename):
+    key = LibraryKey(filename)
+    if key is None:
+      return None
+    return os.path.join(self.directory,
+                        hashlib.sha1(key).hexdigest() + ".sym")
+
+  @staticmethod
+  def _Unpack(data):
+    if data[:8] != SymbolCache._MAGIC:
+      return None
+    (count,) = struct.unpack_from("=Q", data, 8)
+    position = 16
+    offsets = struct.unpack_from("=%dQ" % count, data, position)
+    position += 8 * count
+    sizes = struct.unpack_from("=%dQ" % count, data, position)
+    position += 8 * count
+    name_offsets = struct.unpack_from("=%dQ" % (count + 1), data, position)
+    position += 8 * (count + 1)
+    flags = struct.unpack_from("=%dB" % count, data, position)
+    names = position + count
+    if names + name_offsets[count] != len(data):
+      return None
+    return [ (offsets[i], sizes[i],
+              data[names + name_offsets[i]:names + name_offsets[i + 1]],
+              flags[i] & SymbolCache._RELATIVE != 0)
+             for i in xrange(count) ]
 
 
 class LibraryRepo(object):
-  def __init__(self):
+  """The libraries mapped into the profiled process. Their symbols are only
+  read once a sample hits them, see LoadSymbolsAt()."""
+
+  def __init__(self, symbol_cache=None):
     self.infos = []
     self.names = set()
     self.ticks = {}
+    self.unloaded = []  # Infos of libraries whose symbols aren't loaded.
+    self.symbol_cache = symbol_cache
 
   def Load(self, mmap_info, code_map, options):
     # Skip kernel mmaps when requested using the fact that their tid
@@ -722,69 +1374,94 @@ class LibraryRepo(object):
     self.infos.append(mmap_info)
     mmap_info.ticks = 0
     mmap_info.unique_name = self._UniqueMmapName(mmap_info)
-    if not os.path.exists(mmap_info.filename):
-      return True
-    # Request section headers (-h), symbols (-t), and dynamic symbols
-    # (-T) from objdump.
-    # Unfortunately, section headers span two lines, so we have to
-    # keep the just seen section name (from the first line in each
-    # section header) in the after_section variable.
-    if mmap_info.filename.endswith(".ko"):
-      dynamic_symbols = ""
-    else:
-      dynamic_symbols = "-T"
-    process = subprocess.Popen(
-      "%s -h -t %s -C %s" % (OBJDUMP_BIN, dynamic_symbols, mmap_info.filename),
-      shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    pipe = process.stdout
-    after_section = None
-    code_sections = set()
-    reloc_sections = set()
-    dynamic = False
-    try:
-      for line in pipe:
-        if after_section:
-          if line.find("CODE") != -1:
-            code_sections.add(after_section)
-          if line.find("RELOC") != -1:
-            reloc_sections.add(after_section)
-          after_section = None
-          continue
-
-        match = OBJDUMP_SECTION_HEADER_RE.match(line)
-        if match:
-          after_section = match.group(1)
-          continue
+    if os.path.exists(mmap_info.filename):
+      self.unloaded.append(mmap_info)
+    return True
 
-        if OBJDUMP_DYNAMIC_SYMBOLS_START_RE.match(line):
-          dynamic = True
-          continue
+  def LoadSymbolsAt(self, pcs, code_map):
+    """Adds the symbols of the libraries containing any of |pcs|, a list or
+    a NumPy array, to |code_map|."""
+    if not self.unloaded:
+      return
+    if numpy is not None and isinstance(pcs, numpy.ndarray):
+      pcs = numpy.unique(pcs)
+      search = lambda address: numpy.searchsorted(pcs,
+                                                  numpy.uint64(address))
+    else:
+      pcs = sorted(set(pcs))
+      search = lambda address: bisect.bisect_left(pcs, address)
+    unloaded = []
+    for mmap_info in self.unloaded:
+      i = search(mmap_info.addr)
+      if i < len(pcs) and pcs[i] < mmap_info.addr + mmap_info.len:
+        self._LoadSymbols(mmap_info, code_map)
+      else:
+        unloaded.append(mmap_info)
+    self.unloaded = unloaded
+
+  def LoadSymbolsOf(self, indices, code_map):
+    """Loads the symbols of the libraries with |indices| in self.infos if
+    they aren't loaded yet, and returns the records of all their code."""
+    records = []
+    for i in indices:
+      mmap_info = self.infos[i]
+      if mmap_info in self.unloaded:
+        self.unloaded.remove(mmap_info)
+        self._LoadSymbols(mmap_info, code_map)
+      records.extend(mmap_info.records)
+    return records
+
+  def _LoadSymbols(self, mmap_info, code_map):
+    symbols = None
+    if self.symbol_cache:
+      symbols = self.symbol_cache.Get(mmap_info.filename)
+    if symbols is None:
+      symbols = LibraryRepo._ReadSymbols(mmap_info.filename)
+      if self.symbol_cache:
+        self.symbol_cache.Put(mmap_info.filename, symbols)
+    origin = mmap_info.filename
+    mmap_info.records = []
+    for (origin_offset, size, name, relative) in symbols:
+      start_address = origin_offset
+      if relative:
+        start_address += mmap_info.addr
+      mmap_info.records.append(code_map.Add(
+          Code(name, start_address, start_address + size, origin,
+               origin_offset)))
 
-        match = OBJDUMP_SYMBOL_LINE_RE.match(line)
-        if match:
-          start_address = int(match.group(1), 16)
-          origin_offset = start_address
-          flags = match.group(2)
-          section = match.group(3)
-          if section in code_sections:
-            if dynamic or section in reloc_sections:
-              start_address += mmap_info.addr
-            size = int(match.group(4), 16)
-            name = match.group(5)
-            origin = mmap_info.filename
-            code_map.Add(Code(name, start_address, start_address + size,
-                              origin, origin_offset))
+  @staticmethod
+  def _ReadSymbols(filename):
+    """Returns the code symbols of |filename| as a list of (offset, size,
+    name, relative) tuples, see ElfFile.CodeSymbols()."""
+    try:
+      elf = ElfFile(filename)
+    except (IOError, mmap.error, ValueError), e:
+      print >>sys.stderr, "Warning: Can't read symbols of %s: %s" % (
+          filename, e)
+      return []
+    try:
+      # Kernel modules have no dynamic symbols.
+      symbols = elf.CodeSymbols(dynamic=not filename.endswith(".ko"))
+    except struct.error:
+      print >>sys.stderr, "Warning: %s is truncated" % filename
+      return []
     finally:
-      pipe.close()
-    assert process.wait() == 0, "Failed to objdump %s" % mmap_info.filename
+      elf.Dispose()
+    return DemangleSymbols(symbols)
 
-  def Tick(self, pc):
-    for i, mmap_info in enumerate(self.infos):
+  def Find(self, pc):
+    # Later mappings replace earlier ones at the same addresses.
+    for mmap_info in reversed(self.infos):
       if mmap_info.addr <= pc < (mmap_info.addr + mmap_info.len):
-        mmap_info.ticks += 1
-        self.infos[0], self.infos[i] = mmap_info, self.infos[0]
-        return True
-    return False
+        return mmap_info
+    return None
+
+  def Tick(self, pc, count=1):
+    mmap_info = self.Find(pc)
+    if mmap_info is None:
+      return False
+    mmap_info.ticks += count
+    return True
 
   def _UniqueMmapName(self, mmap_info):
     name = mmap_info.filename
@@ -799,31 +1476,958 @@ class LibraryRepo(object):
     if not os.path.exists(KERNEL_ALLSYMS_FILE):
       print >>sys.stderr, "Warning: %s not found" % KERNEL_ALLSYMS_FILE
       return False
-    kallsyms = open(KERNEL_ALLSYMS_FILE, "r")
-    code = None
-    for line in kallsyms:
-      match = KERNEL_ALLSYMS_LINE_RE.match(line)
-      if match:
-        start_address = int(match.group(1), 16)
-        end_address = start_address
-        name = match.group(2)
-        if code:
-          code.end_address = start_address
-          code_map.Add(code, 16)
-        code = Code(name, start_address, end_address, "kernel", 0)
+    with open(KERNEL_ALLSYMS_FILE, "r") as kallsyms:
+      symbols = KERNEL_ALLSYMS_LINE_RE.findall(kallsyms.read())
+    symbols = sorted((int(address, 16), name) for (address, name) in symbols)
+    # Each symbol extends up to the next one.
+    for i in xrange(len(symbols) - 1):
+      (start_address, name) = symbols[i]
+      code = Code(name, start_address, symbols[i + 1][0], "kernel", 0)
+      code_map.Add(code, KERNEL_SYMBOL_MAX_SIZE)
     return True
 
 
-def PrintReport(code_map, library_repo, arch, ticks, options):
+class DisasmCache(object):
+  """Caches disassembled code in a directory, a file per code object keyed by
+  a hash of the code, see CodeDisassembler."""
+
+  _MAGIC = "V8LLDIS1\n"
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def Get(self, key):
+    """Returns the cached lines for |key| as for Put(), or None."""
+    try:
+      with open(self._CachePath(key), "rb") as f:
+        data = f.read()
+    except IOError:
+      return None
+    if not data.startswith(DisasmCache._MAGIC):
+      return None
+    lines = []
+    for line in data[len(DisasmCache._MAGIC):].splitlines():
+      (address, text) = line.split(" ", 1)
+      lines.append((int(address, 16), text))
+    return lines
+
+  def Put(self, key, lines):
+    """Caches |lines|, a list of (address, text) tuples, for |key|."""
+    path = self._CachePath(key)
+    try:
+      if not os.path.exists(self.directory):
+        os.makedirs(self.directory)
+      temp_path = "%s.%d" % (path, os.getpid())
+      with open(temp_path, "wb") as f:
+        f.write(DisasmCache._MAGIC)
+        f.write("".join("%x %s\n" % line for line in lines))
+      os.rename(temp_path, path)
+    except (IOError, OSError), e:
+      print >>sys.stderr, "Warning: Can't cache disassembly: %s" % e
+
+  def _CachePath(self, key):
+    return os.path.join(self.directory, key + ".dis")
+
+
+class CodeDisassembler(object):
+  """Disassembles code objects in batches. Generated code is read from the
+  log and disassembled with a few objdump invocations in all, other code in
+  place with an invocation per cluster of close symbols of each library.
+
+  Code objects are keyed by a hash of their instructions, or of their
+  library and range, so that each distinct code is disassembled once and
+  the results can be cached.
+  """
+
+  def __init__(self, log_reader, cache=None):
+    self.log_reader = log_reader
+    self.cache = cache
+
+  def Disassemble(self, codes):
+    """Returns the list of disassembled lines of each of |codes|, see
+    disasm.GetDisasmLines()."""
+    lines = {}  # Key -> lines.
+    blobs = {}  # Key -> instructions of generated code.
+    ranges = collections.defaultdict(dict)  # Library -> key -> range.
+    keys = []
+    for code in codes:
+      size = code.end_address - code.start_address
+      if code.origin == JS_ORIGIN or code.origin == JS_SNAPSHOT_ORIGIN:
+        blob = self.log_reader.ReadCode(code.origin_offset, size)
+        key = self._Key(self.log_reader.arch, blob)
+        blobs[key] = blob
+      else:
+        library_key = LibraryKey(code.origin)
+        if library_key is None:
+          keys.append(None)
+          continue
+        key = self._Key(library_key, "%x,%x" % (code.origin_offset, size))
+        ranges[code.origin][key] = (code.origin_offset, size)
+      keys.append(key)
+    if self.cache:
+      for key in itertools.chain(blobs.keys(), *ranges.values()):
+        cached = self.cache.Get(key)
+        if cached is not None:
+          lines[key] = cached
+    missing = [ key for key in blobs if key not in lines ]
+    self._Add(lines, missing, disasm.GetDisasmLinesOfBlobs(
+        [ blobs[key] for key in missing ], self.log_reader.arch))
+    for (filename, library_ranges) in ranges.iteritems():
+      missing = [ key for key in library_ranges if key not in lines ]
+      self._Add(lines, missing, disasm.GetDisasmLinesOfRanges(
+          filename, [ library_ranges[key] for key in missing ]))
+    return [ lines.get(key, []) for key in keys ]
+
+  def _Add(self, lines, keys, new_lines):
+    for (key, key_lines) in itertools.izip(keys, new_lines):
+      lines[key] = key_lines
+      if self.cache:
+        self.cache.Put(key, key_lines)
+
+  @staticmethod
+  def _Key(*parts):
+    return hashlib.sha1("\0".join((disasm.OBJDUMP_BIN,) + parts)).hexdigest()
+
+
+class CodeSnapshot(object):
+  """The address ranges of the code map and of the libraries at one point, as
+  NumPy arrays that can be sent to other processes."""
+
+  def __init__(self, code_map, library_repo):
+    (starts, ends, records) = code_map.GetIndex()
+    self.starts = _NumPyArray(starts, numpy.uint64)
+    self.ends = _NumPyArray(ends, numpy.uint64)
+    self.code_starts = _NumPyArray(code_map.starts, numpy.uint64)[
+        _NumPyArray(records, numpy.int64)]
+    self.library_starts = numpy.array(
+        [ m.addr for m in library_repo.infos ], dtype=numpy.uint64)
+    self.library_ends = numpy.array(
+        [ m.addr + m.len for m in library_repo.infos ], dtype=numpy.uint64)
+    unloaded = set(id(m) for m in library_repo.unloaded)
+    self.unloaded_libraries = numpy.array(
+        [ i for (i, m) in enumerate(library_repo.infos)
+          if id(m) in unloaded ], dtype=numpy.int64)
+
+  def Lookup(self, pcs):
+    """Returns the index of the address range containing each pc, or -1."""
+    if len(self.starts) == 0:
+      return numpy.repeat(-1, len(pcs))
+    i = numpy.searchsorted(self.starts, pcs, side="right") - 1
+    found = (i >= 0) & (pcs < self.ends[numpy.maximum(i, 0)])
+    return numpy.where(found, i, -1)
+
+  def LookupLibraries(self, pcs):
+    """Returns the index of the library containing each pc, or -1."""
+    libraries = numpy.repeat(-1, len(pcs))
+    # Later mappings replace earlier ones at the same addresses.
+    for i in xrange(len(self.library_starts)):
+      libraries[(pcs >= self.library_starts[i]) &
+                (pcs < self.library_ends[i])] = i
+    return libraries
+
+  def FindUnloadedLibraries(self, pcs):
+    """Returns the indices of the libraries whose symbols weren't loaded
+    when the snapshot was taken and that contain any of |pcs|."""
+    if not len(self.unloaded_libraries) or not len(pcs):
+      return numpy.zeros(0, dtype=numpy.int64)
+    return numpy.intersect1d(self.LookupLibraries(numpy.unique(pcs)),
+                             self.unloaded_libraries)
+
+  def WithCode(self, records, added, code_map, libraries):
+    """Returns a copy of the snapshot, whose address ranges map to |records|
+    of |code_map|, with the code of the |added| records too, and the records
+    of its address ranges. Added code that overlaps the snapshot's address
+    ranges is left out. The symbols of the libraries with indices
+    |libraries| count as loaded in the copy."""
+    index = CodeMap()
+    for record in added:
+      index.Add(code_map.GetCode(record))
+    (starts, ends, index_records) = index.GetIndex()
+    added_records = [ added[r] for r in index_records ]
+    starts = _NumPyArray(starts, numpy.uint64)
+    ends = _NumPyArray(ends, numpy.uint64)
+    # Drop the added ranges that overlap the ranges before or after them.
+    keep = numpy.ones(len(starts), dtype=bool)
+    if len(self.starts):
+      i = numpy.searchsorted(self.starts, starts, side="right")
+      keep &= (i == 0) | (self.ends[numpy.maximum(i - 1, 0)] <= starts)
+      keep &= ((i == len(self.starts)) |
+               (ends <= self.starts[numpy.minimum(i, len(self.starts) - 1)]))
+    order = numpy.argsort(numpy.concatenate((self.starts, starts[keep])),
+                          kind="mergesort")
+    snapshot = object.__new__(CodeSnapshot)
+    snapshot.starts = numpy.concatenate((self.starts, starts[keep]))[order]
+    snapshot.ends = numpy.concatenate((self.ends, ends[keep]))[order]
+    code_starts = numpy.array(
+        [ code_map.starts[added_records[k]] for k in numpy.flatnonzero(keep) ],
+        dtype=numpy.uint64)
+    snapshot.code_starts = numpy.concatenate(
+        (self.code_starts, code_starts))[order]
+    snapshot.library_starts = self.library_starts
+    snapshot.library_ends = self.library_ends
+    snapshot.unloaded_libraries = numpy.setdiff1d(self.unloaded_libraries,
+                                                  libraries)
+    records = list(records) + [ added_records[k]
+                                for k in numpy.flatnonzero(keep) ]
+    return (snapshot, [ records[k] for k in order.tolist() ])
+
+
+def _NumPyArray(values, dtype):
+  """Returns a copy of |values|, a list or an array of |dtype| items, as a
+  NumPy array."""
+  if isinstance(values, array.array) and len(values) > 0:
+    return numpy.frombuffer(values, dtype=dtype).copy()
+  return numpy.array(values, dtype=dtype)
+
+
+class SampleTicks(object):
+  """The ticks of samples resolved against a CodeSnapshot, by address range
+  and offset into its code object, by library, and by pair of address
+  ranges for calls."""
+
+  def __init__(self):
+    self.tick_ranges = None
+    self.tick_offsets = None
+    self.tick_counts = None
+    self.library_ticks = None
+    self.callers = None
+    self.callees = None
+    self.call_counts = None
+    self.stack_parents = None
+    self.stack_frames = None
+    self.stack_ticks = None
+    self.missed_ticks = 0
+    self.really_missed_ticks = 0
+
+
+def ResolveSamples(snapshot, sample_pcs, callchain_lengths, callchain_ips,
+                   stacks=False):
+  """Resolves samples given as in SampleResolver.AddMany() against
+  |snapshot| and returns their SampleTicks, with the tree of their stacks
+  if |stacks|."""
+  result = SampleTicks()
+  if stacks and callchain_lengths is not None:
+    (result.stack_parents, result.stack_frames, result.stack_ticks) = \
+        _BuildStackTree(snapshot, sample_pcs, callchain_lengths,
+                        callchain_ips)
+  (pcs, sample_pcs, counts) = numpy.unique(
+      sample_pcs, return_inverse=True, return_counts=True)
+  pc_ranges = snapshot.Lookup(pcs)
+  found = pc_ranges >= 0
+  result.tick_ranges = pc_ranges[found]
+  result.tick_offsets = (pcs[found] -
+                         snapshot.code_starts[result.tick_ranges])
+  result.tick_counts = counts[found]
+  result.missed_ticks = int(counts[~found].sum())
+  pc_libraries = snapshot.LookupLibraries(pcs)
+  found_library = pc_libraries >= 0
+  result.library_ticks = numpy.bincount(
+      pc_libraries[found_library], weights=counts[found_library],
+      minlength=len(snapshot.library_starts)).astype(numpy.int64)
+  result.really_missed_ticks = int(counts[~found & ~found_library].sum())
+  if callchain_lengths is None:
+    return result
+
+  # Each sample's code, followed by the code of its callchain, calls the
+  # code found before it.
+  samples = numpy.arange(len(sample_pcs))
+  chain_ranges = numpy.concatenate((pc_ranges[sample_pcs],
+                                    snapshot.Lookup(callchain_ips)))
+  chain_samples = numpy.concatenate((
+      samples, numpy.repeat(samples, callchain_lengths)))
+  order = numpy.argsort(chain_samples, kind="mergesort")
+  chain_ranges = chain_ranges[order]
+  chain_samples = chain_samples[order]
+  found = chain_ranges >= 0
+  chain_ranges = chain_ranges[found]
+  chain_samples = chain_samples[found]
+  same_sample = chain_samples[1:] == chain_samples[:-1]
+  num_ranges = len(snapshot.starts)
+  calls = (chain_ranges[1:][same_sample] * num_ranges +
+           chain_ranges[:-1][same_sample])
+  (calls, result.call_counts) = numpy.unique(calls, return_counts=True)
+  result.callers = calls // num_ranges
+  result.callees = calls % num_ranges
+  return result
+
+
+def _BuildStackTree(snapshot, sample_pcs, callchain_lengths, callchain_ips):
+  """Returns the prefix tree of the stacks of samples given as in
+  SampleResolver.AddMany(), outermost frame first, as NumPy arrays with the
+  parent of each node (-1 for the outermost frames), its frame and the
+  number of samples whose stack ends at it. Parents precede their children.
+  Frames are the indices of address ranges of |snapshot|, -2 - the index of
+  a library for pcs in libraries but not in code, and -1 for other pcs."""
+  count = len(sample_pcs)
+  # Each stack is the pc followed by the callchain, without the context
+  # markers of the callchain and the pc it usually starts with.
+  lengths = callchain_lengths + 1
+  starts = numpy.cumsum(lengths) - lengths
+  ips = numpy.empty(int(lengths.sum()), dtype=numpy.uint64)
+  is_pc = numpy.zeros(len(ips), dtype=bool)
+  is_pc[starts] = True
+  ips[is_pc] = sample_pcs
+  ips[~is_pc] = callchain_ips
+  samples = numpy.repeat(numpy.arange(count), lengths)
+  keep = is_pc | (ips < numpy.uint64(PERF_CONTEXT_MAX))
+  (ips, samples) = (ips[keep], samples[keep])
+  starts = numpy.flatnonzero(is_pc[keep])
+  second = starts + 1
+  second = second[second < len(ips)]
+  repeated = second[(samples[second] == samples[second - 1]) &
+                    (ips[second] == ips[second - 1])]
+  keep = numpy.ones(len(ips), dtype=bool)
+  keep[repeated] = False
+  (ips, samples) = (ips[keep], samples[keep])
+  lengths = numpy.bincount(samples, minlength=count)
+  starts = numpy.cumsum(lengths) - lengths
+  ranges = snapshot.Lookup(ips)
+  libraries = snapshot.LookupLibraries(ips)
+  frames = numpy.where(ranges >= 0, ranges,
+                       numpy.where(libraries >= 0, -2 - libraries, -1))
+
+  # Add the frames of all stacks at a depth at once, numbering the distinct
+  # (parent, frame) pairs.
+  frame_base = len(snapshot.library_starts) + 2
+  frame_count = len(snapshot.starts) + frame_base
+  nodes = numpy.repeat(-1, count)
+  parents = []
+  node_frames = []
+  node_count = 0
+  depth = 0
+  active = numpy.arange(count)
+  while len(active):
+    keys = ((nodes[active] + 1) * frame_count + frame_base +
+            frames[starts[active] + lengths[active] - 1 - depth])
+    (keys, active_nodes) = numpy.unique(keys, return_inverse=True)
+    parents.append(keys // frame_count - 1)
+    node_frames.append(keys % frame_count - frame_base)
+    nodes[active] = active_nodes + node_count
+    node_count += len(keys)
+    depth += 1
+    active = active[lengths[active] > depth]
+  if not parents:
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    return (empty, empty, empty)
+  return (numpy.concatenate(parents), numpy.concatenate(node_frames),
+          numpy.bincount(nodes, minlength=node_count))
+
+
+# The trace reader of a worker process, see SampleResolver.
+_worker_trace_reader = None
+
+
+def _InitWorker(trace_reader):
+  global _worker_trace_reader
+  _worker_trace_reader = trace_reader
+
+
+def _ResolveSampleRuns(snapshot, runs, stacks):
+  """Returns the SampleTicks of |runs|, or the indices of the libraries they
+  hit whose symbols are missing from |snapshot| and None if there are any.
+  Then the symbols need to be loaded and the runs resolved again."""
+  samples = [ _worker_trace_reader.DecodeSamples(first, end)
+              for (first, end) in runs ]
+  pcs = numpy.concatenate([ s[0] for s in samples ])
+  callchain_lengths = None
+  callchain_ips = None
+  unloaded = snapshot.FindUnloadedLibraries(pcs)
+  if _worker_trace_reader.callchain_supported:
+    callchain_lengths = numpy.concatenate([ s[1] for s in samples ])
+    callchain_ips = numpy.concatenate([ s[2] for s in samples ])
+    unloaded = numpy.union1d(
+        unloaded, snapshot.FindUnloadedLibraries(callchain_ips))
+  if len(unloaded):
+    return (unloaded.tolist(), None)
+  return ([], ResolveSamples(snapshot, pcs, callchain_lengths, callchain_ips,
+                             stacks))
+
+
+class SampleResolver(object):
+  """Attributes samples to code objects and libraries.
+
+  Samples are collected until the code map is about to change and then
+  resolved in bulk: with NumPy, if available, each distinct pc is looked
+  up once with a binary search over a snapshot of the code map's index.
+  Given a pool of processes that inherited the trace reader, runs of samples
+  are decoded and resolved in those, one job per GC epoch, and the ticks
+  are added to the code objects when the jobs are done. A job that hits
+  libraries whose symbols aren't loaded yet reports them instead, and runs
+  again once they are added to its snapshot. Given a StackTree,
+  the stacks of the samples are added to it.
+  """
+
+  MAX_PENDING_SAMPLES = 1 << 20
+
+  def __init__(self, code_map, library_repo, trace_reader, pool=None,
+               max_jobs=1, stack_tree=None):
+    self.code_map = code_map
+    self.library_repo = library_repo
+    self.trace_reader = trace_reader
+    self.callchain_supported = trace_reader.callchain_supported
+    self.stack_tree = stack_tree
+    self.pool = pool
+    self.max_jobs = max_jobs
+    # (AsyncResult, snapshot, records of the snapshot, runs)
+    self.jobs = []
+    self.pcs = []
+    self.callchains = []
+    # Chunks of samples added with AddMany().
+    self.pc_chunks = []
+    self.callchain_length_chunks = []
+    self.callchain_ip_chunks = []
+    self.runs = []  # Runs of samples for the pool.
+    self.pending = 0
+    self.ticks = 0
+    self.missed_ticks = 0
+    self.really_missed_ticks = 0
+    self.optimized_ticks = 0
+    self.generated_ticks = 0
+    self.v8_internal_ticks = 0
+
+  def Add(self, sample):
+    self.ticks += 1
+    self.pcs.append(sample.ip)
+    if self.callchain_supported:
+      self.callchains.append(sample.ips)
+    self._Pending(1)
+
+  def AddMany(self, pcs, callchain_lengths, callchain_ips):
+    """Like Add() for many samples at once, given as NumPy arrays of their
+    pcs, the lengths of their callchains and the concatenated callchains.
+    Requires NumPy."""
+    self.ticks += len(pcs)
+    self.pc_chunks.append(pcs)
+    if self.callchain_supported:
+      self.callchain_length_chunks.append(callchain_lengths)
+      self.callchain_ip_chunks.append(callchain_ips)
+    self._Pending(len(pcs))
+
+  def AddRun(self, first, end):
+    """Adds the samples of a run returned by TraceReader.ReadSampleRun()."""
+    if self.pool is None:
+      self.AddMany(*self.trace_reader.DecodeSamples(first, end))
+      return
+    self.ticks += end - first
+    self.runs.append((first, end))
+    self._Pending(end - first)
+
+  def Flush(self):
+    """Resolves the pending samples. Must be called before the code map or
+    the library repo change."""
+    if not self.pending:
+      return
+    self._LoadLibrarySymbols()
+    if numpy is None:
+      self._ResolveOneByOne()
+    else:
+      if self.runs:
+        self._StartJob()
+      if self.pcs:
+        # The order of the samples doesn't matter.
+        self.AddMany(
+            numpy.array(self.pcs, dtype=numpy.uint64),
+            numpy.array([ len(ips) for ips in self.callchains ],
+                        dtype=numpy.int64),
+            numpy.fromiter(itertools.chain.from_iterable(self.callchains),
+                           dtype=numpy.uint64))
+      if self.pc_chunks:
+        callchain_lengths = None
+        callchain_ips = None
+        if self.callchain_supported:
+          callchain_lengths = numpy.concatenate(self.callchain_length_chunks)
+          callchain_ips = numpy.concatenate(self.callchain_ip_chunks)
+        snapshot = CodeSnapshot(self.code_map, self.library_repo)
+        (_, _, records) = self.code_map.GetIndex()
+        self._AddTicks(records, ResolveSamples(
+            snapshot, numpy.concatenate(self.pc_chunks), callchain_lengths,
+            callchain_ips, self.stack_tree is not None))
+    self.pcs = []
+    self.callchains = []
+    self.pc_chunks = []
+    self.callchain_length_chunks = []
+    self.callchain_ip_chunks = []
+    self.runs = []
+    self.pending = 0
+
+  def Finish(self):
+    """Resolves all samples, waiting for the pool."""
+    self.Flush()
+    while self.jobs:
+      self._FinishJob()
+
+  def _LoadLibrarySymbols(self):
+    """Loads the symbols of the libraries hit by the pending samples, except
+    runs, which the jobs check themselves."""
+    if not self.library_repo.unloaded:
+      return
+    pcs = self.pcs + list(itertools.chain.from_iterable(self.callchains))
+    if numpy is not None:
+      arrays = self.pc_chunks + self.callchain_ip_chunks
+      arrays.append(numpy.array(pcs, dtype=numpy.uint64))
+      pcs = numpy.concatenate(arrays)
+    self.library_repo.LoadSymbolsAt(pcs, self.code_map)
+
+  def _Pending(self, count):
+    self.pending += count
+    if self.pending >= SampleResolver.MAX_PENDING_SAMPLES:
+      self.Flush()
+
+  def _StartJob(self):
+    snapshot = CodeSnapshot(self.code_map, self.library_repo)
+    (_, _, records) = self.code_map.GetIndex()
+    # The index changes in place, and its records must outlive it.
+    self.code_map.Pin()
+    self.jobs.append((self.pool.apply_async(
+                          _ResolveSampleRuns,
+                          (snapshot, self.runs, self.stack_tree is not None)),
+                      snapshot, records[:], self.runs))
+    # Limit the snapshots kept alive by the jobs.
+    while len(self.jobs) > self.max_jobs:
+      self._FinishJob()
+
+  def _FinishJob(self):
+    (job, snapshot, records, runs) = self.jobs.pop(0)
+    (libraries, ticks) = job.get()
+    if ticks is None:
+      added = self.library_repo.LoadSymbolsOf(libraries, self.code_map)
+      (snapshot, records) = snapshot.WithCode(records, added, self.code_map,
+                                              libraries)
+      (libraries, ticks) = self.pool.apply(
+          _ResolveSampleRuns, (snapshot, runs, self.stack_tree is not None))
+      assert ticks is not None
+    self._AddTicks(records, ticks)
+    self.code_map.Unpin()
+
+  def _AddTicks(self, records, ticks):
+    """Adds SampleTicks resolved against a snapshot of the code map index
+    with |records|."""
+    get_code = self.code_map.GetCode
+    for i, offset, count in itertools.izip(ticks.tick_ranges.tolist(),
+                                           ticks.tick_offsets.tolist(),
+                                           ticks.tick_counts.tolist()):
+      code = get_code(records[i])
+      code.AddTicks(offset, count)
+      self._CountTicks(code, count)
+    self.missed_ticks += ticks.missed_ticks
+    self.really_missed_ticks += ticks.really_missed_ticks
+    # Libraries are only ever added.
+    for mmap_info, count in itertools.izip(self.library_repo.infos,
+                                           ticks.library_ticks.tolist()):
+      mmap_info.ticks += count
+    if ticks.callers is None:
+      return
+    for caller, callee, count in itertools.izip(ticks.callers.tolist(),
+                                                ticks.callees.tolist(),
+                                                ticks.call_counts.tolist()):
+      get_code(records[caller]).CalleeTick(get_code(records[callee]), count)
+    if ticks.stack_parents is None:
+      return
+    infos = self.library_repo.infos
+    frames = []
+    for frame in ticks.stack_frames.tolist():
+      if frame >= 0:
+        frames.append(get_code(records[frame]))
+      elif frame == -1:
+        frames.append(None)
+      else:
+        frames.append(infos[-2 - frame])
+    self.stack_tree.AddTree(ticks.stack_parents.tolist(), frames,
+                            ticks.stack_ticks.tolist())
+
+  def _CountTicks(self, code, count):
+    if code.codetype == Code.OPTIMIZED:
+      self.optimized_ticks += count
+    elif code.codetype == Code.FULL_CODEGEN:
+      self.generated_ticks += count
+    elif code.codetype == Code.V8INTERNAL:
+      self.v8_internal_ticks += count
+
+  def _ResolveOneByOne(self):
+    for i, pc in enumerate(self.pcs):
+      code = self.code_map.Find(pc)
+      if code:
+        code.Tick(pc)
+        self._CountTicks(code, 1)
+      else:
+        self.missed_ticks += 1
+      if not self.library_repo.Tick(pc) and not code:
+        self.really_missed_ticks += 1
+      if self.callchain_supported:
+        for ip in self.callchains[i]:
+          caller_code = self.code_map.Find(ip)
+          if caller_code:
+            if code:
+              caller_code.CalleeTick(code)
+            code = caller_code
+        if self.stack_tree is not None:
+          self._AddStack(pc, self.callchains[i])
+
+  def _AddStack(self, pc, callchain):
+    ips = [ ip for ip in callchain if ip < PERF_CONTEXT_MAX ]
+    # The callchain usually starts with the pc.
+    if not ips or ips[0] != pc:
+      ips.insert(0, pc)
+    frames = []
+    for ip in reversed(ips):
+      frame = self.code_map.Find(ip)
+      if frame is None:
+        frame = self.library_repo.Find(ip)
+      frames.append(frame)
+    self.stack_tree.AddStack(frames)
+
+
+class StackTree(object):
+  """Prefix tree of the stacks of the samples, outermost frame first.
+
+  Frames are code objects, the infos of libraries for pcs in libraries but
+  not in code, and None for other pcs. Nodes are kept in parallel lists,
+  parents first, so that the tree grows with the number of distinct stacks
+  rather than samples. Frames are told apart by identity.
+  """
+
+  ROOT = 0
+
+  def __init__(self):
+    self.parents = [-1]
+    self.frames = [None]
+    self.ticks = [0]  # Samples whose stack ends at the node.
+    self.children = {}  # (Parent, id of the frame) -> node.
+
+  def AddNode(self, parent, frame):
+    """Returns the child of |parent| for |frame|, adding it if needed."""
+    key = (parent, id(frame))
+    node = self.children.get(key)
+    if node is None:
+      node = len(self.parents)
+      self.children[key] = node
+      self.parents.append(parent)
+      self.frames.append(frame)
+      self.ticks.append(0)
+    return node
+
+  def AddStack(self, frames, count=1):
+    """Adds |count| samples of a stack given outermost frame first."""
+    node = StackTree.ROOT
+    for frame in frames:
+      node = self.AddNode(node, frame)
+    self.ticks[node] += count
+
+  def AddTree(self, parents, frames, ticks):
+    """Merges a tree given as parallel lists, parents first and -1 for the
+    parents of outermost frames."""
+    nodes = []
+    children = self.children
+    for parent, frame, count in itertools.izip(parents, frames, ticks):
+      parent = nodes[parent] if parent >= 0 else StackTree.ROOT
+      key = (parent, id(frame))
+      node = children.get(key)
+      if node is None:
+        node = len(self.parents)
+        children[key] = node
+        self.parents.append(parent)
+        self.frames.append(frame)
+        self.ticks.append(0)
+      if count:
+        self.ticks[node] += count
+      nodes.append(node)
+
+  def Stacks(self):
+    """Yields the stacks samples end at, as lists of nodes from the innermost
+    frame out, with their ticks."""
+    parents = self.parents
+    for node, count in enumerate(self.ticks):
+      if count:
+        path = []
+        while node != StackTree.ROOT:
+          path.append(node)
+          node = parents[node]
+        yield (path, count)
+
+  def MapFrames(self, function):
+    """Returns a list with |function| applied to the frame of every node,
+    calling it once per frame."""
+    results = {}
+    mapped = [None]
+    for frame in itertools.islice(self.frames, 1, None):
+      key = id(frame)
+      if key not in results:
+        results[key] = function(frame)
+      mapped.append(results[key])
+    return mapped
+
+  def FrameTicks(self):
+    """Returns the frames with their inclusive and self ticks, as a list of
+    tuples. The ticks of recursive calls are included once."""
+    parents = self.parents
+    totals = list(self.ticks)
+    for node in xrange(len(totals) - 1, StackTree.ROOT, -1):
+      totals[parents[node]] += totals[node]
+    # A node adds its inclusive ticks unless its frame is on the path to it,
+    # which is known from the nearest node up the path for each frame.
+    frame_ids = map(id, self.frames)
+    recursive = bytearray(len(totals))
+    children = [ [] for _ in xrange(len(totals)) ]
+    for node in xrange(1, len(totals)):
+      children[parents[node]].append(node)
+    on_path = collections.defaultdict(int)
+    pending = list(children[StackTree.ROOT])
+    while pending:
+      node = pending.pop()
+      if node < 0:
+        on_path[frame_ids[~node]] -= 1
+        continue
+      frame_id = frame_ids[node]
+      if on_path[frame_id]:
+        recursive[node] = 1
+      on_path[frame_id] += 1
+      pending.append(~node)
+      pending.extend(children[node])
+    frame_ticks = {}  # Id of the frame -> [frame, inclusive, self ticks].
+    for node in xrange(1, len(totals)):
+      frame_id = frame_ids[node]
+      ticks = frame_ticks.get(frame_id)
+      if ticks is None:
+        ticks = frame_ticks[frame_id] = [self.frames[node], 0, 0]
+      if not recursive[node]:
+        ticks[1] += totals[node]
+      ticks[2] += self.ticks[node]
+    return [ tuple(ticks) for ticks in frame_ticks.itervalues() ]
+
+
+def FrameName(frame):
+  if frame is None:
+    return "[unknown]"
+  if isinstance(frame, Code):
+    return frame.name
+  return "[%s]" % frame.unique_name
+
+
+def FrameOrigin(frame):
+  if frame is None:
+    return ""
+  if isinstance(frame, Code):
+    return frame.origin
+  return frame.filename
+
+
+def WriteFoldedStacks(stack_tree, filename):
+  """Writes the stacks in the folded format of flame graph tools: a line
+  per stack with its frames separated by semicolons and its ticks."""
+  names = stack_tree.MapFrames(
+      lambda frame: FrameName(frame).replace(";", ":"))
+  with open(filename, "w") as output:
+    for (path, ticks) in stack_tree.Stacks():
+      path.reverse()
+      output.write("%s %d\n" % (";".join([ names[node] for node in path ]),
+                                ticks))
+
+
+def _ProtoVarint(value):
+  encoded = []
+  while value > 0x7f:
+    encoded.append(chr(0x80 | (value & 0x7f)))
+    value >>= 7
+  encoded.append(chr(value))
+  return "".join(encoded)
+
+
+def _ProtoField(number, value):
+  """Encodes a protocol buffer field, ints as varints and strings (including
+  embedded messages) length-delimited."""
+  if isinstance(value, str):
+    return _ProtoVarint(number << 3 | 2) + _ProtoVarint(len(value)) + value
+  return _ProtoVarint(number << 3) + _ProtoVarint(value)
+
+
+def WritePprof(stack_tree, filename):
+  """Writes the stacks as a gzipped profile.proto of pprof, with a location
+  and a function per frame."""
+  # Reference: https://github.com/google/pprof/blob/master/proto/profile.proto
+  strings = {"": 0}
+  def String(string):
+    return strings.setdefault(string, len(strings))
+  frames_by_id = [None]
+  def NewLocation(frame):
+    frames_by_id.append(frame)
+    return _ProtoVarint(len(frames_by_id) - 1)
+  # The encoded location id of every node.
+  locations = stack_tree.MapFrames(NewLocation)
+  profile = [ _ProtoField(1, _ProtoField(1, String("samples")) +
+                             _ProtoField(2, String("count"))) ]
+  for (path, ticks) in stack_tree.Stacks():
+    sample = (_ProtoField(1, "".join([ locations[node] for node in path ])) +
+              _ProtoField(2, _ProtoVarint(ticks)))
+    profile.append(_ProtoField(2, sample))
+  for frame_id in xrange(1, len(frames_by_id)):
+    frame = frames_by_id[frame_id]
+    profile.append(_ProtoField(4, _ProtoField(1, frame_id) +
+                                  _ProtoField(4, _ProtoField(1, frame_id))))
+    name = String(FrameName(frame))
+    profile.append(_ProtoField(5, _ProtoField(1, frame_id) +
+                                  _ProtoField(2, name) +
+                                  _ProtoField(3, name) +
+                                  _ProtoField(4, String(FrameOrigin(frame)))))
+  for (string, _) in sorted(strings.iteritems(), key=lambda item: item[1]):
+    profile.append(_ProtoField(6, string))
+  output = gzip.open(filename, "wb")
+  try:
+    output.write("".join(profile))
+  finally:
+    output.close()
+
+
+class Profile(object):
+  """The samples of a perf trace, resolved against the V8 code log and the
+  libraries of the same run by Resolve()."""
+
+  def __init__(self, log_name, trace_name, snapshot_log_name, options):
+    snapshot_name_map = {}
+    if snapshot_log_name:
+      snapshot_log_reader = SnapshotLogReader(log_name=snapshot_log_name)
+      snapshot_name_map = snapshot_log_reader.ReadNameMap()
+    self.code_map = CodeMap()
+    self.log_reader = LogReader(log_name=log_name + ".ll",
+                                code_map=self.code_map,
+                                snapshot_pos_to_name=snapshot_name_map)
+    symbol_cache = None
+    if options.symbol_cache:
+      symbol_cache = SymbolCache(options.symbol_cache)
+    self.library_repo = LibraryRepo(symbol_cache)
+    self.trace_reader = TraceReader(trace_name)
+    self.options = options
+    self.resolver = None
+    # Stats.
+    self.events = 0
+    self.mmap_time = 0
+    self.sample_time = 0
+
+  def Resolve(self, stack_tree=None):
+    """Resolves the samples, adding their stacks to |stack_tree| if any."""
+    options = self.options
+    trace_reader = self.trace_reader
+    self.log_reader.ReadUpToGC()
+    pool = None
+    if options.jobs > 1:
+      if trace_reader.words is None:
+        print >>sys.stderr, \
+            "Warning: resolving samples in parallel requires NumPy"
+      else:
+        pool = multiprocessing.Pool(options.jobs, _InitWorker,
+                                    (trace_reader,))
+    resolver = SampleResolver(self.code_map, self.library_repo, trace_reader,
+                              pool, 2 * options.jobs, stack_tree)
+    while True:
+      header, offset = trace_reader.ReadEventHeader()
+      if not header:
+        break
+      self.events += 1
+      if header.type == PERF_RECORD_MMAP:
+        start = time.time()
+        resolver.Flush()
+        self.sample_time += time.time() - start
+        start = time.time()
+        mmap_info = trace_reader.ReadMmap(header, offset)
+        if mmap_info.filename == HOST_ROOT + V8_GC_FAKE_MMAP:
+          self.log_reader.ReadUpToGC()
+        else:
+          self.library_repo.Load(mmap_info, self.code_map, options)
+        self.mmap_time += time.time() - start
+      elif header.type == PERF_RECORD_SAMPLE:
+        start = time.time()
+        run = trace_reader.ReadSampleRun(offset)
+        if run:
+          resolver.AddRun(*run)
+          self.events += run[1] - run[0] - 1
+        else:
+          resolver.Add(trace_reader.ReadSample(header, offset))
+        self.sample_time += time.time() - start
+    start = time.time()
+    resolver.Finish()
+    if pool:
+      pool.close()
+      pool.join()
+    self.sample_time += time.time() - start
+    self.resolver = resolver
+
+  def Dispose(self):
+    self.log_reader.Dispose()
+    self.trace_reader.Dispose()
+
+
+class ProfileSummary(object):
+  """The ticks of a resolved profile by symbol name and by type of code, to
+  compare runs whose code is at different addresses, see PrintDiffReport().
+  Unlike the report, these include the ticks of code removed during the run.
+  Summaries can be sent to other processes."""
+
+  # Buckets of ticks by the type of their code.
+  NOT_IN_SYMBOLS = -1
+  BUCKETS = [
+    (Code.OPTIMIZED, "optimized code"),
+    (Code.FULL_CODEGEN, "other lazily compiled code"),
+    (Code.V8INTERNAL, "v8::internal::*"),
+    (Code.UNKNOWN, "other symbols"),
+    (NOT_IN_SYMBOLS, "not in symbols")
+  ]
+
+  def __init__(self, profile):
+    self.ticks = profile.resolver.ticks
+    self.symbol_ticks = {}  # Name -> ticks of the code with that name.
+    self.origins = {}  # Name -> origin of the code with that name.
+    self.bucket_ticks = dict((bucket, 0) for (bucket, _) in
+                             ProfileSummary.BUCKETS)
+    code_map = profile.code_map
+    for code in itertools.chain(code_map.UsedCode(),
+                                code_map.RemovedUsedCode()):
+      if not code.self_ticks:
+        continue
+      self.symbol_ticks[code.name] = (self.symbol_ticks.get(code.name, 0) +
+                                      code.self_ticks)
+      self.origins[code.name] = code.origin
+      self.bucket_ticks[code.codetype] += code.self_ticks
+    self.bucket_ticks[ProfileSummary.NOT_IN_SYMBOLS] = \
+        profile.resolver.missed_ticks
+
+  def Share(self, ticks):
+    """Returns |ticks| in percent of all ticks of the profile."""
+    if not self.ticks:
+      return 0.0
+    return 100.0 * ticks / self.ticks
+
+
+def _ResolveSummary(connection, log_name, trace_name, snapshot_log_name,
+                    options):
+  """Resolves a profile and sends its ProfileSummary through |connection|,
+  or None if that fails."""
+  summary = None
+  try:
+    profile = Profile(log_name, trace_name, snapshot_log_name, options)
+    try:
+      profile.Resolve()
+      summary = ProfileSummary(profile)
+    finally:
+      profile.Dispose()
+  finally:
+    connection.send(summary)
+    connection.close()
+
+
+def PrintReport(code_map, library_repo, disassembler, ticks, options):
   print "Ticks per symbol:"
   used_code = [code for code in code_map.UsedCode()]
   used_code.sort(key=lambda x: x.self_ticks, reverse=True)
+  if options.disasm_all:
+    annotated_code = used_code
+  else:
+    annotated_code = used_code[:options.disasm_top]
+  annotated_lines = disassembler.Disassemble(annotated_code)
   for i, code in enumerate(used_code):
     code_ticks = code.self_ticks
     print "%10d %5.1f%% %s [%s]" % (code_ticks, 100. * code_ticks / ticks,
                                     code.FullName(), code.origin)
-    if options.disasm_all or i < options.disasm_top:
-      code.PrintAnnotated(arch, options)
+    if i < len(annotated_lines):
+      code.PrintAnnotated(annotated_lines[i])
   print
   print "Ticks per library:"
   mmap_infos = [m for m in library_repo.infos if m.ticks > 0]
@@ -834,6 +2438,51 @@ def PrintReport(code_map, library_repo, arch, ticks, options):
                                mmap_info.unique_name)
 
 
+def PrintFrameTicks(stack_tree, ticks):
+  print "Ticks per frame of the stacks (inclusive, self):"
+  frame_ticks = stack_tree.FrameTicks()
+  frame_ticks.sort(key=lambda t: (t[1], t[2]), reverse=True)
+  for (frame, inclusive, self_ticks) in frame_ticks:
+    description = FrameName(frame)
+    if isinstance(frame, Code):
+      description = "%s [%s]" % (frame.FullName(), frame.origin)
+    print "%10d %5.1f%% %10d %5.1f%% %s" % (
+        inclusive, 100. * inclusive / ticks,
+        self_ticks, 100. * self_ticks / ticks, description)
+
+
+def PrintDiffReport(baseline, current, options):
+  """Prints the changes of the shares of ticks from the |baseline| to the
+  |current| ProfileSummary, by symbol name and by type of code."""
+  print "Ticks of the baseline -> current profile: %d -> %d" % (
+      baseline.ticks, current.ticks)
+  print
+  print "Ticks per code type (baseline -> current, change):"
+  for (bucket, description) in ProfileSummary.BUCKETS:
+    before = baseline.Share(baseline.bucket_ticks[bucket])
+    after = current.Share(current.bucket_ticks[bucket])
+    print "%5.1f%% -> %5.1f%% %+6.2f%% %s" % (before, after, after - before,
+                                              description)
+  changes = []
+  for name in set(baseline.symbol_ticks) | set(current.symbol_ticks):
+    before = baseline.Share(baseline.symbol_ticks.get(name, 0))
+    after = current.Share(current.symbol_ticks.get(name, 0))
+    origin = current.origins.get(name) or baseline.origins[name]
+    changes.append((after - before, before, after, name, origin))
+  regressions = [ change for change in changes if change[0] > 0 ]
+  regressions.sort(key=lambda change: (-change[0], change[3]))
+  improvements = [ change for change in changes if change[0] < 0 ]
+  improvements.sort(key=lambda change: (change[0], change[3]))
+  for (title, symbol_changes) in [("Regressions", regressions),
+                                  ("Improvements", improvements)]:
+    print
+    print "%s per symbol (baseline -> current, change):" % title
+    for (change, before, after, name, origin) in \
+        symbol_changes[:options.diff_top]:
+      print "%5.1f%% -> %5.1f%% %+6.2f%% %s [%s]" % (before, after, change,
+                                                     name, origin)
+
+
 def PrintDot(code_map, options):
   print "digraph G {"
   for code in code_map.UsedCode():
@@ -879,6 +2528,19 @@ if __name__ == "__main__":
                     default=False,
                     action="store_true",
                     help="produce dot output (WIP) [default: %default]")
+  parser.add_option("--folded-stacks",
+                    default="",
+                    help=("write the stacks of the samples to this file in "
+                          "the folded format of flame graph tools"))
+  parser.add_option("--pprof",
+                    default="",
+                    help=("write the stacks of the samples to this file as "
+                          "a gzipped pprof profile"))
+  parser.add_option("--inclusive",
+                    default=False,
+                    action="store_true",
+                    help=("print inclusive and self ticks per frame of the "
+                          "stacks of the samples [default: %default]"))
   parser.add_option("--quiet", "-q",
                     default=False,
                     action="store_true",
@@ -889,10 +2551,46 @@ if __name__ == "__main__":
   parser.add_option("--objdump",
                     default="/usr/bin/objdump",
                     help="objdump tool to use [default: %default]")
+  parser.add_option("-j", "--jobs",
+                    default=1,
+                    type="int",
+                    help=("number of processes resolving the samples of "
+                          "different GC epochs, requires NumPy "
+                          "[default: %default]"))
+  parser.add_option("--symbol-cache",
+                    default=os.path.join(os.path.expanduser("~"), ".cache",
+                                         "v8-ll_prof"),
+                    help=("directory caching the symbols of libraries, "
+                          "empty to disable [default: %default]"))
+  parser.add_option("--disasm-cache",
+                    default=os.path.join(os.path.expanduser("~"), ".cache",
+                                         "v8-ll_prof"),
+                    help=("directory caching disassembled code, empty to "
+                          "disable [default: %default]"))
+  parser.add_option("--baseline-log",
+                    default="",
+                    help=("V8 log file name of a baseline run to compare "
+                          "the profile with, by symbol name"))
+  parser.add_option("--baseline-trace",
+                    default="",
+                    help="perf trace file name of the baseline run")
+  parser.add_option("--baseline-snapshot-log",
+                    default="",
+                    help=("V8 snapshot log file name of the baseline run "
+                          "[default: the --snapshot-log]"))
+  parser.add_option("--diff-top",
+                    default=25,
+                    type="int",
+                    help=("number of symbols with the largest regressions "
+                          "and improvements to print [default: %default]"))
   parser.add_option("--host-root",
                     default="",
                     help="Path to the host root [default: %default]")
   options, args = parser.parse_args()
+  if bool(options.baseline_log) != bool(options.baseline_trace):
+    parser.error("--baseline-log and --baseline-trace go together")
+  if options.baseline_log and options.dot:
+    parser.error("--dot can't be used with a baseline")
 
   if not options.quiet:
     if options.snapshot:
@@ -902,89 +2600,85 @@ if __name__ == "__main__":
     else:
       print "V8 log: %s, %s.ll (no snapshot)" % (options.log, options.log)
     print "Perf trace file: %s" % options.trace
+    if options.baseline_log:
+      print "Baseline V8 log: %s.ll, perf trace file: %s" % (
+          options.baseline_log, options.baseline_trace)
 
   V8_GC_FAKE_MMAP = options.gc_fake_mmap
   HOST_ROOT = options.host_root
   if os.path.exists(options.objdump):
     disasm.OBJDUMP_BIN = options.objdump
-    OBJDUMP_BIN = options.objdump
   else:
     print "Cannot find %s, falling back to default objdump" % options.objdump
 
-  # Stats.
-  events = 0
-  ticks = 0
-  missed_ticks = 0
-  really_missed_ticks = 0
-  optimized_ticks = 0
-  generated_ticks = 0
-  v8_internal_ticks = 0
-  mmap_time = 0
-  sample_time = 0
-
-  # Process the snapshot log to fill the snapshot name map.
-  snapshot_name_map = {}
-  if options.snapshot:
-    snapshot_log_reader = SnapshotLogReader(log_name=options.snapshot_log)
-    snapshot_name_map = snapshot_log_reader.ReadNameMap()
-
-  # Initialize the log reader.
-  code_map = CodeMap()
-  log_reader = LogReader(log_name=options.log + ".ll",
-                         code_map=code_map,
-                         snapshot_pos_to_name=snapshot_name_map)
+  snapshot_log = options.snapshot_log if options.snapshot else None
+
+  # Resolve the baseline in a process of its own meanwhile.
+  baseline_process = None
+  if options.baseline_log:
+    baseline_snapshot_log = None
+    if options.snapshot:
+      baseline_snapshot_log = (options.baseline_snapshot_log or
+                               options.snapshot_log)
+    (baseline_connection, connection) = multiprocessing.Pipe(False)
+    baseline_process = multiprocessing.Process(
+        target=_ResolveSummary,
+        args=(connection, options.baseline_log, options.baseline_trace,
+              baseline_snapshot_log, options))
+    baseline_process.start()
+    connection.close()
+
+  profile = Profile(options.log, options.trace, snapshot_log, options)
   if not options.quiet:
-    print "Generated code architecture: %s" % log_reader.arch
+    print "Generated code architecture: %s" % profile.log_reader.arch
     print
     sys.stdout.flush()
 
   # Process the code and trace logs.
-  library_repo = LibraryRepo()
-  log_reader.ReadUpToGC()
-  trace_reader = TraceReader(options.trace)
-  while True:
-    header, offset = trace_reader.ReadEventHeader()
-    if not header:
-      break
-    events += 1
-    if header.type == PERF_RECORD_MMAP:
-      start = time.time()
-      mmap_info = trace_reader.ReadMmap(header, offset)
-      if mmap_info.filename == HOST_ROOT + V8_GC_FAKE_MMAP:
-        log_reader.ReadUpToGC()
-      else:
-        library_repo.Load(mmap_info, code_map, options)
-      mmap_time += time.time() - start
-    elif header.type == PERF_RECORD_SAMPLE:
-      ticks += 1
-      start = time.time()
-      sample = trace_reader.ReadSample(header, offset)
-      code = code_map.Find(sample.ip)
-      if code:
-        code.Tick(sample.ip)
-        if code.codetype == Code.OPTIMIZED:
-          optimized_ticks += 1
-        elif code.codetype == Code.FULL_CODEGEN:
-          generated_ticks += 1
-        elif code.codetype == Code.V8INTERNAL:
-          v8_internal_ticks += 1
-      else:
-        missed_ticks += 1
-      if not library_repo.Tick(sample.ip) and not code:
-        really_missed_ticks += 1
-      if trace_reader.callchain_supported:
-        for ip in sample.ips:
-          caller_code = code_map.Find(ip)
-          if caller_code:
-            if code:
-              caller_code.CalleeTick(code)
-            code = caller_code
-      sample_time += time.time() - start
-
+  stack_tree = None
+  if options.folded_stacks or options.pprof or options.inclusive:
+    if profile.trace_reader.callchain_supported:
+      stack_tree = StackTree()
+    else:
+      print >>sys.stderr, \
+          "Warning: no callchains in the trace, use perf record -g"
+  profile.Resolve(stack_tree)
+  resolver = profile.resolver
+  ticks = resolver.ticks
+
+  baseline = None
+  if baseline_process:
+    try:
+      baseline = baseline_connection.recv()
+    except EOFError:
+      pass
+    baseline_process.join()
+    if baseline is None:
+      print >>sys.stderr, "Can't resolve the baseline profile"
+      sys.exit(1)
+
+  if stack_tree is not None:
+    if options.folded_stacks:
+      WriteFoldedStacks(stack_tree, options.folded_stacks)
+    if options.pprof:
+      WritePprof(stack_tree, options.pprof)
+
+  code_map = profile.code_map
   if options.dot:
     PrintDot(code_map, options)
   else:
-    PrintReport(code_map, library_repo, log_reader.arch, ticks, options)
+    if baseline is not None:
+      PrintDiffReport(baseline, ProfileSummary(profile), options)
+    else:
+      disasm_cache = None
+      if options.disasm_cache:
+        disasm_cache = DisasmCache(options.disasm_cache)
+      PrintReport(code_map, profile.library_repo,
+                  CodeDisassembler(profile.log_reader, disasm_cache), ticks,
+                  options)
+    if stack_tree is not None and options.inclusive:
+      print
+      PrintFrameTicks(stack_tree, ticks)
 
     if not options.quiet:
       def PrintTicks(number, total, description):
@@ -992,20 +2686,21 @@ if __name__ == "__main__":
               (number, 100.0*number/total, description))
       print
       print "Stats:"
-      print "%10d total trace events" % events
+      print "%10d total trace events" % profile.events
       print "%10d total ticks" % ticks
-      print "%10d ticks not in symbols" % missed_ticks
+      print "%10d ticks not in symbols" % resolver.missed_ticks
       unaccounted = "unaccounted ticks"
-      if really_missed_ticks > 0:
+      if resolver.really_missed_ticks > 0:
         unaccounted += " (probably in the kernel, try --kernel)"
-      PrintTicks(really_missed_ticks, ticks, unaccounted)
-      PrintTicks(optimized_ticks, ticks, "ticks in optimized code")
-      PrintTicks(generated_ticks, ticks, "ticks in other lazily compiled code")
-      PrintTicks(v8_internal_ticks, ticks, "ticks in v8::internal::*")
-      print "%10d total symbols" % len([c for c in code_map.AllCode()])
+      PrintTicks(resolver.really_missed_ticks, ticks, unaccounted)
+      PrintTicks(resolver.optimized_ticks, ticks, "ticks in optimized code")
+      PrintTicks(resolver.generated_ticks, ticks,
+                 "ticks in other lazily compiled code")
+      PrintTicks(resolver.v8_internal_ticks, ticks,
+                 "ticks in v8::internal::*")
+      print "%10d total symbols" % code_map.CodeCount()
       print "%10d used symbols" % len([c for c in code_map.UsedCode()])
-      print "%9.2fs library processing time" % mmap_time
-      print "%9.2fs tick processing time" % sample_time
+      print "%9.2fs library processing time" % profile.mmap_time
+      print "%9.2fs tick processing time" % profile.sample_time
 
-  log_reader.Dispose()
-  trace_reader.Dispose()
+  profile.Dispose()
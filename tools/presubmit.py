@@ -45,6 +45,8 @@ import subprocess
 import multiprocessing
 from subprocess import PIPE
 
+from testrunner.local import utils
+
 # Disabled LINT rules and reason.
 # build/include_what_you_use: Started giving false positives for variables
 #  named "string" and "map" assuming that you needed to include STL headers.
@@ -256,7 +258,7 @@ class CppLintProcessor(SourceFileProcessor):
     command = [sys.executable, cpplint, '--filter', filt]
 
     commands = join([command + [file] for file in files])
-    count = multiprocessing.cpu_count()
+    count = utils.GuessJobCount()
     pool = multiprocessing.Pool(count)
     try:
       results = pool.map_async(CppLintWorker, commands).get(999999)
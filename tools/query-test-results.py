@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Answers questions about test results logged with run-tests.py --json-log.
+
+Each log file is indexed incrementally into <log>.index, so repeated queries
+only have to parse the records appended since the last query.
+"""
+
+import cPickle
+import optparse
+import os
+import sys
+
+from testrunner.local import results_log
+
+
+USAGE = """usage: %prog [options] COMMAND LOG...
+
+Commands:
+  runs          list the logged runs
+  slowest       list the tests with the highest average duration
+  regressions   list the tests that got slower in the latest run"""
+
+INDEX_VERSION = 1
+
+
+class LogIndex(object):
+  """Per-run test durations and outcomes extracted from one results log."""
+
+  def __init__(self):
+    self.version = INDEX_VERSION
+    self.offset = 0  # Log position up to which records have been indexed.
+    self.run_info = {}  # run id -> (arch, mode)
+    self.results = {}  # run id -> {test key -> (duration, outcome)}
+
+  def Update(self, log_name):
+    for (record, offset) in results_log.ReadRecords(log_name, self.offset):
+      run = record["run"]
+      if run not in self.results:
+        self.run_info[run] = (record["arch"], record["mode"])
+        self.results[run] = {}
+      key = " ".join([record["name"]] + record["flags"])
+      self.results[run][key] = (record["duration"], record["outcome"])
+      self.offset = offset
+
+
+def LoadIndex(log_name):
+  index_name = log_name + ".index"
+  index = None
+  if os.path.exists(index_name):
+    with open(index_name, "rb") as f:
+      try:
+        index = cPickle.load(f)
+      except Exception:
+        index = None
+  if (index is None or index.version != INDEX_VERSION or
+      index.offset > os.path.getsize(log_name)):
+    # Missing, outdated or the log was truncated: start from scratch.
+    index = LogIndex()
+  old_offset = index.offset
+  index.Update(log_name)
+  if index.offset != old_offset:
+    with open(index_name, "wb") as f:
+      cPickle.dump(index, f, cPickle.HIGHEST_PROTOCOL)
+  return index
+
+
+def RunStartTime(run):
+  # Run ids start with the start time in milliseconds.
+  return int(run.split(".")[0])
+
+
+def CollectRuns(logs, options):
+  """Returns a list of (run id, arch, mode, results) sorted by start time,
+  restricted to the last |options.runs| runs that match arch and mode."""
+  runs = []
+  for log_name in logs:
+    index = LoadIndex(log_name)
+    for run in index.results:
+      (arch, mode) = index.run_info[run]
+      if options.arch and arch != options.arch: continue
+      if options.mode and mode != options.mode: continue
+      runs.append((run, arch, mode, index.results[run]))
+  runs.sort(key=lambda r: RunStartTime(r[0]))
+  if options.runs > 0:
+    runs = runs[-options.runs:]
+  return runs
+
+
+def Median(values):
+  values = sorted(values)
+  middle = len(values) // 2
+  if len(values) % 2:
+    return values[middle]
+  return (values[middle - 1] + values[middle]) / 2.0
+
+
+def PrintRuns(runs, options):
+  print "%-20s %-8s %-8s %7s %7s %10s" % (
+      "run", "arch", "mode", "tests", "failed", "time [s]")
+  for (run, arch, mode, results) in runs:
+    failed = len([r for r in results.itervalues() if r[1] != "PASS"])
+    total = sum(r[0] for r in results.itervalues())
+    print "%-20s %-8s %-8s %7d %7d %10.1f" % (
+        run, arch, mode, len(results), failed, total)
+
+
+def PrintSlowest(runs, options):
+  durations = {}
+  for (_, _, _, results) in runs:
+    for key, (duration, _) in results.iteritems():
+      durations.setdefault(key, []).append(duration)
+  averages = [(sum(d) / len(d), max(d), len(d), key)
+              for key, d in durations.iteritems()]
+  averages.sort(reverse=True)
+  print "%9s %9s %5s  %s" % ("avg [s]", "max [s]", "runs", "test")
+  for (average, maximum, count, key) in averages[:options.count]:
+    print "%9.3f %9.3f %5d  %s" % (average, maximum, count, key)
+
+
+def PrintRegressions(runs, options):
+  if len(runs) < 2:
+    print "Need at least two runs to find regressions."
+    return
+  latest = runs[-1][3]
+  previous = {}
+  for (_, _, _, results) in runs[:-1]:
+    for key, (duration, _) in results.iteritems():
+      previous.setdefault(key, []).append(duration)
+  regressions = []
+  for key, (duration, _) in latest.iteritems():
+    if key not in previous or duration < options.min_duration:
+      continue
+    baseline = Median(previous[key])
+    if baseline > 0 and duration > options.factor * baseline:
+      regressions.append((duration / baseline, baseline, duration, key))
+  regressions.sort(reverse=True)
+  print "%7s %9s %9s  %s" % ("factor", "base [s]", "now [s]", "test")
+  for (factor, baseline, duration, key) in regressions[:options.count]:
+    print "%6.1fx %9.3f %9.3f  %s" % (factor, baseline, duration, key)
+
+
+COMMANDS = {
+  "runs": PrintRuns,
+  "slowest": PrintSlowest,
+  "regressions": PrintRegressions,
+}
+
+
+def BuildOptions():
+  result = optparse.OptionParser(USAGE)
+  result.add_option("--arch", help="Only consider runs for this architecture")
+  result.add_option("--mode", help="Only consider runs in this mode")
+  result.add_option("-n", "--count", help="Maximum number of tests to list",
+                    default=100, type="int")
+  result.add_option("--runs",
+                    help="Only consider the last N runs (0: all runs)",
+                    default=20, type="int")
+  result.add_option("--factor",
+                    help="Minimum slowdown reported by 'regressions'",
+                    default=2.0, type="float")
+  result.add_option("--min-duration",
+                    help=("Ignore tests that took less than this many seconds "
+                          "in the latest run for 'regressions'"),
+                    default=0.1, type="float")
+  return result
+
+
+def Main():
+  parser = BuildOptions()
+  (options, args) = parser.parse_args()
+  if len(args) < 2 or args[0] not in COMMANDS:
+    parser.print_help()
+    return 1
+  for log_name in args[1:]:
+    if not os.path.exists(log_name):
+      print "Log file %s not found." % log_name
+      return 1
+  runs = CollectRuns(args[1:], options)
+  COMMANDS[args[0]](runs, options)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(Main())
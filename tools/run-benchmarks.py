@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""Runs the benchmarks in test/benchmarks repeatedly and reports their results
+with confidence intervals, optionally compared against an earlier run:
+
+  tools/run-benchmarks.py --arch=x64 --runs=20 --json-output=before.json
+  tools/run-benchmarks.py --arch=x64 --runs=20 --baseline=before.json octane
+
+or compares two builds directly by interleaving their runs, in parallel on
+pinned CPUs:
+
+  tools/run-benchmarks.py --shell-dir=out/patched --cpus=auto \\
+      --baseline-shell-dir=out/x64.release
+"""
+
+
+import json
+import optparse
+import os
+from os.path import join
+import shlex
+import sys
+
+from testrunner.local import benchmark
+from testrunner.local import execution
+from testrunner.local import progress
+from testrunner.local import testsuite
+from testrunner.local import utils
+from testrunner.objects import context
+
+
+ARCH_GUESS = utils.DefaultArch()
+TIMEOUT_DEFAULT = 600
+MODE_FLAGS = {
+    "debug"   : ["--nobreak-on-abort"],
+    "release" : ["--nobreak-on-abort"]}
+
+
+def BuildOptions():
+  result = optparse.OptionParser()
+  result.add_option("--arch",
+                    help=("The architecture to run the benchmarks for, "
+                          "'auto' or 'native' for auto-detect"),
+                    default="x64")
+  result.add_option("--baseline",
+                    help=("Compare against the results in this file, written "
+                          "by an earlier run with --json-output"))
+  result.add_option("--baseline-shell-dir",
+                    help=("Compare against the shells in this directory, "
+                          "running them interleaved with those in "
+                          "--shell-dir"))
+  result.add_option("--buildbot",
+                    help="Adapt to path structure used on buildbots",
+                    default=False, action="store_true")
+  result.add_option("--command-prefix",
+                    help="Prepended to each shell command used to run a test",
+                    default="")
+  result.add_option("--confidence",
+                    help="The confidence level of the reported intervals",
+                    default=0.95, type="float")
+  result.add_option("--cpus",
+                    help=("Pin the benchmark processes to these CPUs, as a "
+                          "list like '2-3,6' or 'auto' for all CPUs in the "
+                          "affinity mask (default: no pinning)"),
+                    default="")
+  result.add_option("--extra-flags",
+                    help="Additional flags to pass to each test command",
+                    default="")
+  result.add_option("-j", help=("The number of benchmarks to run in parallel "
+                                "(default: the number of --cpus if pinning, "
+                                "1 otherwise)"),
+                    default=0, type="int")
+  result.add_option("--json-output",
+                    help="Write the samples and statistics to this file")
+  result.add_option("-m", "--mode",
+                    help="The mode of the build to benchmark",
+                    default="release")
+  result.add_option("--outdir", help="Base directory with compile output",
+                    default="out")
+  result.add_option("-p", "--progress",
+                    help=("The style of progress indicator"
+                          " (verbose, dots, color, mono)"),
+                    choices=progress.PROGRESS_INDICATORS.keys(), default="mono")
+  result.add_option("--regression-threshold",
+                    help=("Fail if a benchmark regressed significantly by "
+                          "more than this many percent against the baseline"),
+                    default=2.0, type="float")
+  result.add_option("--runs",
+                    help="The number of measured runs of each benchmark",
+                    default=10, type="int")
+  result.add_option("--shell-dir", help="Directory containing executables",
+                    default="")
+  result.add_option("--significance",
+                    help=("The p-value below which a difference to the "
+                          "baseline is significant"),
+                    default=0.05, type="float")
+  result.add_option("-t", "--timeout", help="Timeout in seconds",
+                    default=TIMEOUT_DEFAULT, type="int")
+  result.add_option("-v", "--verbose", help="Verbose output",
+                    default=False, action="store_true")
+  result.add_option("--warmup",
+                    help="The number of unmeasured runs of each benchmark",
+                    default=1, type="int")
+  return result
+
+
+def ProcessOptions(options):
+  if options.arch in ["auto", "native"]:
+    options.arch = ARCH_GUESS
+  if not options.mode in MODE_FLAGS:
+    print "Unknown mode %s" % options.mode
+    return False
+  if options.runs < 2:
+    print "At least two runs are needed for a confidence interval"
+    return False
+  if options.warmup < 0:
+    print "The number of warmup runs must not be negative"
+    return False
+  if not 0 < options.confidence < 1:
+    print "The confidence level must be between 0 and 1"
+    return False
+  if options.baseline and options.baseline_shell_dir:
+    print "Use either --baseline or --baseline-shell-dir"
+    return False
+  if options.cpus == "auto":
+    options.cpus = utils.GetAffinityCpus()
+  else:
+    options.cpus = utils.ParseCpuList(options.cpus)
+  if options.j == 0:
+    options.j = len(options.cpus) or 1
+  options.command_prefix = shlex.split(options.command_prefix)
+  options.extra_flags = shlex.split(options.extra_flags)
+  return True
+
+
+def GetShellDir(options, workspace):
+  if options.shell_dir:
+    return os.path.relpath(options.shell_dir)
+  if options.buildbot:
+    return os.path.relpath(join(workspace, options.outdir, options.mode))
+  return os.path.relpath(join(workspace, options.outdir,
+                              "%s.%s" % (options.arch, options.mode)))
+
+
+def LoadBaseline(filename):
+  with open(filename) as f:
+    packed = json.load(f)
+  return dict((name, benchmark.BenchmarkResult.Unpack(name, result))
+              for (name, result) in packed["benchmarks"].iteritems())
+
+
+def PrintResults(results, comparisons, failed):
+  print
+  print "%-40s %14s %9s %14s %9s %21s %8s" % ("Benchmark", "Mean", "CI",
+                                               "Baseline", "Delta",
+                                               "Delta CI", "p")
+  for (name, result) in results.iteritems():
+    line = "%-40s %14.2f %8.2f%% " % ("%s (%s)" % (name, result.unit),
+                                     result.mean, result.RelativeCi())
+    if name in comparisons:
+      comparison = comparisons[name]
+      line += "%14.2f %+8.2f%% %21s %8.4f  %s" % (
+          comparison.baseline.mean, comparison.delta,
+          "[%+.2f%%, %+.2f%%]" % comparison.delta_ci, comparison.p_value,
+          comparison.verdict)
+    print line.rstrip()
+  for name in failed:
+    print "%-40s %14s" % (name, "FAILED")
+
+
+def WriteJson(filename, options, results, comparisons):
+  packed = {}
+  for (name, result) in results.iteritems():
+    packed[name] = result.Pack()
+    if name in comparisons:
+      packed[name]["comparison"] = comparisons[name].Pack()
+  with open(filename, "w") as f:
+    json.dump({"arch": options.arch, "mode": options.mode,
+               "runs": options.runs, "warmup": options.warmup,
+               "benchmarks": packed}, f, indent=2, sort_keys=True)
+
+
+def Main():
+  parser = BuildOptions()
+  (options, args) = parser.parse_args()
+  if not ProcessOptions(options):
+    parser.print_help()
+    return 1
+
+  workspace = os.path.abspath(join(os.path.dirname(sys.argv[0]), ".."))
+  suite = testsuite.TestSuite.LoadTestSuite(
+      join(workspace, "test", "benchmarks"))
+  ctx = context.Context(options.arch, options.mode,
+                        GetShellDir(options, workspace),
+                        MODE_FLAGS[options.mode], options.verbose,
+                        options.timeout, False,
+                        options.command_prefix,
+                        options.extra_flags,
+                        False,  # No i18n flags.
+                        False,  # No adaptive jobs.
+                        0,  # No memory budget.
+                        False,  # No batching.
+                        options.cpus,
+                        True)  # Benchmarks print their results.
+  variables = {
+    "mode": options.mode,
+    "arch": options.arch,
+    "system": utils.GuessOS(),
+    "isolates": False,
+    "deopt_fuzzer": False,
+    "no_i18n": False,
+  }
+  suite.ReadStatusFile(variables)
+  suite.ReadTestCases(ctx)
+  if args:
+    suite.FilterTestCasesByArgs([ a if a.startswith("benchmarks") else
+                                  join("benchmarks", a) for a in args ])
+  suite.FilterTestCasesByStatus(False)
+  if not suite.tests:
+    print "No benchmarks to run."
+    return 0
+
+  baseline = {}
+  if options.baseline:
+    baseline = LoadBaseline(options.baseline)
+
+  print(">>> Running %d benchmarks %d times (+%d warmup) for %s.%s" %
+        (len(suite.tests), options.runs, options.warmup, options.arch,
+         options.mode))
+  progress_indicator = progress.PROGRESS_INDICATORS[options.progress]()
+  try:
+    if options.baseline_shell_dir:
+      (results, baseline, failed) = benchmark.RunComparison(
+          suite, ctx, os.path.relpath(options.baseline_shell_dir),
+          options.runs, options.warmup, options.j, progress_indicator,
+          options.confidence)
+    else:
+      (results, failed) = benchmark.RunBenchmarks(
+          suite, ctx, options.runs, options.warmup, options.j,
+          progress_indicator, options.confidence)
+  except (KeyboardInterrupt, execution.BreakNowException):
+    return 1
+
+  comparisons = {}
+  for (name, result) in results.iteritems():
+    if name in baseline:
+      comparisons[name] = benchmark.Comparison(result, baseline[name],
+                                               options.significance)
+  PrintResults(results, comparisons, failed)
+  if options.json_output:
+    WriteJson(options.json_output, options, results, comparisons)
+
+  regressions = [ name for (name, comparison) in comparisons.iteritems()
+                  if comparison.IsRegression(options.regression_threshold) ]
+  if regressions:
+    print
+    print "Significant regressions: %s" % ", ".join(sorted(regressions))
+  if failed or regressions:
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(Main())
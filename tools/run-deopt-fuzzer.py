@@ -28,13 +28,14 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import bisect
 import json
 import math
-import multiprocessing
 import optparse
 import os
 from os.path import join
 import random
+import re
 import shlex
 import subprocess
 import sys
@@ -42,6 +43,8 @@ import time
 
 from testrunner.local import execution
 from testrunner.local import progress
+from testrunner.local import reducer
+from testrunner.local import testdata
 from testrunner.local import testsuite
 from testrunner.local import utils
 from testrunner.local import verbose
@@ -78,7 +81,13 @@ SLOW_ARCHS = ["android_arm",
               "nacl_ia32",
               "nacl_x64"]
 MAX_DEOPT = 1000000000
-DISTRIBUTION_MODES = ["smooth", "random"]
+DISTRIBUTION_MODES = ["smooth", "random", "coverage"]
+# Matches the first line --trace-deopt prints for a deoptimization and
+# captures the optimized function and the bailout id of the deopt site.
+DEOPT_TRACE_PATTERN = re.compile(
+    r"^\[deoptimizing \(DEOPT \w+\): begin 0x[0-9a-fA-F]+ (.*) @(\d+), ")
+# Number of candidate deopt points considered per selected deopt point.
+COVERAGE_CANDIDATES = 8
 
 
 class RandomDistribution:
@@ -87,7 +96,7 @@ class RandomDistribution:
     print "Using random distribution with seed %d" % seed
     self._random = random.Random(seed)
 
-  def Distribute(self, n, m):
+  def Distribute(self, n, m, key=None):
     if n > m:
       n = m
     return self._random.sample(xrange(1, m + 1), n)
@@ -103,7 +112,7 @@ class SmoothDistribution:
     self._factor1 = factor1
     self._factor2 = factor2
 
-  def Distribute(self, n, m):
+  def Distribute(self, n, m, key=None):
     if n > m:
       n = m
     if n <= 1:
@@ -137,9 +146,110 @@ class SmoothDistribution:
     return result
 
 
-def Distribution(options):
+class CoverageDistribution:
+  """Selects deopt points that are likely to reach deopt sites which no
+  earlier test case has hit. The deopt sites hit by each test case are read
+  from its --trace-deopt output; they can be persisted in a file to guide
+  subsequent runs.
+
+  The first forced deoptimization of --deopt-every-n-times N happens at the
+  N-th deopt point. Untried deopt points are preferred when the closest tried
+  points on both sides started with different deopt sites (or there is no
+  tried point on one side), and then by their distance to the closest tried
+  point.
+  """
+  def __init__(self, seed=None, filename=None, config=""):
+    seed = seed or random.randint(1, sys.maxint)
+    print "Using coverage guided distribution with seed %d" % seed
+    self._random = random.Random(seed)
+    self._filename = filename
+    self._config = config
+    self._all_data = {}
+    if filename and os.path.exists(filename):
+      with open(filename) as f:
+        self._all_data = json.load(f)
+    # Test key -> {"max_deopt": m, "hits": {"n": [deopt sites]}}
+    self._data = self._all_data.setdefault(config, {})
+    self.new_sites = 0
+
+  def _Entry(self, key, m):
+    entry = self._data.get(key)
+    if not entry or entry["max_deopt"] != m:
+      # The test or the build has changed, old deopt points are meaningless.
+      entry = {"max_deopt": m, "hits": {}}
+      self._data[key] = entry
+    return entry
+
+  def Distribute(self, n, m, key=None):
+    if n > m:
+      n = m
+    hits = self._Entry(key, m)["hits"]
+    first_sites = dict((int(i), sites[0] if sites else None)
+                       for (i, sites) in hits.iteritems())
+    tried = sorted(first_sites)
+    untried = m - len(tried)
+    if untried <= n * COVERAGE_CANDIDATES:
+      candidates = [ i for i in xrange(1, m + 1) if i not in first_sites ]
+    else:
+      candidates = set(self._random.sample(xrange(1, m + 1),
+                                           n * COVERAGE_CANDIDATES))
+      candidates = [ i for i in candidates if i not in first_sites ]
+
+    def Score(i):
+      index = bisect.bisect_left(tried, i)
+      left = tried[index - 1] if index > 0 else None
+      right = tried[index] if index < len(tried) else None
+      if left is None and right is None:
+        return (1, 0, self._random.random())
+      distance = min(abs(i - j) for j in (left, right) if j is not None)
+      boundary = (left is None or right is None or
+                  first_sites[left] != first_sites[right])
+      return (int(boundary), distance, self._random.random())
+
+    candidates.sort(key=Score, reverse=True)
+    return sorted(candidates[:n])
+
+  def RecordCase(self, test):
+    """Records the deopt sites hit by the fuzzing case |test|."""
+    if test.output is None or not "--deopt-every-n-times" in test.flags:
+      return
+    n = test.flags[test.flags.index("--deopt-every-n-times") + 1]
+    entry = self._data.get(test.GetLabel())
+    if entry is None:
+      return
+    seen = set()
+    for sites in entry["hits"].itervalues():
+      seen.update(sites)
+    sites = []
+    for line in test.output.stdout.splitlines():
+      match = DEOPT_TRACE_PATTERN.match(line)
+      if match:
+        site = "%s@%s" % match.groups()
+        if not site in sites:
+          sites.append(site)
+    self.new_sites += len(set(sites) - seen)
+    entry["hits"][n] = sites
+
+  def Done(self):
+    sites = 0
+    for entry in self._data.itervalues():
+      seen = set()
+      for hit in entry["hits"].itervalues():
+        seen.update(hit)
+      sites += len(seen)
+    print (">>> Deopt coverage: %d deopt sites in %d tests (%d new)" %
+           (sites, len(self._data), self.new_sites))
+    if self._filename:
+      with open(self._filename, "w") as f:
+        json.dump(self._all_data, f)
+
+
+def Distribution(options, arch, mode):
   if options.distribution_mode == "random":
     return RandomDistribution(options.seed)
+  if options.distribution_mode == "coverage":
+    return CoverageDistribution(options.seed, options.coverage_file,
+                                "%s.%s" % (arch, mode))
   if options.distribution_mode == "smooth":
     return SmoothDistribution(options.distribution_factor1,
                               options.distribution_factor2)
@@ -163,6 +273,9 @@ def BuildOptions():
   result.add_option("--coverage", help=("Exponential test coverage "
                     "(range 0.0, 1.0) -- 0.0: one test, 1.0 all tests (slow)"),
                     default=0.4, type="float")
+  result.add_option("--coverage-file",
+                    help=("File to keep the deopt sites hit per test across "
+                          "runs with --distribution-mode=coverage"))
   result.add_option("--coverage-lift", help=("Lifts test coverage for tests "
                     "with a small number of deopt points (range 0, inf)"),
                     default=20, type="int")
@@ -175,7 +288,7 @@ def BuildOptions():
                     "derivation of the distribution function"), default=0.7,
                     type="float")
   result.add_option("--distribution-mode", help=("How to select deopt points "
-                    "for a given test (smooth|random)"),
+                    "for a given test (smooth|random|coverage)"),
                     default="smooth")
   result.add_option("--dump-results-file", help=("Dump maximum number of "
                     "deopt points per test to a file"))
@@ -184,7 +297,23 @@ def BuildOptions():
                     default="")
   result.add_option("--isolates", help="Whether to test isolates",
                     default=False, action="store_true")
-  result.add_option("-j", help="The number of parallel tasks to run",
+  result.add_option("-j", help=("The number of parallel tasks to run "
+                                "(default: derived from the CPU affinity mask,"
+                                " cgroup CPU quota and available memory)"),
+                    default=0, type="int")
+  result.add_option("--adaptive-jobs",
+                    help=("Lower the number of parallel tasks when the load "
+                          "or the number of timeouts spikes, and raise it "
+                          "again when the machine is idle"),
+                    default=False, action="store_true")
+  result.add_option("--memory-budget",
+                    help=("Only start a test when the peak memory of all "
+                          "running tests, as observed in previous runs, fits "
+                          "into this many MB (0: unlimited)"),
+                    default=0, type="int")
+  result.add_option("--max-cases",
+                    help=("Maximum number of deopt fuzzing test cases to run "
+                          "in pipelined mode (0: unlimited)"),
                     default=0, type="int")
   result.add_option("-m", "--mode",
                     help="The test modes in which to run (comma-separated)",
@@ -196,6 +325,17 @@ def BuildOptions():
                           " (verbose, dots, color, mono)"),
                     choices=progress.PROGRESS_INDICATORS.keys(),
                     default="mono")
+  result.add_option("--pipelined",
+                    help=("Start fuzzing a test as soon as its collection run "
+                          "is done, using a single pool of workers"),
+                    default=False, action="store_true")
+  result.add_option("--reduce",
+                    help=("Minimize failing deopt fuzzing test cases and "
+                          "write the reproducers to --reduce-dir"),
+                    default=False, action="store_true")
+  result.add_option("--reduce-dir",
+                    help=("Directory for the minimized test cases (default: "
+                          "<outdir>/deopt-reductions)"))
   result.add_option("--shard-count",
                     help="Split testsuites into this number of shards",
                     default=1, type="int")
@@ -206,6 +346,10 @@ def BuildOptions():
                     default="")
   result.add_option("--seed", help="The seed for the random distribution",
                     type="int")
+  result.add_option("--time-budget",
+                    help=("Stop starting new test cases after this many "
+                          "seconds in pipelined mode (0: unlimited)"),
+                    default=0, type="int")
   result.add_option("-t", "--timeout", help="Timeout in seconds",
                     default= -1, type="int")
   result.add_option("-v", "--verbose", help="Verbose output",
@@ -238,7 +382,7 @@ def ProcessOptions(options):
   options.command_prefix = shlex.split(options.command_prefix)
   options.extra_flags = shlex.split(options.extra_flags)
   if options.j == 0:
-    options.j = multiprocessing.cpu_count()
+    options.j = utils.GuessJobCount()
   if not options.distribution_mode in DISTRIBUTION_MODES:
     print "Unknown distribution mode %s" % options.distribution_mode
     return False
@@ -254,6 +398,10 @@ def ProcessOptions(options):
     print ("Coverage %s is out of range. Defaulting to 0.4"
         % options.coverage)
     options.coverage = 0.4
+  if ((options.max_cases or options.time_budget) and
+      not options.pipelined):
+    print "--max-cases and --time-budget require --pipelined."
+    return False
   if options.coverage_lift < 0:
     print ("Coverage lift %s is out of range. Defaulting to 0"
         % options.coverage_lift)
@@ -307,8 +455,8 @@ def Main():
       suites.append(suite)
 
   if options.download_data:
-    for s in suites:
-      s.DownloadData()
+    testdata.ProvisionAll([ a for s in suites for a in s.GetDataArchives() ],
+                          options.j)
 
   for mode in options.mode:
     for arch in options.arch:
@@ -328,10 +476,157 @@ def CalculateNTests(m, options):
   return int(math.pow(m, (m * c + l) / (m + l)))
 
 
+def ParseDeoptCount(test):
+  """Returns the number of deopt points found by the collection run of
+  |test|, or None if the output doesn't contain the deopt counter."""
+  for line in test.output.stdout.splitlines():
+    if line.startswith("=== Stress deopt counter: "):
+      return MAX_DEOPT - int(line.split(" ")[-1])
+  return None
+
+
+def FuzzingFlags(n, options):
+  flags = ["--deopt-every-n-times", "%d" % n]
+  if options.distribution_mode == "coverage":
+    flags.append("--trace-deopt")
+  return flags
+
+
+def DumpResults(test_results, options):
+  with file("%s.%d.txt" % (options.dump_results_file, time.time()), "w") as f:
+    f.write(json.dumps(test_results))
+
+
+def ReduceFailures(failed, options, ctx, workspace):
+  """Minimizes one failing fuzzing case per test."""
+  outdir = options.reduce_dir or os.path.join(workspace, options.outdir,
+                                              "deopt-reductions")
+  reduced = set()
+  for test in failed:
+    label = test.GetLabel()
+    index = test.flags.index("--deopt-every-n-times")
+    if label in reduced or test.flags[index + 1] == "%d" % MAX_DEOPT:
+      # Failures of collection runs are not caused by deopt fuzzing.
+      continue
+    reduced.add(label)
+    print ">>> Reducing %s" % label
+    try:
+      filename = reducer.DeoptReducer(test, ctx, options.j,
+                                      options.verbose).Reduce(outdir)
+    except IOError, e:
+      print "Cannot reduce %s: %s" % (label, e)
+      continue
+    if filename:
+      print "Minimized test case: %s" % filename
+    else:
+      print "Failure of %s doesn't reproduce" % label
+
+
+class PipelinedFuzzingIndicator(progress.ProgressIndicator):
+  """Wraps a progress indicator. As soon as the collection run of a test is
+  done, its deopt fuzzing cases are added to the running runner, until the
+  time or case budget is exhausted. With a random distribution and a time
+  budget, new rounds of cases are added whenever the queue runs low."""
+
+  def __init__(self, progress_indicator, prototypes, next_id, dist, options):
+    self.progress_indicator = progress_indicator
+    self.prototypes = prototypes  # Collection test id -> test prototype.
+    self.next_id = next_id
+    self.dist = dist
+    self.options = options
+    self.max_deopts = []  # (test prototype, number of deopt points)
+    self.test_results = {}
+    self.missing = []
+    self.num_cases = 0
+    self.deadline = None
+    if options.time_budget:
+      self.deadline = time.time() + options.time_budget
+    self.exhausted = False
+
+  def Starting(self):
+    self.progress_indicator.runner = self.runner
+    self.progress_indicator.Starting()
+
+  def Done(self):
+    self.progress_indicator.Done()
+    for path in self.missing:
+      print "Missing results for %s" % path
+    print ">>> %d deopt fuzzing test cases run" % self.num_cases
+    if self.options.distribution_mode == "coverage":
+      self.dist.Done()
+    if self.options.dump_results_file:
+      DumpResults(self.test_results, self.options)
+
+  def AboutToRun(self, test):
+    self.progress_indicator.AboutToRun(test)
+
+  def HasRun(self, test, has_unexpected_output):
+    self.progress_indicator.HasRun(test, has_unexpected_output)
+    prototype = self.prototypes.pop(test.id, None)
+    if prototype is not None:
+      max_deopt = ParseDeoptCount(test)
+      if max_deopt is None:
+        self.missing.append(test.path)
+      elif max_deopt > 0:
+        self.test_results[test.path] = max_deopt
+        self.max_deopts.append((prototype, max_deopt))
+        self._AddCases(prototype, max_deopt)
+    elif self.options.distribution_mode == "coverage":
+      self.dist.RecordCase(test)
+    elif (not self.prototypes and self.deadline and
+          self.options.distribution_mode == "random" and
+          self.runner.remaining < 2 * self.options.j):
+      # Keep all cores busy with fresh random cases until time is up.
+      for (prototype, max_deopt) in self.max_deopts:
+        self._AddCases(prototype, max_deopt)
+    if (not self.exhausted and self.deadline and
+        time.time() >= self.deadline):
+      self.exhausted = True
+      self.num_cases -= self.runner.CancelPendingTests()
+
+  def _AddCases(self, prototype, max_deopt):
+    if self.exhausted:
+      return
+    n_deopt = CalculateNTests(max_deopt, self.options)
+    distribution = self.dist.Distribute(n_deopt, max_deopt,
+                                        prototype.GetLabel())
+    if self.options.max_cases:
+      distribution = distribution[:self.options.max_cases - self.num_cases]
+      if self.num_cases + len(distribution) >= self.options.max_cases:
+        self.exhausted = True
+    for i in distribution:
+      case = prototype.CopyAddingFlags(FuzzingFlags(i, self.options))
+      case.id = self.next_id
+      self.next_id += 1
+      self.runner.AddTest(case)
+    self.num_cases += len(distribution)
+
+
+def ExecutePipelined(suites, test_backup, next_id, dist, options, ctx,
+                     workspace):
+  prototypes = {}
+  for s in suites:
+    for (t, prototype) in zip(s.tests, test_backup[s]):
+      prototypes[t.id] = prototype
+  try:
+    print(">>> Pipelined collection and deopt fuzzing phase")
+    progress_indicator = PipelinedFuzzingIndicator(
+        progress.PROGRESS_INDICATORS[options.progress](), prototypes,
+        next_id, dist, options)
+    runner = execution.Runner(suites, progress_indicator, ctx,
+                              perf_data=False)
+    exit_code = runner.Run(options.j)
+    if options.reduce and not runner.terminate:
+      ReduceFailures(runner.failed, options, ctx, workspace)
+    return exit_code
+  except KeyboardInterrupt:
+    return 1
+
+
 def Execute(arch, mode, args, options, suites, workspace):
   print(">>> Running tests for %s.%s" % (arch, mode))
 
-  dist = Distribution(options)
+  dist = Distribution(options, arch, mode)
 
   shell_dir = options.shell_dir
   if not shell_dir:
@@ -359,6 +654,11 @@ def Execute(arch, mode, args, options, suites, workspace):
                         timeout, options.isolates,
                         options.command_prefix,
                         options.extra_flags,
+                        False,
+                        options.adaptive_jobs,
+                        options.memory_budget * 1024,
+                        False,
+                        [],
                         False)
 
   # Find available test suites and read test cases from them.
@@ -397,10 +697,15 @@ def Execute(arch, mode, args, options, suites, workspace):
     print "No tests to run."
     return 0
 
+  if options.pipelined:
+    return ExecutePipelined(suites, test_backup, test_id, dist, options, ctx,
+                            workspace)
+
   try:
     print(">>> Collection phase")
     progress_indicator = progress.PROGRESS_INDICATORS[options.progress]()
-    runner = execution.Runner(suites, progress_indicator, ctx)
+    runner = execution.Runner(suites, progress_indicator, ctx,
+                              perf_data=False)
 
     exit_code = runner.Run(options.j)
     if runner.terminate:
@@ -415,16 +720,14 @@ def Execute(arch, mode, args, options, suites, workspace):
   for s in suites:
     test_results = {}
     for t in s.tests:
-      for line in t.output.stdout.splitlines():
-        if line.startswith("=== Stress deopt counter: "):
-          test_results[t.path] = MAX_DEOPT - int(line.split(" ")[-1])
+      max_deopt = ParseDeoptCount(t)
+      if max_deopt is not None:
+        test_results[t.path] = max_deopt
     for t in s.tests:
       if t.path not in test_results:
         print "Missing results for %s" % t.path
     if options.dump_results_file:
-      results_dict = dict((t.path, n) for (t, n) in test_results.iteritems())
-      with file("%s.%d.txt" % (dump_results_file, time.time()), "w") as f:
-        f.write(json.dumps(results_dict))
+      DumpResults(test_results, options)
 
     # Reset tests and redistribute the prototypes from the collection phase.
     s.tests = []
@@ -435,12 +738,11 @@ def Execute(arch, mode, args, options, suites, workspace):
       if max_deopt == 0:
         continue
       n_deopt = CalculateNTests(max_deopt, options)
-      distribution = dist.Distribute(n_deopt, max_deopt)
+      distribution = dist.Distribute(n_deopt, max_deopt, t.GetLabel())
       if options.verbose:
         print "%s %s" % (t.path, distribution)
       for i in distribution:
-        fuzzing_flags = ["--deopt-every-n-times", "%d" % i]
-        s.tests.append(t.CopyAddingFlags(fuzzing_flags))
+        s.tests.append(t.CopyAddingFlags(FuzzingFlags(i, options)))
     num_tests += len(s.tests)
     for t in s.tests:
       t.id = test_id
@@ -453,7 +755,8 @@ def Execute(arch, mode, args, options, suites, workspace):
   try:
     print(">>> Deopt fuzzing phase (%d test cases)" % num_tests)
     progress_indicator = progress.PROGRESS_INDICATORS[options.progress]()
-    runner = execution.Runner(suites, progress_indicator, ctx)
+    runner = execution.Runner(suites, progress_indicator, ctx,
+                              perf_data=False)
 
     exit_code = runner.Run(options.j)
     if runner.terminate:
@@ -462,6 +765,18 @@ def Execute(arch, mode, args, options, suites, workspace):
   except KeyboardInterrupt:
     return 1
 
+  if options.distribution_mode == "coverage":
+    for s in suites:
+      for t in s.tests:
+        dist.RecordCase(t)
+    dist.Done()
+
+  if options.reduce:
+    try:
+      ReduceFailures(runner.failed, options, ctx, workspace)
+    except KeyboardInterrupt:
+      return 1
+
   return exit_code
 
 
@@ -28,7 +28,6 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-import multiprocessing
 import optparse
 import os
 from os.path import join
@@ -39,8 +38,10 @@ import time
 
 from testrunner.local import execution
 from testrunner.local import progress
+from testrunner.local import testdata
 from testrunner.local import testsuite
 from testrunner.local import utils
+from testrunner.local import variants
 from testrunner.local import verbose
 from testrunner.network import network_execution
 from testrunner.objects import context
@@ -89,6 +90,10 @@ def BuildOptions():
   result.add_option("--arch-and-mode",
                     help="Architecture and mode in the format 'arch.mode'",
                     default=None)
+  result.add_option("--batch-tests",
+                    help=("Run many small tests in one shell process where "
+                          "the test suite supports it (preparser, cctest)"),
+                    default=False, action="store_true")
   result.add_option("--buildbot",
                     help="Adapt to path structure used on buildbots",
                     default=False, action="store_true")
@@ -107,7 +112,19 @@ def BuildOptions():
                     default="")
   result.add_option("--isolates", help="Whether to test isolates",
                     default=False, action="store_true")
-  result.add_option("-j", help="The number of parallel tasks to run",
+  result.add_option("-j", help=("The number of parallel tasks to run "
+                                "(default: derived from the CPU affinity mask,"
+                                " cgroup CPU quota and available memory)"),
+                    default=0, type="int")
+  result.add_option("--adaptive-jobs",
+                    help=("Lower the number of parallel tasks when the load "
+                          "or the number of timeouts spikes, and raise it "
+                          "again when the machine is idle"),
+                    default=False, action="store_true")
+  result.add_option("--memory-budget",
+                    help=("Only start a test when the peak memory of all "
+                          "running tests, as observed in previous runs, fits "
+                          "into this many MB (0: unlimited)"),
                     default=0, type="int")
   result.add_option("-m", "--mode",
                     help="The test modes in which to run (comma-separated)",
@@ -134,6 +151,13 @@ def BuildOptions():
                     help=("The style of progress indicator"
                           " (verbose, dots, color, mono)"),
                     choices=progress.PROGRESS_INDICATORS.keys(), default="mono")
+  result.add_option("--prune-variants",
+                    help=("Skip testing variants that can't change the "
+                          "behavior of a test: those with the same effective "
+                          "flags as another variant and, unless sharding, "
+                          "those that always had the same outcome as the "
+                          "standard variant in previous runs"),
+                    default=False, action="store_true")
   result.add_option("--report", help="Print a summary of the tests to be run",
                     default=False, action="store_true")
   result.add_option("--shard-count",
@@ -158,6 +182,9 @@ def BuildOptions():
                     default=False, action="store_true")
   result.add_option("--warn-unused", help="Report unused rules",
                     default=False, action="store_true")
+  result.add_option("--json-log",
+                    help=("Append a JSON record for each test result to this "
+                          "file, see tools/query-test-results.py"))
   result.add_option("--junitout", help="File name of the JUnit output")
   result.add_option("--junittestsuite",
                     help="The testsuite name in the JUnit output file",
@@ -199,7 +226,7 @@ def ProcessOptions(options):
   options.command_prefix = shlex.split(options.command_prefix)
   options.extra_flags = shlex.split(options.extra_flags)
   if options.j == 0:
-    options.j = multiprocessing.cpu_count()
+    options.j = utils.GuessJobCount()
 
   def excl(*args):
     """Returns true if zero or one of multiple arguments are true."""
@@ -282,8 +309,8 @@ def Main():
       suites.append(suite)
 
   if options.download_data:
-    for s in suites:
-      s.DownloadData()
+    testdata.ProvisionAll([ a for s in suites for a in s.GetDataArchives() ],
+                          options.j)
 
   for mode in options.mode:
     for arch in options.arch:
@@ -321,7 +348,12 @@ def Execute(arch, mode, args, options, suites, workspace):
                         timeout, options.isolates,
                         options.command_prefix,
                         options.extra_flags,
-                        options.no_i18n)
+                        options.no_i18n,
+                        options.adaptive_jobs,
+                        options.memory_budget * 1024,
+                        options.batch_tests,
+                        [],
+                        False)
 
   # Find available test suites and read test cases from them.
   variables = {
@@ -335,6 +367,14 @@ def Execute(arch, mode, args, options, suites, workspace):
   all_tests = []
   num_tests = 0
   test_id = 0
+  pruner = None
+  if options.prune_variants:
+    history = None
+    if options.shard_count < 2:
+      # Shards have to agree on the set of tests to split up.
+      history = variants.VariantHistory(
+          os.path.join("out", "testrunner_data"), arch, mode)
+    pruner = variants.VariantPruner(ctx, history)
   for s in suites:
     s.ReadStatusFile(variables)
     s.ReadTestCases(ctx)
@@ -345,9 +385,12 @@ def Execute(arch, mode, args, options, suites, workspace):
     if options.cat:
       verbose.PrintTestSource(s.tests)
       continue
-    s.tests = [ t.CopyAddingFlags(v)
-                for t in s.tests
-                for v in s.VariantFlags(t, VARIANT_FLAGS) ]
+    if pruner:
+      s.tests = pruner.Expand(s, VARIANT_FLAGS)
+    else:
+      s.tests = [ t.CopyAddingFlags(v)
+                  for t in s.tests
+                  for v in s.VariantFlags(t, VARIANT_FLAGS) ]
     s.tests = ShardTests(s.tests, options.shard_count, options.shard_run)
     num_tests += len(s.tests)
     for t in s.tests:
@@ -360,7 +403,12 @@ def Execute(arch, mode, args, options, suites, workspace):
   if options.report:
     verbose.PrintReport(all_tests)
 
+  if pruner:
+    pruner.PrintSummary()
+
   if num_tests == 0:
+    if pruner and pruner.history:
+      pruner.history.close()
     print "No tests to run."
     return 0
 
@@ -371,6 +419,9 @@ def Execute(arch, mode, args, options, suites, workspace):
     if options.junitout:
       progress_indicator = progress.JUnitTestProgressIndicator(
           progress_indicator, options.junitout, options.junittestsuite)
+    if options.json_log:
+      progress_indicator = progress.ResultsLogProgressIndicator(
+          progress_indicator, options.json_log, arch, mode)
 
     run_networked = not options.no_network
     if not run_networked:
@@ -403,6 +454,10 @@ def Execute(arch, mode, args, options, suites, workspace):
     overall_duration = time.time() - start_time
   except KeyboardInterrupt:
     return 1
+  finally:
+    if pruner and pruner.history:
+      pruner.RecordResults()
+      pruner.history.close()
 
   if options.time:
     verbose.PrintTestDurations(suites, overall_duration)
@@ -0,0 +1,188 @@
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import collections
+
+from . import execution
+from . import statistics
+
+
+class BenchmarkResult(object):
+  """The samples of one benchmark, without outliers, and their statistics."""
+
+  def __init__(self, name, unit, higher_is_better, samples, confidence):
+    self.name = name
+    self.unit = unit
+    self.higher_is_better = higher_is_better
+    (self.samples, self.outliers) = statistics.RejectOutliers(samples)
+    self.confidence = confidence
+    self.mean = statistics.Mean(self.samples)
+    self.stddev = statistics.StandardDeviation(self.samples)
+    self.ci = statistics.ConfidenceInterval(self.samples, confidence)
+
+  def Pack(self):
+    return {"unit": self.unit, "higher_is_better": self.higher_is_better,
+            "samples": self.samples, "outliers": self.outliers,
+            "mean": self.mean, "stddev": self.stddev,
+            "confidence": self.confidence, "ci": list(self.ci)}
+
+  @staticmethod
+  def Unpack(name, packed):
+    return BenchmarkResult(name, packed["unit"], packed["higher_is_better"],
+                           packed["samples"] + packed["outliers"],
+                           packed["confidence"])
+
+  def RelativeCi(self):
+    """Returns the half width of the confidence interval in percent of the
+    mean."""
+    if not self.mean:
+      return 0.0
+    return 100.0 * (self.ci[1] - self.ci[0]) / 2 / abs(self.mean)
+
+
+class Comparison(object):
+  """Compares a benchmark result against a baseline with Welch's t-test."""
+
+  def __init__(self, result, baseline, significance):
+    self.result = result
+    self.baseline = baseline
+    self.delta = 0.0  # Relative change of the mean in percent.
+    if baseline.mean:
+      self.delta = 100.0 * (result.mean - baseline.mean) / abs(baseline.mean)
+    self.delta_ci = (0.0, 0.0)  # Confidence interval of |delta|.
+    if baseline.mean:
+      self.delta_ci = tuple(
+          100.0 * x / abs(baseline.mean)
+          for x in statistics.DifferenceConfidenceInterval(
+              result.samples, baseline.samples, result.confidence))
+    self.p_value = statistics.WelchTTest(result.samples, baseline.samples)
+    self.significant = self.p_value < significance
+    better = (result.mean > baseline.mean) == result.higher_is_better
+    if not self.significant or result.mean == baseline.mean:
+      self.verdict = "same"
+    elif better:
+      self.verdict = "improvement"
+    else:
+      self.verdict = "regression"
+
+  def IsRegression(self, threshold):
+    """Whether this is a significant regression of more than |threshold|
+    percent."""
+    return self.verdict == "regression" and abs(self.delta) > threshold
+
+  def Pack(self):
+    return {"baseline_mean": self.baseline.mean, "delta": self.delta,
+            "delta_ci": list(self.delta_ci), "p_value": self.p_value,
+            "verdict": self.verdict}
+
+
+def ScheduleRuns(prototypes, runs, warmup, shell_dirs=[None]):
+  """Returns copies of the tests in |prototypes| for |warmup| + |runs|
+  rounds and the set of ids of the warmup runs. Within a round, each test
+  runs with each of |shell_dirs|, the order of which alternates between
+  rounds, so that drifting machine noise affects all shells alike."""
+  tests = []
+  warmup_ids = set()
+  for i in xrange(warmup + runs):
+    order = shell_dirs if i % 2 == 0 else shell_dirs[::-1]
+    for prototype in prototypes:
+      for shell_dir in order:
+        test = prototype.CopyAddingFlags([])
+        test.id = len(tests)
+        test.shell_dir = shell_dir
+        if i < warmup:
+          warmup_ids.add(test.id)
+        tests.append(test)
+  return (tests, warmup_ids)
+
+
+def CollectResults(tests, warmup_ids, confidence):
+  """Collects the benchmark results of |tests| that have run, skipping the
+  warmup runs. Returns an ordered dict of BenchmarkResults by label and the
+  list of labels of benchmarks that failed."""
+  samples = collections.OrderedDict()
+  units = {}
+  failed = []
+  for test in tests:
+    name = test.GetLabel()
+    samples.setdefault(name, [])
+    if test.id in warmup_ids:
+      continue
+    result = None
+    if test.output is not None and not test.suite.HasUnexpectedOutput(test):
+      result = test.suite.GetBenchmarkResult(test)
+    if result is None:
+      if not name in failed:
+        failed.append(name)
+      continue
+    samples[name].append(result[0])
+    units[name] = result[1:]
+  results = collections.OrderedDict()
+  for (name, values) in samples.iteritems():
+    if name in failed or not values:
+      continue
+    (unit, higher_is_better) = units[name]
+    results[name] = BenchmarkResult(name, unit, higher_is_better, values,
+                                    confidence)
+  return (results, failed)
+
+
+def RunBenchmarks(suite, context, runs, warmup, jobs, progress_indicator,
+                  confidence):
+  """Runs each test of |suite| |warmup| + |runs| times and returns the
+  results as with CollectResults()."""
+  (suite.tests, warmup_ids) = ScheduleRuns(suite.tests, runs, warmup)
+  runner = execution.Runner([suite], progress_indicator, context,
+                            perf_data=False)
+  runner.Run(jobs)
+  return CollectResults(suite.tests, warmup_ids, confidence)
+
+
+def RunComparison(suite, context, baseline_shell_dir, runs, warmup, jobs,
+                  progress_indicator, confidence):
+  """Runs each test of |suite| with the shells in context.shell_dir and in
+  |baseline_shell_dir|, interleaved as in ScheduleRuns(). Returns the
+  results of both as with CollectResults() and the labels of the
+  benchmarks that failed with either."""
+  (suite.tests, warmup_ids) = ScheduleRuns(
+      suite.tests, runs, warmup, [None, baseline_shell_dir])
+  runner = execution.Runner([suite], progress_indicator, context,
+                            perf_data=False)
+  runner.Run(jobs)
+  (results, failed) = CollectResults(
+      [ t for t in suite.tests if t.shell_dir is None ], warmup_ids,
+      confidence)
+  (baseline, baseline_failed) = CollectResults(
+      [ t for t in suite.tests if t.shell_dir is not None ], warmup_ids,
+      confidence)
+  failed += [ name for name in baseline_failed if not name in failed ]
+  for name in failed:
+    results.pop(name, None)
+    baseline.pop(name, None)
+  return (results, baseline, failed)
@@ -26,6 +26,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import errno
 import os
 import signal
 import subprocess
@@ -63,6 +64,37 @@ def Win32SetErrorMode(mode):
   return prev_error_mode
 
 
+def WaitForProcess(process, block):
+  """Reaps |process| and returns a tuple (exit_code, resource_usage).
+
+  Returns (None, None) if the process is still running and |block| is False.
+  The resource usage is None on platforms without os.wait4().
+  """
+  if not hasattr(os, "wait4"):
+    if block:
+      return (process.wait(), None)
+    return (process.poll(), None)
+  options = 0
+  if not block:
+    options = os.WNOHANG
+  while True:
+    try:
+      (pid, status, rusage) = os.wait4(process.pid, options)
+      break
+    except OSError, e:
+      if e.errno != errno.EINTR:
+        raise
+  if pid == 0:
+    return (None, None)
+  if os.WIFSIGNALED(status):
+    exit_code = -os.WTERMSIG(status)
+  else:
+    exit_code = os.WEXITSTATUS(status)
+  # Let the Popen object know that the process has been reaped.
+  process.returncode = exit_code
+  return (exit_code, output.ResourceUsage.FromRusage(rusage))
+
+
 def RunProcess(verbose, timeout, args, **rest):
   if verbose: print "#", " ".join(args)
   popen_args = args
@@ -90,21 +122,22 @@ def RunProcess(verbose, timeout, args, **rest):
   # Repeatedly check the exit code from the process in a
   # loop and keep track of whether or not it times out.
   exit_code = None
+  resources = None
   sleep_time = INITIAL_SLEEP_TIME
   try:
     while exit_code is None:
       if (not end_time is None) and (time.time() >= end_time):
         # Kill the process and wait for it to exit.
         KillProcessWithID(process.pid)
-        exit_code = process.wait()
+        (exit_code, resources) = WaitForProcess(process, True)
         timed_out = True
       else:
-        exit_code = process.poll()
+        (exit_code, resources) = WaitForProcess(process, False)
         time.sleep(sleep_time)
         sleep_time = sleep_time * SLEEP_TIME_FACTOR
         if sleep_time > MAX_SLEEP_TIME:
           sleep_time = MAX_SLEEP_TIME
-    return (exit_code, timed_out)
+    return (exit_code, timed_out, resources)
   except KeyboardInterrupt:
     raise
 
@@ -135,7 +168,7 @@ def Execute(args, verbose=False, timeout=None):
   (fd_out, outname) = tempfile.mkstemp()
   (fd_err, errname) = tempfile.mkstemp()
   try:
-    (exit_code, timed_out) = RunProcess(
+    (exit_code, timed_out, resources) = RunProcess(
       verbose,
       timeout,
       args=args,
@@ -150,4 +183,4 @@ def Execute(args, verbose=False, timeout=None):
   errors = file(errname).read()
   CheckedUnlink(outname)
   CheckedUnlink(errname)
-  return output.Output(exit_code, timed_out, out, errors)
+  return output.Output(exit_code, timed_out, out, errors, resources)
@@ -26,26 +26,45 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import collections
 import multiprocessing
 import os
+import Queue
 import threading
 import time
 
 from . import commands
 from . import utils
+from ..network import perfdata
 
 
 BREAK_NOW = -1
 EXCEPTION = -2
+# Jobs that run a batch of tests get ids counting down from here, so they
+# can't collide with test ids.
+FIRST_BATCH_ID = -3
+# Limits for the number of tests in a batch and for the total length of
+# their flags, which end up on a single command line.
+MAX_BATCH_SIZE = 50
+MAX_BATCH_LENGTH = 16384
+
+
+# Memory (in KB) assumed for tests whose peak memory use hasn't been observed
+# in a previous run yet.
+DEFAULT_MEMORY_ESTIMATE = utils.MEMORY_PER_JOB // 1024
+# Number of queued jobs that are considered when the next job in line doesn't
+# fit into the memory budget.
+ADMISSION_WINDOW = 1000
 
 
 class Job(object):
-  def __init__(self, command, dep_command, test_id, timeout, verbose):
+  def __init__(self, command, dep_command, test_id, timeout, verbose, memory):
     self.command = command
     self.dep_command = dep_command
     self.id = test_id
     self.timeout = timeout
     self.verbose = verbose
+    self.memory = memory  # Predicted peak memory use in KB.
 
 
 def RunTest(job):
@@ -62,15 +81,148 @@ def RunTest(job):
     output = commands.Execute(job.command, job.verbose, job.timeout)
     return (job.id, output, time.time() - start_time)
   except KeyboardInterrupt:
-    return (-1, BREAK_NOW, 0)
+    return (job.id, BREAK_NOW, 0)
   except Exception, e:
     print(">>> EXCEPTION: %s" % e)
-    return (-1, EXCEPTION, 0)
+    return (job.id, EXCEPTION, 0)
+
+
+def PinWorker(cpus):
+  """Pool initializer that pins each worker, and thereby the tests it runs,
+  to the next CPU from the queue |cpus|."""
+  try:
+    utils.PinToCpu(cpus.get_nowait())
+  except Queue.Empty:
+    pass
+
+
+class JobThrottle(object):
+  """Hands jobs to the worker pool while at most |limit| of them are in
+  flight. In adaptive mode, the limit is lowered when the load average of
+  the machine or the rate of timeouts spikes, and raised again (up to the
+  initial number of jobs) when the machine is idle.
+
+  With a memory budget (in KB), a job is only admitted when the sum of the
+  predicted peak memory of all running jobs fits into the budget. Jobs
+  further down the queue that do fit are started in the meantime."""
+
+  ADAPT_INTERVAL = 5.0  # Seconds between adjustments of the limit.
+
+  def __init__(self, jobs, adaptive, memory_budget=0):
+    self.max_limit = jobs
+    self.limit = jobs
+    self.adaptive = adaptive
+    self.memory_budget = memory_budget
+    self.memory_in_use = 0
+    self.job_memory = {}  # Predicted memory of running jobs, keyed by id.
+    self.running = 0
+    self.terminated = False
+    self.cond = threading.Condition()
+    # The load average is system wide, so compare it against all CPUs of
+    # the host, not just the ones available to us.
+    self.host_cpus = multiprocessing.cpu_count()
+    self.last_adapt_time = time.time()
+    self.results = 0
+    self.timeouts = 0
+
+  def Feed(self, queue):
+    """Generator for Pool.imap_unordered() that blocks while the limit of
+    running jobs or the memory budget is reached. More jobs can be added
+    with AddJob() until the queue is empty and no job is running anymore."""
+    self.pending = collections.deque(queue)
+    while True:
+      with self.cond:
+        while True:
+          if self.terminated:
+            return
+          if not self.pending:
+            if self.running == 0:
+              return
+          elif self.running < self.limit:
+            index = self._FindAdmissibleJob(self.pending)
+            if index is not None:
+              break
+          self.cond.wait()
+        job = self.pending[index]
+        del self.pending[index]
+        self.running += 1
+        if self.memory_budget:
+          self.memory_in_use += job.memory
+          self.job_memory[job.id] = job.memory
+      yield job
+
+  def AddJob(self, job):
+    with self.cond:
+      self.pending.append(job)
+      self.cond.notify()
+
+  def DropPendingJobs(self):
+    """Removes all jobs that haven't been started yet and returns them."""
+    with self.cond:
+      dropped = list(self.pending)
+      self.pending.clear()
+      self.cond.notify()
+    return dropped
+
+  def _FindAdmissibleJob(self, pending):
+    """Returns the index into |pending| of the next job to start, or None."""
+    if not self.memory_budget or self.running == 0:
+      # Always admit a job into an idle pool, even if it exceeds the budget
+      # on its own.
+      return 0
+    available = self.memory_budget - self.memory_in_use
+    for index in xrange(min(len(pending), ADMISSION_WINDOW)):
+      if pending[index].memory <= available:
+        return index
+    return None
+
+  def JobDone(self, job_id, timed_out):
+    with self.cond:
+      self.running -= 1
+      if job_id in self.job_memory:
+        self.memory_in_use -= self.job_memory.pop(job_id)
+      if self.adaptive:
+        self._Adapt(timed_out)
+      self.cond.notify()
+
+  def Terminate(self):
+    """Unblocks Feed() so that the pool can shut down."""
+    with self.cond:
+      self.terminated = True
+      self.cond.notify_all()
+
+  def _Adapt(self, timed_out):
+    self.results += 1
+    if timed_out:
+      self.timeouts += 1
+    now = time.time()
+    if now - self.last_adapt_time < JobThrottle.ADAPT_INTERVAL:
+      return
+    load = 0.0
+    if hasattr(os, "getloadavg"):
+      load = os.getloadavg()[0]
+    # More than 5% timeouts are considered a spike.
+    if (self.timeouts * 20 > self.results or
+        load > 1.5 * self.host_cpus):
+      self.limit = max(1, self.limit * 3 // 4)
+    elif self.timeouts == 0 and load < 0.75 * self.host_cpus:
+      self.limit = min(self.max_limit, self.limit + 1)
+    self.last_adapt_time = now
+    self.results = 0
+    self.timeouts = 0
 
 
 class Runner(object):
 
-  def __init__(self, suites, progress_indicator, context):
+  def __init__(self, suites, progress_indicator, context, perf_data=True):
+    # Without |perf_data|, the durations and memory use of earlier runs are
+    # neither used nor updated, e.g. for throwaway tests.
+    if perf_data:
+      datapath = os.path.join("out", "testrunner_data")
+      self.perf_data_manager = perfdata.PerfDataManager(datapath)
+    else:
+      self.perf_data_manager = perfdata.NullPerfDataManager()
+    self.perfdata = self.perf_data_manager.GetStore(context.arch, context.mode)
     self.tests = [ t for s in suites for t in s.tests ]
     self._CommonInit(len(self.tests), progress_indicator, context)
 
@@ -90,69 +242,78 @@ class Runner(object):
     self.indicator.Starting()
     self._RunInternal(jobs)
     self.indicator.Done()
+    self.perf_data_manager.close()
     if self.failed or self.remaining:
       return 1
     return 0
 
   def _RunInternal(self, jobs):
-    pool = multiprocessing.Pool(processes=jobs)
-    test_map = {}
+    if self.context.cpus:
+      cpus = multiprocessing.Queue()
+      for i in xrange(jobs):
+        cpus.put(self.context.cpus[i % len(self.context.cpus)])
+      pool = multiprocessing.Pool(processes=jobs, initializer=PinWorker,
+                                  initargs=(cpus,))
+    else:
+      pool = multiprocessing.Pool(processes=jobs)
+    self.test_map = {}
+    self.batch_map = {}
+    self.next_batch_id = FIRST_BATCH_ID
     queue = []
     queued_exception = None
-    for test in self.tests:
-      assert test.id >= 0
-      test_map[test.id] = test
+    for tests in self._GroupTests():
       try:
-        command = self.GetCommand(test)
+        if len(tests) > 1:
+          queue.append(self._CreateBatchJob(tests))
+        else:
+          queue.append(self._CreateJob(tests[0]))
       except Exception, e:
         # If this failed, save the exception and re-raise it later (after
         # all other tests have had a chance to run).
         queued_exception = e
         continue
-      timeout = self.context.timeout
-      if ("--stress-opt" in test.flags or
-          "--stress-opt" in self.context.mode_flags or
-          "--stress-opt" in self.context.extra_flags):
-        timeout *= 4
-      if test.dependency is not None:
-        dep_command = [ c.replace(test.path, test.dependency) for c in command ]
-      else:
-        dep_command = None
-      job = Job(command, dep_command, test.id, timeout, self.context.verbose)
-      queue.append(job)
+    self.throttle = JobThrottle(jobs, self.context.adaptive_jobs,
+                                self.context.memory_budget)
+    throttle = self.throttle
     try:
       kChunkSize = 1
-      it = pool.imap_unordered(RunTest, queue, kChunkSize)
+      it = pool.imap_unordered(RunTest, throttle.Feed(queue), kChunkSize)
       for result in it:
         test_id = result[0]
-        if test_id < 0:
+        if result[1] == BREAK_NOW or result[1] == EXCEPTION:
+          throttle.JobDone(test_id, False)
+          self.batch_map.pop(test_id, None)
           if result[1] == BREAK_NOW:
             self.terminate = True
           else:
             continue
+        if test_id in self.batch_map:
+          self._BatchDone(test_id, result[1], result[2])
+          continue
         if self.terminate:
+          throttle.Terminate()
           pool.terminate()
           pool.join()
           raise BreakNowException("User pressed Ctrl+C or IO went wrong")
-        test = test_map[test_id]
-        self.indicator.AboutToRun(test)
+        test = self.test_map[test_id]
         test.output = result[1]
         test.duration = result[2]
-        has_unexpected_output = test.suite.HasUnexpectedOutput(test)
-        if has_unexpected_output:
-          self.failed.append(test)
-          if test.output.HasCrashed():
-            self.crashed += 1
-        else:
-          self.succeeded += 1
-        self.remaining -= 1
-        self.indicator.HasRun(test, has_unexpected_output)
+        try:
+          self.perfdata.UpdatePerfData(test)
+        except Exception:
+          pass  # Just keep working.
+        self._TestDone(test)
+        # Only mark the job as done after the indicator had the chance to
+        # add more tests, otherwise the pool might shut down prematurely.
+        throttle.JobDone(test_id, test.output.HasTimedOut())
     except KeyboardInterrupt:
+      throttle.Terminate()
       pool.terminate()
       pool.join()
       raise
     except Exception, e:
       print("Exception: %s" % e)
+      throttle.Terminate()
       pool.terminate()
       pool.join()
       raise
@@ -160,16 +321,146 @@ class Runner(object):
       raise queued_exception
     return
 
+  def _TestDone(self, test):
+    self.indicator.AboutToRun(test)
+    has_unexpected_output = test.suite.HasUnexpectedOutput(test)
+    if has_unexpected_output:
+      self.failed.append(test)
+      if test.output.HasCrashed():
+        self.crashed += 1
+    else:
+      self.succeeded += 1
+    self.remaining -= 1
+    self.indicator.HasRun(test, has_unexpected_output)
+
+  def _GroupTests(self):
+    """Yields lists of tests to run in one job. When context.batch_tests is
+    set, tests of a suite with the same batch key are grouped."""
+    batches = collections.OrderedDict()  # Batch key -> (tests, length)
+    for test in self.tests:
+      key = None
+      if self.context.batch_tests:
+        key = test.suite.GetBatchKey(test)
+      if key is None:
+        yield [test]
+        continue
+      key = (test.suite.name, test.shell_dir, key)
+      test_length = sum(len(flag) + 1 for flag in test.flags + [test.path])
+      (batch, length) = batches.get(key, ([], 0))
+      if batch and (len(batch) == MAX_BATCH_SIZE or
+                    length + test_length > MAX_BATCH_LENGTH):
+        yield batch
+        (batch, length) = ([], 0)
+      batches[key] = (batch + [test], length + test_length)
+    for (batch, length) in batches.itervalues():
+      yield batch
+
+  def _CreateBatchJob(self, tests):
+    batch_id = self.next_batch_id
+    self.next_batch_id -= 1
+    self.batch_map[batch_id] = tests
+    command = self.GetBatchCommand(tests)
+    # Give the batch the time its tests took in previous runs on top of the
+    # usual timeout. The tests of a batch run one after another in the same
+    # process, so it needs as much memory as the largest of them.
+    timeout = max(self._GetTimeout(test) for test in tests)
+    memory = 0
+    for test in tests:
+      timeout += self.perfdata.FetchPerfData(test) or 0
+      memory = max(memory, self.perfdata.FetchMaxRss(test) or 0)
+    return Job(command, None, batch_id, timeout, self.context.verbose,
+               memory or DEFAULT_MEMORY_ESTIMATE)
+
+  def _BatchDone(self, batch_id, output, duration):
+    """Maps the output of a batch back to its tests. If the batch failed as
+    a whole or any of its tests has unexpected output, it is split up (see
+    TestSuite.SplitBatch()) until the failing tests run on their own, so
+    that they get exact results."""
+    tests = self.batch_map.pop(batch_id)
+    outputs = tests[0].suite.GetBatchOutputs(tests, output)
+    if outputs is not None:
+      for (test, test_output) in zip(tests, outputs):
+        test.output = test_output
+        if test.suite.HasUnexpectedOutput(test):
+          outputs = None
+          break
+    if outputs is None:
+      for part in tests[0].suite.SplitBatch(tests):
+        if len(part) > 1:
+          self.throttle.AddJob(self._CreateBatchJob(part))
+        else:
+          self.throttle.AddJob(self._CreateJob(part[0]))
+    else:
+      for test in tests:
+        test.duration = duration / len(tests)
+        self._TestDone(test)
+    self.throttle.JobDone(batch_id, output.HasTimedOut())
+
+  def _CreateJob(self, test):
+    assert test.id >= 0
+    self.test_map[test.id] = test
+    command = self.GetCommand(test)
+    timeout = self._GetTimeout(test)
+    if test.dependency is not None:
+      dep_command = [ c.replace(test.path, test.dependency) for c in command ]
+    else:
+      dep_command = None
+    memory = self.perfdata.FetchMaxRss(test) or DEFAULT_MEMORY_ESTIMATE
+    return Job(command, dep_command, test.id, timeout, self.context.verbose,
+               memory)
+
+  def _GetTimeout(self, test):
+    timeout = self.context.timeout
+    if ("--stress-opt" in test.flags or
+        "--stress-opt" in self.context.mode_flags or
+        "--stress-opt" in self.context.extra_flags):
+      timeout *= 4
+    return timeout
+
+  def AddTest(self, test):
+    """Schedules |test|, which needs a fresh id, while the runner is running.
+    Must be called from the thread that processes the results, e.g. from
+    the progress indicator's HasRun()."""
+    assert test.id not in self.test_map
+    job = self._CreateJob(test)
+    self.total += 1
+    self.remaining += 1
+    self.throttle.AddJob(job)
+
+  def CancelPendingTests(self):
+    """Drops all tests that haven't been started yet. Returns their number."""
+    dropped = len(self.throttle.DropPendingJobs())
+    self.total -= dropped
+    self.remaining -= dropped
+    return dropped
+
+  def _GetShell(self, test):
+    shell = test.suite.shell()
+    if utils.IsWindows():
+      shell += ".exe"
+    shell_dir = test.shell_dir or self.context.shell_dir
+    return os.path.abspath(os.path.join(shell_dir, shell))
+
+  def GetBatchCommand(self, tests):
+    d8testflag = []
+    suite = tests[0].suite
+    shell = suite.shell()
+    if shell == "d8":
+      d8testflag = ["--test"]
+    cmd = (self.context.command_prefix +
+           [self._GetShell(tests[0])] +
+           d8testflag +
+           suite.GetFlagsForBatch(tests, self.context) +
+           self.context.extra_flags)
+    return cmd
 
   def GetCommand(self, test):
     d8testflag = []
     shell = test.suite.shell()
     if shell == "d8":
       d8testflag = ["--test"]
-    if utils.IsWindows():
-      shell += ".exe"
     cmd = (self.context.command_prefix +
-           [os.path.abspath(os.path.join(self.context.shell_dir, shell))] +
+           [self._GetShell(test)] +
            d8testflag +
            test.suite.GetFlagsForTestCase(test, self.context) +
            self.context.extra_flags)
@@ -27,23 +27,40 @@
 
 
 import xml.etree.ElementTree as xml
+from xml.sax import saxutils
 
 
 class JUnitTestOutput:
-  def __init__(self, test_suite_name):
-    self.root = xml.Element("testsuite")
-    self.root.attrib["name"] = test_suite_name
+  """Streams test results to |output| as they arrive, so that memory use
+  doesn't grow with the number of tests. |output| is a
+  progress.AsyncOutput, which keeps writes off the runner's main thread."""
 
-  def HasRunTest(self, test_name, test_duration, test_failure):
+  def __init__(self, test_suite_name, output):
+    self.output = output
+    self.output.Write("<?xml version='1.0' encoding='UTF-8'?>\n")
+    self.output.Write("<testsuite name=%s>" %
+                      saxutils.quoteattr(test_suite_name))
+
+  def HasRunTest(self, test_name, test_duration, test_failure,
+                 test_properties=None):
     testCaseElement = xml.Element("testcase")
     testCaseElement.attrib["name"] = " ".join(test_name)
     testCaseElement.attrib["time"] = str(round(test_duration, 3))
+    if test_properties:
+      propertiesElement = xml.Element("properties")
+      for (name, value) in test_properties:
+        propertyElement = xml.Element("property")
+        propertyElement.attrib["name"] = name
+        propertyElement.attrib["value"] = str(value)
+        propertiesElement.append(propertyElement)
+      testCaseElement.append(propertiesElement)
     if len(test_failure):
       failureElement = xml.Element("failure")
       failureElement.text = test_failure
       testCaseElement.append(failureElement)
-    self.root.append(testCaseElement)
+    # Lower-case "utf-8" keeps ElementTree from emitting an XML declaration.
+    self.output.Write(xml.tostring(testCaseElement, "utf-8"))
 
-  def FinishAndWrite(self, file):
-    xml.ElementTree(self.root).write(file, "UTF-8")
+  def Finish(self):
+    self.output.Write("</testsuite>")
 
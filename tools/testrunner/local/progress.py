@@ -26,10 +26,13 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import collections
 import sys
+import threading
 import time
 
 from . import junit_output
+from . import results_log
 
 def EscapeCommand(command):
   parts = []
@@ -60,24 +63,94 @@ class ProgressIndicator(object):
   def HasRun(self, test, has_unexpected_output):
     pass
 
-  def PrintFailureHeader(self, test):
+  def FormatFailureHeader(self, test):
     if test.suite.IsNegativeTest(test):
       negative_marker = '[negative] '
     else:
       negative_marker = ''
-    print "=== %(label)s %(negative)s===" % {
+    return "=== %(label)s %(negative)s===" % {
       'label': test.GetLabel(),
       'negative': negative_marker
     }
 
+  def PrintFailureHeader(self, test):
+    print self.FormatFailureHeader(test)
+
+
+class AsyncOutput(object):
+  """Writes to a stream from a background thread, so that the test runner's
+  main loop never blocks on a slow terminal or pipe.
+
+  At most MAX_PENDING chunks wait to be written. When the queue is full,
+  only the latest status line is kept, and other output waits for space."""
+
+  MAX_PENDING = 1000
+
+  def __init__(self, stream=None):
+    self.stream = stream or sys.stdout
+    self.chunks = collections.deque()
+    # The latest status line that didn't fit into the queue.
+    self.status = None
+    self.closed = False
+    self.cond = threading.Condition()
+    self.thread = threading.Thread(target=self._WriterThread)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Write(self, text):
+    with self.cond:
+      while len(self.chunks) >= self.MAX_PENDING:
+        self.cond.wait()
+      self.chunks.append(text)
+      self.cond.notify_all()
+
+  def WriteStatus(self, text):
+    """Writes |text|, which may be dropped if it is superseded by a later
+    status line before it could be written."""
+    with self.cond:
+      if len(self.chunks) >= self.MAX_PENDING:
+        self.status = text
+      else:
+        self.chunks.append(text)
+      self.cond.notify_all()
+
+  def Close(self):
+    """Writes all pending output and stops the writer thread."""
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+    self.thread.join()
+
+  def _WriterThread(self):
+    while True:
+      with self.cond:
+        while not self.chunks and not self.closed:
+          self.cond.wait()
+        chunks = list(self.chunks)
+        self.chunks.clear()
+        if self.status is not None:
+          # The status line is newer than everything in the full queue.
+          chunks.append(self.status)
+          self.status = None
+        closed = self.closed
+        self.cond.notify_all()
+      if chunks:
+        self.stream.write("".join(chunks))
+        self.stream.flush()
+      elif closed:
+        return
+
 
 class SimpleProgressIndicator(ProgressIndicator):
   """Abstract base class for {Verbose,Dots}ProgressIndicator"""
 
   def Starting(self):
     print 'Running %i tests' % self.runner.total
+    sys.stdout.flush()
+    self.output = AsyncOutput()
 
   def Done(self):
+    self.output.Close()
     print
     for failed in self.runner.failed:
       self.PrintFailureHeader(failed)
@@ -108,8 +181,7 @@ class SimpleProgressIndicator(ProgressIndicator):
 class VerboseProgressIndicator(SimpleProgressIndicator):
 
   def AboutToRun(self, test):
-    print 'Starting %s...' % test.GetLabel()
-    sys.stdout.flush()
+    self.output.Write('Starting %s...\n' % test.GetLabel())
 
   def HasRun(self, test, has_unexpected_output):
     if has_unexpected_output:
@@ -119,62 +191,75 @@ class VerboseProgressIndicator(SimpleProgressIndicator):
         outcome = 'FAIL'
     else:
       outcome = 'pass'
-    print 'Done running %s: %s' % (test.GetLabel(), outcome)
+    self.output.Write('Done running %s: %s\n' % (test.GetLabel(), outcome))
 
 
 class DotsProgressIndicator(SimpleProgressIndicator):
 
   def HasRun(self, test, has_unexpected_output):
     total = self.runner.succeeded + len(self.runner.failed)
+    text = ''
     if (total > 1) and (total % 50 == 1):
-      sys.stdout.write('\n')
+      text = '\n'
     if has_unexpected_output:
       if test.output.HasCrashed():
-        sys.stdout.write('C')
-        sys.stdout.flush()
+        text += 'C'
       elif test.output.HasTimedOut():
-        sys.stdout.write('T')
-        sys.stdout.flush()
+        text += 'T'
       else:
-        sys.stdout.write('F')
-        sys.stdout.flush()
+        text += 'F'
     else:
-      sys.stdout.write('.')
-      sys.stdout.flush()
+      text += '.'
+    self.output.Write(text)
 
 
 class CompactProgressIndicator(ProgressIndicator):
   """Abstract base class for {Color,Monochrome}ProgressIndicator"""
 
+  # Minimum number of seconds between two updates of the status line.
+  STATUS_INTERVAL = 0.2
+
   def __init__(self, templates):
     super(CompactProgressIndicator, self).__init__()
     self.templates = templates
     self.last_status_length = 0
+    self.last_status_time = 0
     self.start_time = time.time()
+    self.output = None
+
+  def Starting(self):
+    self.output = AsyncOutput()
 
   def Done(self):
     self.PrintProgress('Done')
-    print ""  # Line break.
+    self.output.Write("\n")  # Line break.
+    self.output.Close()
 
   def AboutToRun(self, test):
+    now = time.time()
+    if now - self.last_status_time < self.STATUS_INTERVAL:
+      return
+    self.last_status_time = now
     self.PrintProgress(test.GetLabel())
 
   def HasRun(self, test, has_unexpected_output):
     if has_unexpected_output:
-      self.ClearLine(self.last_status_length)
-      self.PrintFailureHeader(test)
+      lines = [self.ClearLine(self.last_status_length) +
+               self.FormatFailureHeader(test)]
       stdout = test.output.stdout.strip()
       if len(stdout):
-        print self.templates['stdout'] % stdout
+        lines.append(self.templates['stdout'] % stdout)
       stderr = test.output.stderr.strip()
       if len(stderr):
-        print self.templates['stderr'] % stderr
-      print "Command: %s" % EscapeCommand(self.runner.GetCommand(test))
+        lines.append(self.templates['stderr'] % stderr)
+      lines.append("Command: %s" % EscapeCommand(self.runner.GetCommand(test)))
       if test.output.HasCrashed():
-        print "exit code: %d" % test.output.exit_code
-        print "--- CRASHED ---"
+        lines.append("exit code: %d" % test.output.exit_code)
+        lines.append("--- CRASHED ---")
       if test.output.HasTimedOut():
-        print "--- TIMEOUT ---"
+        lines.append("--- TIMEOUT ---")
+      self.output.Write("\n".join(lines) + "\n")
+      self.last_status_length = 0
 
   def Truncate(self, string, length):
     if length and (len(string) > (length - 3)):
@@ -183,7 +268,7 @@ class CompactProgressIndicator(ProgressIndicator):
       return string
 
   def PrintProgress(self, name):
-    self.ClearLine(self.last_status_length)
+    clear = self.ClearLine(self.last_status_length)
     elapsed = time.time() - self.start_time
     status = self.templates['status_line'] % {
       'passed': self.runner.succeeded,
@@ -196,8 +281,7 @@ class CompactProgressIndicator(ProgressIndicator):
     }
     status = self.Truncate(status, 78)
     self.last_status_length = len(status)
-    print status,
-    sys.stdout.flush()
+    self.output.WriteStatus(clear + status)
 
 
 class ColorProgressIndicator(CompactProgressIndicator):
@@ -214,7 +298,7 @@ class ColorProgressIndicator(CompactProgressIndicator):
     super(ColorProgressIndicator, self).__init__(templates)
 
   def ClearLine(self, last_line_length):
-    print "\033[1K\r",
+    return "\033[1K\r"
 
 
 class MonochromeProgressIndicator(CompactProgressIndicator):
@@ -229,26 +313,40 @@ class MonochromeProgressIndicator(CompactProgressIndicator):
     super(MonochromeProgressIndicator, self).__init__(templates)
 
   def ClearLine(self, last_line_length):
-    print ("\r" + (" " * last_line_length) + "\r"),
+    return "\r" + (" " * last_line_length) + "\r"
 
 
 class JUnitTestProgressIndicator(ProgressIndicator):
 
   def __init__(self, progress_indicator, junitout, junittestsuite):
     self.progress_indicator = progress_indicator
-    self.outputter = junit_output.JUnitTestOutput(junittestsuite)
+    self.junittestsuite = junittestsuite
     if junitout:
       self.outfile = open(junitout, "w")
     else:
       self.outfile = sys.stdout
+    self.output = None
+    self.outputter = None
 
   def Starting(self):
     self.progress_indicator.runner = self.runner
     self.progress_indicator.Starting()
+    # Results for stdout go through the progress indicator's writer thread,
+    # so that they don't interleave with its output.
+    self.shares_output = False
+    if self.outfile == sys.stdout:
+      self.output = getattr(self.progress_indicator, "output", None)
+      self.shares_output = self.output is not None
+    if not self.shares_output:
+      self.output = AsyncOutput(self.outfile)
+    self.outputter = junit_output.JUnitTestOutput(self.junittestsuite,
+                                                  self.output)
 
   def Done(self):
+    self.outputter.Finish()
+    if not self.shares_output:
+      self.output.Close()
     self.progress_indicator.Done()
-    self.outputter.FinishAndWrite(self.outfile)
     if self.outfile != sys.stdout:
       self.outfile.close()
 
@@ -270,10 +368,42 @@ class JUnitTestProgressIndicator(ProgressIndicator):
         fail_text += "exit code: %d\n--- CRASHED ---" % test.output.exit_code
       if test.output.HasTimedOut():
         fail_text += "--- TIMEOUT ---"
+    properties = None
+    resources = test.output.resources
+    if resources is not None:
+      properties = [("user_time", round(resources.user_time, 3)),
+                    ("system_time", round(resources.system_time, 3)),
+                    ("max_rss_kb", resources.max_rss),
+                    ("voluntary_switches", resources.voluntary_switches),
+                    ("involuntary_switches", resources.involuntary_switches)]
     self.outputter.HasRunTest(
         [test.GetLabel()] + self.runner.context.mode_flags + test.flags,
         test.duration,
-        fail_text)
+        fail_text,
+        properties)
+
+
+class ResultsLogProgressIndicator(ProgressIndicator):
+
+  def __init__(self, progress_indicator, filename, arch, mode):
+    self.progress_indicator = progress_indicator
+    self.log = results_log.ResultsLog(filename, arch, mode)
+
+  def Starting(self):
+    self.progress_indicator.runner = self.runner
+    self.progress_indicator.Starting()
+
+  def Done(self):
+    self.progress_indicator.Done()
+    self.log.Close()
+
+  def AboutToRun(self, test):
+    self.progress_indicator.AboutToRun(test)
+
+  def HasRun(self, test, has_unexpected_output):
+    self.progress_indicator.HasRun(test, has_unexpected_output)
+    self.log.HasRunTest(test, test.suite.GetOutcome(test),
+                        has_unexpected_output)
 
 
 PROGRESS_INDICATORS = {
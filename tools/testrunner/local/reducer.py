@@ -0,0 +1,267 @@
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import re
+import shutil
+
+from . import execution
+from . import progress
+from ..objects import testcase
+
+
+# Comment lines that configure the test and are never removed from the
+# source. The flags are collected and reduced separately.
+FLAGS_PATTERN = re.compile(r"^//\s+Flags:(.*)$")
+HEADER_PATTERN = re.compile(r"^//\s+(Files|Env):")
+# String literals and line comments, which are ignored when counting braces.
+STRINGS_AND_COMMENTS_PATTERN = re.compile(
+    r"\"(\\.|[^\"\\])*\"|'(\\.|[^'\\])*'|//.*$")
+DEOPT_FLAG = "--deopt-every-n-times"
+
+
+def _SplitFlags(flags):
+  """Groups a list of flags into units that are dropped together, i.e. a
+  flag and the values that follow it."""
+  units = []
+  for flag in flags:
+    if units and not flag.startswith("-"):
+      units[-1].append(flag)
+    else:
+      units.append([flag])
+  return units
+
+
+def _BraceDelta(line):
+  line = STRINGS_AND_COMMENTS_PATTERN.sub("", line)
+  return (line.count("{") + line.count("(") + line.count("[") -
+          line.count("}") - line.count(")") - line.count("]"))
+
+
+def _SplitStatements(lines):
+  """Groups source lines into top-level statements, approximated by runs of
+  lines after which all brackets are balanced."""
+  units = []
+  current = []
+  depth = 0
+  for line in lines:
+    current.append(line)
+    depth += _BraceDelta(line)
+    if depth <= 0:
+      units.append(current)
+      current = []
+      depth = 0
+  if current:
+    units.append(current)
+  return units
+
+
+def _Flatten(units):
+  return [ item for unit in units for item in unit ]
+
+
+class _Candidates(object):
+  """Stands in for a test suite when handing candidates to the runner."""
+  def __init__(self, tests):
+    self.tests = tests
+
+
+class DeoptReducer(object):
+  """Minimizes a failing deopt fuzzing test case. The deopt point N of
+  --deopt-every-n-times is bisected first (a smaller N deopts more often,
+  which makes the failure more robust against changes to the source), then
+  the flags are dropped and the source is reduced, first by top-level
+  statements and then by lines, with the ddmin delta debugging algorithm.
+
+  A candidate reproduces the failure if it ends with the same outcome and
+  exit code as the original case. All candidates of a round run in parallel
+  on an execution.Runner. They are written next to the original test, with
+  copies of its sibling files such as expected output, so that the suite
+  finds these and relative paths resolve as for the test itself."""
+
+  def __init__(self, test, context, jobs, verbose=False):
+    self.test = test
+    self.suite = test.suite
+    self.context = context
+    self.jobs = jobs
+    self.verbose = verbose
+    self.outcome = test.suite.GetOutcome(test)
+    self.exit_code = test.output.exit_code
+    index = test.flags.index(DEOPT_FLAG)
+    self.n = int(test.flags[index + 1])
+    self.flags = test.flags[:index] + test.flags[index + 2:]
+    self.header = []
+    self.lines = []
+    self.basename = os.path.join(self.suite.root, test.path)
+    self.siblings = self._FindSiblings()
+    with open(self.basename + self.suite.suffix()) as f:
+      for line in f.read().splitlines():
+        match = FLAGS_PATTERN.match(line)
+        if match:
+          self.flags += match.group(1).strip().split()
+        elif HEADER_PATTERN.match(line):
+          self.header.append(line)
+        else:
+          self.lines.append(line)
+    self.rounds = 0
+    self.runs = 0
+
+  def _Source(self, n, flags, lines):
+    flags = flags + [DEOPT_FLAG, "%d" % n] if n else flags
+    source = list(self.header)
+    if flags:
+      source.append("// Flags: %s" % " ".join(flags))
+    return "\n".join(source + lines) + "\n"
+
+  def _Run(self, candidates):
+    """Runs the (n, flags, lines) |candidates| in parallel and returns for
+    each of them whether it reproduces the failure."""
+    self.rounds += 1
+    self.runs += len(candidates)
+    tests = []
+    files = []
+    try:
+      for (i, (n, flags, lines)) in enumerate(candidates):
+        path = "%s.deopt-reducer-%d-%d-%d" % (self.test.path, os.getpid(),
+                                              self.rounds, i)
+        filename = os.path.join(self.suite.root, path)
+        files.append(filename + self.suite.suffix())
+        with open(files[-1], "w") as f:
+          f.write(self._Source(None, flags, lines))
+        for sibling in self.siblings:
+          files.append(filename + sibling)
+          shutil.copyfile(self.basename + sibling, files[-1])
+        test = testcase.TestCase(self.suite, path, [DEOPT_FLAG, "%d" % n])
+        test.outcomes = self.test.outcomes
+        test.id = i
+        tests.append(test)
+      runner = execution.Runner([_Candidates(tests)],
+                                progress.ProgressIndicator(), self.context,
+                                perf_data=False)
+      runner.Run(self.jobs)
+    finally:
+      for filename in files:
+        if os.path.exists(filename):
+          os.remove(filename)
+    if runner.terminate:
+      raise KeyboardInterrupt
+    return [ self._Reproduces(t) for t in tests ]
+
+  def _FindSiblings(self):
+    """Returns the name endings of the files next to the test that are
+    named after it, e.g. "-expected.txt"."""
+    (dirname, name) = os.path.split(self.basename)
+    return [ f[len(name):] for f in sorted(os.listdir(dirname))
+             if f.startswith(name) and not f.endswith(self.suite.suffix())
+             and ".deopt-reducer-" not in f ]
+
+  def _Reproduces(self, test):
+    return (test.output is not None and
+            self.suite.GetOutcome(test) == self.outcome and
+            test.output.exit_code == self.exit_code)
+
+  def _ReduceDeoptCount(self):
+    """Bisects the smallest N that still fails, probing up to |jobs| points
+    of the remaining interval per round."""
+    low = 0
+    high = self.n
+    while high - low > 1:
+      count = min(self.jobs, high - low - 1)
+      probes = sorted(set(low + (high - low) * (i + 1) // (count + 1)
+                          for i in xrange(count)))
+      results = self._Run([ (n, self.flags, self.lines) for n in probes ])
+      failing = [ n for (n, result) in zip(probes, results) if result ]
+      if failing:
+        high = failing[0]
+        passing = [ n for (n, result) in zip(probes, results)
+                    if not result and n < high ]
+        if passing:
+          low = passing[-1]
+      else:
+        low = probes[-1]
+    self.n = high
+
+  def _DeltaDebug(self, units, candidate):
+    """Minimizes the list |units| with ddmin. |candidate| maps a list of
+    units to an (n, flags, lines) candidate. All subsets and complements of
+    a partition are tried in one parallel round."""
+    if self._Run([ candidate([]) ])[0]:
+      return []
+    granularity = 2
+    while len(units) >= 2:
+      granularity = min(granularity, len(units))
+      bounds = [ len(units) * i // granularity
+                 for i in xrange(granularity + 1) ]
+      subsets = [ units[bounds[i]:bounds[i + 1]]
+                  for i in xrange(granularity) ]
+      complements = []
+      if granularity > 2:
+        complements = [ units[:bounds[i]] + units[bounds[i + 1]:]
+                        for i in xrange(granularity) ]
+      results = self._Run([ candidate(c) for c in subsets + complements ])
+      if True in results[:granularity]:
+        units = subsets[results.index(True)]
+        granularity = 2
+      elif True in results[granularity:]:
+        units = complements[results.index(True, granularity) - granularity]
+        granularity = max(granularity - 1, 2)
+      elif granularity == len(units):
+        break
+      else:
+        granularity = min(2 * granularity, len(units))
+    return units
+
+  def Reduce(self, outdir):
+    """Reduces the test case and writes the reproducer into |outdir|.
+    Returns the name of the reproducer, or None if the failure couldn't be
+    reproduced."""
+    if not self._Run([ (self.n, self.flags, self.lines) ])[0]:
+      return None
+    (n, num_flags, num_lines) = (self.n, len(self.flags), len(self.lines))
+    self._ReduceDeoptCount()
+    self.flags = _Flatten(self._DeltaDebug(
+        _SplitFlags(self.flags),
+        lambda units: (self.n, _Flatten(units), self.lines)))
+    self.lines = _Flatten(self._DeltaDebug(
+        _SplitStatements(self.lines),
+        lambda units: (self.n, self.flags, _Flatten(units))))
+    self.lines = self._DeltaDebug(
+        self.lines, lambda units: (self.n, self.flags, units))
+    if self.verbose:
+      print ("%s: N %d -> %d, %d -> %d flags, %d -> %d lines "
+             "(%d rounds, %d runs)" %
+             (self.test.GetLabel(), n, self.n, num_flags, len(self.flags),
+              num_lines, len(self.lines), self.rounds, self.runs))
+    if not os.path.exists(outdir):
+      os.makedirs(outdir)
+    filename = os.path.join(outdir, "%s%s" % (
+        self.test.GetLabel().replace("/", "-"), self.suite.suffix()))
+    with open(filename, "w") as f:
+      f.write(self._Source(self.n, self.flags, self.lines))
+    return filename
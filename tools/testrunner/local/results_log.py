@@ -0,0 +1,94 @@
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import json
+import os
+import time
+
+
+# Number of characters of stdout/stderr kept per test in the log.
+MAX_OUTPUT_LENGTH = 1024
+
+
+def _Truncate(output):
+  """Keeps the end of |output|, which usually holds the interesting part."""
+  if len(output) > MAX_OUTPUT_LENGTH:
+    output = "..." + output[-MAX_OUTPUT_LENGTH:]
+  # Crashing tests can print arbitrary bytes.
+  return output.decode("utf-8", "replace")
+
+
+class ResultsLog(object):
+  """Appends one JSON record per test result to a log file. Several runs
+  can share the same file; records of one run carry the same run id."""
+
+  def __init__(self, filename, arch, mode):
+    self.file = open(filename, "a")
+    self.run_id = "%d.%d" % (time.time() * 1000, os.getpid())
+    self.arch = arch
+    self.mode = mode
+
+  def HasRunTest(self, test, outcome, unexpected):
+    output = test.output
+    record = {
+      "run": self.run_id,
+      "arch": self.arch,
+      "mode": self.mode,
+      "name": test.GetLabel(),
+      "flags": test.flags,
+      "outcome": outcome,
+      "unexpected": unexpected,
+      "duration": round(test.duration, 3),
+      "exit_code": output.exit_code,
+      "stdout": _Truncate(output.stdout),
+      "stderr": _Truncate(output.stderr),
+    }
+    if output.resources is not None:
+      record["cpu_time"] = round(output.resources.CpuTime(), 3)
+      record["max_rss"] = output.resources.max_rss
+    # Write whole lines and flush them, so that readers see each result as
+    # it arrives and nothing is lost if the runner dies.
+    self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+    self.file.flush()
+
+  def Close(self):
+    self.file.close()
+
+
+def ReadRecords(filename, offset=0):
+  """Yields (record, end_offset) for all complete records in |filename|
+  starting at byte |offset|. A partially written last line is skipped, so
+  reading can be resumed at the returned offset later."""
+  with open(filename, "rb") as f:
+    f.seek(offset)
+    for line in f:
+      if not line.endswith("\n"):
+        return
+      offset += len(line)
+      yield (json.loads(line), offset)
@@ -0,0 +1,188 @@
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import math
+
+
+# Observations whose modified z-score exceeds this are outliers (Iglewicz
+# and Hoaglin).
+OUTLIER_Z_SCORE = 3.5
+
+
+def Mean(values):
+  return sum(values) / float(len(values))
+
+
+def Median(values):
+  values = sorted(values)
+  middle = len(values) // 2
+  if len(values) % 2:
+    return values[middle]
+  return (values[middle - 1] + values[middle]) / 2.0
+
+
+def Variance(values):
+  """Returns the sample variance of |values|."""
+  if len(values) < 2:
+    return 0.0
+  mean = Mean(values)
+  return sum((x - mean) ** 2 for x in values) / (len(values) - 1)
+
+
+def StandardDeviation(values):
+  return math.sqrt(Variance(values))
+
+
+def RejectOutliers(values):
+  """Splits |values| into (kept, outliers) using the modified z-score, which
+  is based on the median absolute deviation and robust against the outliers
+  themselves."""
+  if len(values) < 3:
+    return (list(values), [])
+  median = Median(values)
+  mad = Median([ abs(x - median) for x in values ])
+  if mad == 0:
+    return (list(values), [])
+  kept = []
+  outliers = []
+  for x in values:
+    if 0.6745 * abs(x - median) / mad > OUTLIER_Z_SCORE:
+      outliers.append(x)
+    else:
+      kept.append(x)
+  return (kept, outliers)
+
+
+def _BetaContinuedFraction(a, b, x):
+  """Evaluates the continued fraction of the incomplete beta function with
+  the modified Lentz method."""
+  tiny = 1e-300
+  c = 1.0
+  d = 1.0 - (a + b) * x / (a + 1.0)
+  if abs(d) < tiny:
+    d = tiny
+  d = 1.0 / d
+  result = d
+  for m in xrange(1, 300):
+    for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                      -(a + m) * (a + b + m) * x /
+                      ((a + 2 * m) * (a + 2 * m + 1))):
+      d = 1.0 + numerator * d
+      if abs(d) < tiny:
+        d = tiny
+      c = 1.0 + numerator / c
+      if abs(c) < tiny:
+        c = tiny
+      d = 1.0 / d
+      delta = c * d
+      result *= delta
+    if abs(delta - 1.0) < 1e-12:
+      break
+  return result
+
+
+def RegularizedIncompleteBeta(a, b, x):
+  if x <= 0.0:
+    return 0.0
+  if x >= 1.0:
+    return 1.0
+  front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                   a * math.log(x) + b * math.log(1.0 - x))
+  if x < (a + 1.0) / (a + b + 2.0):
+    return front * _BetaContinuedFraction(a, b, x) / a
+  return 1.0 - front * _BetaContinuedFraction(b, a, 1.0 - x) / b
+
+
+def StudentTTwoSidedP(t, df):
+  """Returns the probability of a |t| statistic at least this large under
+  Student's t-distribution with |df| degrees of freedom."""
+  if df <= 0:
+    return 1.0
+  return RegularizedIncompleteBeta(df / 2.0, 0.5, df / (df + t * t))
+
+
+def StudentTQuantile(confidence, df):
+  """Returns t such that a two-sided interval [-t, t] covers |confidence|
+  of Student's t-distribution with |df| degrees of freedom."""
+  low = 0.0
+  high = 1000.0
+  for _ in xrange(100):
+    middle = (low + high) / 2.0
+    if StudentTTwoSidedP(middle, df) > 1.0 - confidence:
+      low = middle
+    else:
+      high = middle
+  return (low + high) / 2.0
+
+
+def ConfidenceInterval(values, confidence=0.95):
+  """Returns the (low, high) confidence interval of the mean of |values|."""
+  mean = Mean(values)
+  if len(values) < 2:
+    return (mean, mean)
+  half = (StudentTQuantile(confidence, len(values) - 1) *
+          StandardDeviation(values) / math.sqrt(len(values)))
+  return (mean - half, mean + half)
+
+
+def _WelchStatistics(values1, values2):
+  """Returns the squared standard error of the difference of the means of
+  |values1| and |values2| and its Welch-Satterthwaite degrees of freedom."""
+  se1 = Variance(values1) / len(values1)
+  se2 = Variance(values2) / len(values2)
+  if se1 + se2 == 0:
+    return (0.0, None)
+  df = (se1 + se2) ** 2 / (se1 ** 2 / (len(values1) - 1) +
+                           se2 ** 2 / (len(values2) - 1))
+  return (se1 + se2, df)
+
+
+def WelchTTest(values1, values2):
+  """Returns the two-sided p-value of Welch's t-test for the hypothesis
+  that |values1| and |values2| have the same mean."""
+  if len(values1) < 2 or len(values2) < 2:
+    return 1.0
+  (variance, df) = _WelchStatistics(values1, values2)
+  if variance == 0:
+    return 1.0 if Mean(values1) == Mean(values2) else 0.0
+  t = (Mean(values1) - Mean(values2)) / math.sqrt(variance)
+  return StudentTTwoSidedP(t, df)
+
+
+def DifferenceConfidenceInterval(values1, values2, confidence=0.95):
+  """Returns the (low, high) confidence interval of the difference of the
+  means of |values1| and |values2|, without assuming equal variances."""
+  difference = Mean(values1) - Mean(values2)
+  if len(values1) < 2 or len(values2) < 2:
+    return (difference, difference)
+  (variance, df) = _WelchStatistics(values1, values2)
+  if variance == 0:
+    return (difference, difference)
+  half = StudentTQuantile(confidence, df) * math.sqrt(variance)
+  return (difference - half, difference + half)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.insert(0, TOOLS_DIR)
+
+from testrunner.local import execution
+from testrunner.local import progress
+from testrunner.local import reducer
+from testrunner.local import statusfile
+from testrunner.local import testsuite
+from testrunner.objects import context
+from testrunner.objects import testcase
+
+
+# Prints the expected output of the test, unless the test calls broken()
+# with natives syntax and deopts at least every 7th time.
+FAKE_D8 = """#!%s
+import sys
+args = sys.argv[1:]
+test = [ a for a in args if a.endswith(".js") and "standalone" not in a ][0]
+n = int(args[args.index("--deopt-every-n-times") + 1])
+if ("broken();" in open(test).read().splitlines() and
+    "--allow-natives-syntax" in args and n <= 7):
+  print "FAIL broken"
+else:
+  print "PASS a is 1"
+""" % sys.executable
+
+TEST_SOURCE = """// Flags: --allow-natives-syntax --nouse-inlining
+var a = 1;
+function f() {
+  return a;
+}
+broken();
+f();
+"""
+
+
+class DeoptReducerTest(unittest.TestCase):
+  def setUp(self):
+    self.workspace = tempfile.mkdtemp(prefix="test-reducer-")
+    self.cwd = os.getcwd()
+    os.chdir(self.workspace)
+    self.root = os.path.join(self.workspace, "webkit")
+    os.makedirs(os.path.join(self.root, "resources"))
+    os.makedirs(os.path.join(self.root, "fast"))
+    shutil.copy(os.path.join(TOOLS_DIR, "..", "test", "webkit", "testcfg.py"),
+                self.root)
+    for name in ["standalone-pre.js", "standalone-post.js"]:
+      open(os.path.join(self.root, "resources", name), "w").close()
+    with open(os.path.join(self.root, "fast", "case.js"), "w") as f:
+      f.write(TEST_SOURCE)
+    with open(os.path.join(self.root, "fast", "case-expected.txt"), "w") as f:
+      f.write("# Expected output.\nPASS a is 1\n")
+    shell_dir = os.path.join(self.workspace, "out")
+    os.makedirs(shell_dir)
+    shell = os.path.join(shell_dir, "d8")
+    with open(shell, "w") as f:
+      f.write(FAKE_D8)
+    os.chmod(shell, stat.S_IRWXU)
+    self.context = context.Context("x64", "release", shell_dir, [], False, 60,
+                                   False, [], [], False, False, 0, False, [],
+                                   False)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.workspace)
+
+  def testReduceWebkitCase(self):
+    suite = testsuite.TestSuite.LoadTestSuite(self.root)
+    test = testcase.TestCase(suite, "fast/case",
+                             [reducer.DEOPT_FLAG, "5"])
+    test.id = 0
+    suite.tests = [test]
+    runner = execution.Runner([suite], progress.ProgressIndicator(),
+                              self.context, perf_data=False)
+    runner.Run(1)
+    self.assertEquals(statusfile.FAIL, suite.GetOutcome(test))
+
+    outdir = os.path.join(self.workspace, "reduced")
+    filename = reducer.DeoptReducer(test, self.context, 2).Reduce(outdir)
+    with open(filename) as f:
+      self.assertEquals(
+          "// Flags: --allow-natives-syntax --deopt-every-n-times 1\n"
+          "broken();\n", f.read())
+    # Candidates are cleaned up and no performance data is recorded.
+    self.assertEquals(["case-expected.txt", "case.js"],
+                      sorted(os.listdir(os.path.join(self.root, "fast"))))
+    self.assertFalse(os.path.exists(os.path.join("out", "testrunner_data")))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,319 @@
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+# Provisioning of the test data that some test suites download.
+#
+# Archives are kept in a content addressed cache, in the directory named by
+# $V8_TEST_DATA_CACHE (default: ~/.cache/v8-test-data). The cache can be
+# pre-seeded by dropping archives with their usual names into it; archives
+# found in the suite directories are picked up as well. With
+# $V8_TEST_DATA_OFFLINE set, missing archives are an error instead of being
+# downloaded. Extraction is incremental: only members that differ from the
+# files on disk are written, and files of an older version of the data are
+# removed. A manifest in the cache directory remembers the archive extracted
+# into each target directory and its files, so that data that is up to date
+# is skipped without looking at the files.
+
+
+import hashlib
+import json
+import os
+import Queue
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import urllib
+
+
+CACHE_DIR_ENV = "V8_TEST_DATA_CACHE"
+OFFLINE_ENV = "V8_TEST_DATA_OFFLINE"
+CHUNK_SIZE = 1 << 20
+
+
+def HashFile(filename, algorithm="sha1"):
+  digest = hashlib.new(algorithm)
+  with open(filename, "rb") as f:
+    while True:
+      chunk = f.read(CHUNK_SIZE)
+      if not chunk:
+        break
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def DownloadUrl(url):
+  """Returns a fetch function for DataArchive that downloads |url|."""
+  def Fetch(filename):
+    print "Downloading test data from %s ..." % url
+    urllib.urlretrieve(url, filename)
+  return Fetch
+
+
+def PackCheckout(command, directory, arcname):
+  """Returns a fetch function for DataArchive that runs the checkout
+  |command| in a temporary directory and packs the checked out |directory|
+  as |arcname| into a .tar.gz archive."""
+  def Fetch(filename):
+    tmpdir = tempfile.mkdtemp(prefix="testdata-")
+    try:
+      print "Running %s ..." % command
+      code = subprocess.call(command, shell=True, cwd=tmpdir)
+      if code != 0:
+        raise Exception("Error running %s" % command)
+      with tarfile.open(filename, "w:gz") as tar:
+        tar.add(os.path.join(tmpdir, directory), arcname)
+    finally:
+      shutil.rmtree(tmpdir, ignore_errors=True)
+  return Fetch
+
+
+class DataArchive(object):
+  """An archive with test data.
+  key: identifies the data in |target| across versions, e.g. "test262"
+  name: file name of this version of the archive
+  target: directory to extract the archive into
+  fetch: function that creates the archive at a given file name
+  md5: expected MD5 digest of the archive, if known
+  strip_prefix: leading directory of the members that is dropped
+  seed_dirs: directories in which a copy of the archive may already exist
+    (default: |target|)
+  """
+  def __init__(self, key, name, target, fetch, md5=None, strip_prefix=None,
+               seed_dirs=None):
+    self.key = key
+    self.name = name
+    self.target = target
+    self.fetch = fetch
+    self.md5 = md5
+    self.strip_prefix = strip_prefix
+    self.seed_dirs = seed_dirs or [target]
+
+
+class ArchiveCache(object):
+  """Stores archives under their SHA-1 digest, with an index that maps the
+  names of archives to digests."""
+
+  def __init__(self, directory):
+    self.directory = directory
+    if not os.path.exists(directory):
+      os.makedirs(directory)
+    self.index_file = os.path.join(directory, "index.json")
+    self.lock = threading.Lock()
+
+  def _ReadIndex(self):
+    if not os.path.exists(self.index_file):
+      return {}
+    with open(self.index_file) as f:
+      return json.load(f)
+
+  def Lookup(self, name):
+    """Returns the file name of the cached archive |name|, or None."""
+    with self.lock:
+      digest = self._ReadIndex().get(name)
+    if digest is not None:
+      filename = os.path.join(self.directory, digest)
+      if os.path.exists(filename):
+        return filename
+    return None
+
+  def Store(self, archive, filename, move=False):
+    """Verifies |filename| against the MD5 digest of |archive| and adds it
+    to the cache. Returns the name of the cached file."""
+    if archive.md5 and HashFile(filename, "md5") != archive.md5:
+      raise Exception("Hash mismatch of test data file %s" % filename)
+    digest = HashFile(filename)
+    cached = os.path.join(self.directory, digest)
+    if not os.path.exists(cached):
+      if move:
+        shutil.move(filename, cached + ".tmp")
+      else:
+        shutil.copyfile(filename, cached + ".tmp")
+      os.rename(cached + ".tmp", cached)
+    with self.lock:
+      index = self._ReadIndex()
+      index[archive.name] = digest
+      with open(self.index_file + ".tmp", "w") as f:
+        json.dump(index, f, indent=2)
+      if os.path.exists(self.index_file) and sys.platform == "win32":
+        os.remove(self.index_file)
+      os.rename(self.index_file + ".tmp", self.index_file)
+    return cached
+
+
+def _ManifestFile(archive, cache):
+  # Checkouts share the cache, so the manifest is named after the target.
+  target = hashlib.sha1(os.path.abspath(archive.target)).hexdigest()
+  return os.path.join(cache.directory,
+                      "manifest-%s-%s.json" % (archive.key, target[:16]))
+
+
+def _OldManifestFile(archive):
+  # Manifests used to be kept in the target directory.
+  return os.path.join(archive.target, ".testdata-%s.json" % archive.key)
+
+
+def _ReadManifest(archive, cache):
+  filename = _ManifestFile(archive, cache)
+  if not os.path.exists(filename):
+    filename = _OldManifestFile(archive)
+    if not os.path.exists(filename):
+      return {"name": None, "digest": None, "files": []}
+  with open(filename) as f:
+    return json.load(f)
+
+
+def _IsUpToDate(archive, cache, manifest):
+  """Returns whether the archive in the manifest is |archive|, as far as the
+  cache knows, without looking at the extracted files."""
+  if (manifest["name"] != archive.name or
+      not os.path.isdir(archive.target)):
+    return False
+  cached = cache.Lookup(archive.name)
+  return (cached is None or
+          os.path.basename(cached) == manifest.get("digest"))
+
+
+def _Extract(archive, filename, old_files):
+  """Extracts the members of |filename| that differ from the files in the
+  target directory. Returns the names of all members and the number of
+  members that were written."""
+  target = archive.target
+  if sys.platform in ("win32", "cygwin"):
+    # Magic incantation to allow longer path names on Windows.
+    target = u"\\\\?\\%s" % os.path.abspath(target)
+  names = []
+  written = 0
+  with tarfile.open(filename, "r|*") as tar:
+    for member in tar:
+      name = member.name
+      if archive.strip_prefix:
+        if not name.startswith(archive.strip_prefix):
+          continue
+        name = name[len(archive.strip_prefix):]
+      name = name.strip("/")
+      if not name or os.path.isabs(name) or ".." in name.split("/"):
+        continue
+      if member.islnk():
+        # Hard links refer to other members by their name in the archive.
+        linkname = member.linkname
+        if archive.strip_prefix:
+          if not linkname.startswith(archive.strip_prefix):
+            continue
+          linkname = linkname[len(archive.strip_prefix):]
+        member.linkname = linkname.strip("/")
+      names.append(name)
+      path = os.path.join(target, name)
+      if member.isdir() and os.path.isdir(path):
+        continue
+      if member.isfile() and os.path.isfile(path):
+        stat = os.stat(path)
+        if stat.st_size == member.size and int(stat.st_mtime) == member.mtime:
+          continue
+      member.name = name
+      tar.extract(member, target)
+      written += 1
+  for name in set(old_files) - set(names):
+    path = os.path.join(target, name)
+    if os.path.isfile(path) or os.path.islink(path):
+      os.remove(path)
+  return (names, written)
+
+
+def Provision(archive, cache, offline=False):
+  """Makes sure that the contents of |archive| are extracted into its target
+  directory, fetching the archive if it isn't cached."""
+  manifest = _ReadManifest(archive, cache)
+  if _IsUpToDate(archive, cache, manifest):
+    return
+  filename = cache.Lookup(archive.name)
+  if filename is None:
+    for directory in archive.seed_dirs + [cache.directory]:
+      seeded = os.path.join(directory, archive.name)
+      if os.path.exists(seeded):
+        filename = cache.Store(archive, seeded)
+        break
+  if filename is None:
+    if offline:
+      raise Exception("Test data %s is not cached and %s is set" %
+                      (archive.name, OFFLINE_ENV))
+    (handle, download) = tempfile.mkstemp(dir=cache.directory,
+                                          suffix=".download")
+    os.close(handle)
+    try:
+      archive.fetch(download)
+      filename = cache.Store(archive, download, move=True)
+    finally:
+      if os.path.exists(download):
+        os.remove(download)
+  print "Extracting %s ..." % archive.name
+  if not os.path.exists(archive.target):
+    os.makedirs(archive.target)
+  (names, written) = _Extract(archive, filename, manifest["files"])
+  with open(_ManifestFile(archive, cache), "w") as f:
+    json.dump({"name": archive.name, "digest": os.path.basename(filename),
+               "files": names}, f)
+  if os.path.exists(_OldManifestFile(archive)):
+    os.remove(_OldManifestFile(archive))
+  print "Extracted %s: %d of %d members written" % (archive.name, written,
+                                                   len(names))
+
+
+def ProvisionAll(archives, jobs=1):
+  """Provisions |archives| on |jobs| threads in parallel."""
+  if not archives:
+    return
+  cache_dir = os.environ.get(CACHE_DIR_ENV) or os.path.join(
+      os.path.expanduser("~"), ".cache", "v8-test-data")
+  cache = ArchiveCache(cache_dir)
+  offline = bool(os.environ.get(OFFLINE_ENV))
+  queue = Queue.Queue()
+  for archive in archives:
+    queue.put(archive)
+  errors = []
+  def Worker():
+    while True:
+      try:
+        archive = queue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        Provision(archive, cache, offline)
+      except Exception, e:
+        errors.append(e)
+  threads = [ threading.Thread(target=Worker)
+              for _ in xrange(max(1, min(jobs, len(archives)))) ]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
@@ -30,6 +30,7 @@ import imp
 import os
 
 from . import statusfile
+from . import testdata
 from . import utils
 
 class TestSuite(object):
@@ -79,8 +80,13 @@ class TestSuite(object):
       return [[]]
     return default_flags
 
+  def GetDataArchives(self):
+    """Returns the testdata.DataArchive objects with the data this suite
+    needs to download."""
+    return []
+
   def DownloadData(self):
-    pass
+    testdata.ProvisionAll(self.GetDataArchives())
 
   def ReadStatusFile(self, variables):
     (self.rules, self.wildcards) = \
@@ -158,6 +164,31 @@ class TestSuite(object):
   def GetSourceForTest(self, testcase):
     return "(no source available)"
 
+  def GetBatchKey(self, testcase):
+    """Returns None if |testcase| can't run together with other tests in a
+    single shell process. Otherwise, consecutive test cases with the same
+    key can be batched, see GetFlagsForBatch()."""
+    return None
+
+  def GetFlagsForBatch(self, testcases, context):
+    raise NotImplementedError
+
+  def GetBatchOutputs(self, testcases, output):
+    """Splits the output of a batch into one Output per test case. Returns
+    None if that isn't possible, e.g. because the batch crashed."""
+    raise NotImplementedError
+
+  def SplitBatch(self, testcases):
+    """Splits a failed batch into parts that are run again to find the
+    failing test cases. Parts with a single test case run on their own."""
+    half = len(testcases) // 2
+    return [testcases[:half], testcases[half:]]
+
+  def GetBenchmarkResult(self, testcase):
+    """Returns (value, unit, higher_is_better) for the result printed by a
+    benchmark that has run, or None if the output doesn't contain one."""
+    return None
+
   def IsFailureOutput(self, output, testpath):
     return output.exit_code != 0
 
@@ -171,15 +202,18 @@ class TestSuite(object):
     else:
       return execution_failed
 
-  def HasUnexpectedOutput(self, testcase):
+  def GetOutcome(self, testcase):
     if testcase.output.HasCrashed():
-      outcome = statusfile.CRASH
+      return statusfile.CRASH
     elif testcase.output.HasTimedOut():
-      outcome = statusfile.TIMEOUT
+      return statusfile.TIMEOUT
     elif self.HasFailed(testcase):
-      outcome = statusfile.FAIL
+      return statusfile.FAIL
     else:
-      outcome = statusfile.PASS
+      return statusfile.PASS
+
+  def HasUnexpectedOutput(self, testcase):
+    outcome = self.GetOutcome(testcase)
     if not testcase.outcomes:
       return outcome != statusfile.PASS
     return not outcome in testcase.outcomes
@@ -26,12 +26,15 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import math
+import multiprocessing
 import os
 from os.path import exists
 from os.path import isdir
 from os.path import join
 import platform
 import re
+import subprocess
 
 
 def GetSuitePaths(test_root):
@@ -106,3 +109,110 @@ def GuessWordsize():
 
 def IsWindows():
   return GuessOS() == 'windows'
+
+
+# Rough estimate of the memory a single test process needs, used to cap the
+# default number of parallel jobs on machines with little memory.
+MEMORY_PER_JOB = 256 * 1024 * 1024
+
+
+def _ReadFileStripped(name):
+  try:
+    with open(name) as f:
+      return f.read().strip()
+  except IOError:
+    return None
+
+
+def ParseCpuList(cpu_list):
+  """Returns the CPUs in a kernel CPU list like '0-3,8,10-11'."""
+  cpus = []
+  for part in cpu_list.split(','):
+    if '-' in part:
+      (first, last) = part.split('-')
+      cpus += range(int(first), int(last) + 1)
+    elif part:
+      cpus.append(int(part))
+  return cpus
+
+
+def GetAffinityCpus():
+  """Returns the CPUs this process is allowed to run on."""
+  status = _ReadFileStripped('/proc/self/status')
+  if status:
+    for line in status.splitlines():
+      if line.startswith('Cpus_allowed_list:'):
+        return ParseCpuList(line.split(':')[1].strip())
+  return range(multiprocessing.cpu_count())
+
+
+def PinToCpu(cpu, pid=None):
+  """Restricts the process |pid| (default: this one) and the processes it
+  starts afterwards to |cpu|. Returns False if that isn't supported."""
+  if pid is None:
+    pid = os.getpid()
+  try:
+    with open(os.devnull, 'w') as devnull:
+      return subprocess.call(['taskset', '-p', '-c', str(cpu), str(pid)],
+                             stdout=devnull, stderr=devnull) == 0
+  except OSError:
+    return False
+
+
+def GetAffinityCpuCount():
+  """Returns the number of CPUs this process is allowed to run on."""
+  return len(GetAffinityCpus())
+
+
+def GetCgroupCpuQuota():
+  """Returns the CPU bandwidth limit of our cgroup as a (fractional) number
+  of CPUs, or None if there is no limit. Only the cgroup mounted at
+  /sys/fs/cgroup is considered, which is what containers see."""
+  cpu_max = _ReadFileStripped('/sys/fs/cgroup/cpu.max')  # cgroup v2
+  if cpu_max:
+    (quota, period) = cpu_max.split()
+    if quota == 'max':
+      return None
+    return float(quota) / float(period)
+  quota = _ReadFileStripped('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')  # v1
+  period = _ReadFileStripped('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+  if quota and period and int(quota) > 0:
+    return float(quota) / float(period)
+  return None
+
+
+def GetAvailableMemory():
+  """Returns the number of bytes of memory that are available for new
+  processes, taking cgroup memory limits into account, or None if unknown."""
+  available = None
+  meminfo = _ReadFileStripped('/proc/meminfo')
+  if meminfo:
+    for line in meminfo.splitlines():
+      if line.startswith('MemAvailable:'):
+        available = int(line.split()[1]) * 1024
+  for (limit_file, usage_file) in [
+      ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+      ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+       '/sys/fs/cgroup/memory/memory.usage_in_bytes')]:
+    limit = _ReadFileStripped(limit_file)
+    usage = _ReadFileStripped(usage_file)
+    if not limit or not usage or limit == 'max':
+      continue
+    cgroup_available = max(0, int(limit) - int(usage))
+    if available is None or cgroup_available < available:
+      available = cgroup_available
+    break
+  return available
+
+
+def GuessJobCount():
+  """Returns a sensible default for the number of parallel jobs, based on
+  the CPU affinity mask, the cgroup CPU quota and the available memory."""
+  jobs = GetAffinityCpuCount()
+  quota = GetCgroupCpuQuota()
+  if quota is not None:
+    jobs = min(jobs, int(math.ceil(quota)))
+  memory = GetAvailableMemory()
+  if memory is not None:
+    jobs = min(jobs, int(memory // MEMORY_PER_JOB))
+  return max(1, jobs)
@@ -0,0 +1,181 @@
+# Copyright 2013 the V8 project authors. All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of Google Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import shelve
+
+
+# Flags that have no effect once the optimizing compiler is turned off.
+OPTIMIZER_FLAGS = ["always-opt", "stress-opt"]
+# Number of consecutive runs in which a variant must have had the same
+# outcome as the standard variant before it is skipped.
+MIN_AGREEING_RUNS = 20
+# A skipped variant is run again every this many runs to catch changes.
+RECHECK_INTERVAL = 10
+
+
+def EffectiveFlags(flags):
+  """Returns a dict with the value each V8 flag in |flags| ends up with.
+  Later flags override earlier ones and --nofoo is foo=False. Values are
+  only recognized in the --foo=value form. Other tokens that don't start
+  with '-', such as file names, are ignored."""
+  result = {}
+  for flag in flags:
+    if not flag.startswith("-"):
+      continue
+    flag = flag.lstrip("-")
+    value = True
+    if "=" in flag:
+      (flag, value) = flag.split("=", 1)
+    flag = flag.replace("_", "-")
+    if value is True and flag.startswith("no"):
+      (flag, value) = (flag[2:].lstrip("-"), False)
+    result[flag] = value
+  return result
+
+
+def _CanonicalFlags(flags):
+  effective = EffectiveFlags(flags)
+  if effective.get("crankshaft") is False:
+    for flag in OPTIMIZER_FLAGS:
+      effective.pop(flag, None)
+  return frozenset(effective.iteritems())
+
+
+class VariantHistory(object):
+  """Persists, per test and variant, for how many consecutive runs the
+  variant had the same outcome as the standard variant of the test. The
+  counters changed in a run are kept in memory until close()."""
+
+  def __init__(self, datadir, arch, mode):
+    if not os.path.exists(datadir):
+      os.makedirs(datadir)
+    filename = os.path.join(datadir, "%s.%s.variants" % (arch, mode))
+    self.database = shelve.open(filename, protocol=2)
+    self.counters = {}  # Key -> (agreeing, skipped)
+
+  def close(self):
+    for (key, counters) in self.counters.iteritems():
+      self.database[key] = counters
+    self.counters = {}
+    self.database.close()
+
+  def _Get(self, key):
+    counters = self.counters.get(key)
+    if counters is None:
+      counters = self.database.get(key)
+    return counters
+
+  def GetKey(self, test, variant):
+    return str("%s|%s" % (test.GetLabel(), " ".join(variant)))
+
+  def ShouldRun(self, test, variant):
+    key = self.GetKey(test, variant)
+    counters = self._Get(key)
+    if counters is None:
+      return True
+    (agreeing, skipped) = counters
+    if agreeing < MIN_AGREEING_RUNS or skipped + 1 >= RECHECK_INTERVAL:
+      if skipped != 0:
+        self.counters[key] = (agreeing, 0)
+      return True
+    self.counters[key] = (agreeing, skipped + 1)
+    return False
+
+  def Record(self, test, variant, agrees):
+    key = self.GetKey(test, variant)
+    (agreeing, skipped) = self._Get(key) or (0, 0)
+    if agrees:
+      self.counters[key] = (agreeing + 1, skipped)
+    else:
+      self.counters[key] = (0, 0)
+
+
+class VariantPruner(object):
+  """Expands tests into their variants, leaving out variants that can't
+  change the behavior of a test:
+  - variants whose flags, merged with the flags of the test, are identical
+    to those of an earlier variant, e.g. --nocrankshaft for a test that
+    declares '// Flags: --nocrankshaft' itself. The optimizer flags are
+    ignored when the optimizer is turned off.
+  - with a |history|, variants that had the same outcome as the standard
+    variant in each of the last MIN_AGREEING_RUNS runs. These are still run
+    every RECHECK_INTERVAL runs.
+  The first variant is never left out."""
+
+  def __init__(self, context, history=None):
+    self.context = context
+    self.history = history
+    self.variants = {}  # Test -> (standard variant test, variant flags)
+    self.expanded = 0
+    self.identical = 0
+    self.from_history = 0
+
+  def Expand(self, suite, variant_flags):
+    result = []
+    for test in suite.tests:
+      variants = suite.VariantFlags(test, variant_flags)
+      self.expanded += len(variants)
+      test_flags = suite.GetFlagsForTestCase(test, self.context)
+      seen = set()
+      standard = None
+      for variant in variants:
+        canonical = _CanonicalFlags(variant + test_flags)
+        if canonical in seen:
+          self.identical += 1
+          continue
+        seen.add(canonical)
+        if (standard is not None and self.history is not None and
+            not self.history.ShouldRun(test, variant)):
+          self.from_history += 1
+          continue
+        copy = test.CopyAddingFlags(variant)
+        if standard is None:
+          standard = copy
+        self.variants[copy] = (standard, variant)
+        result.append(copy)
+    return result
+
+  def RecordResults(self):
+    """Updates the history with the outcomes of the tests that have run."""
+    if self.history is None:
+      return
+    for (test, (standard, variant)) in self.variants.iteritems():
+      if (test is standard or test.output is None or
+          standard.output is None):
+        continue
+      agrees = (test.suite.GetOutcome(test) ==
+                standard.suite.GetOutcome(standard))
+      self.history.Record(test, variant, agrees)
+
+  def PrintSummary(self):
+    print (">>> Variant pruning: skipped %d of %d test runs (%d with "
+           "identical flags, %d from history)" %
+           (self.identical + self.from_history, self.expanded,
+            self.identical, self.from_history))
@@ -84,6 +84,15 @@ def FormatTime(d):
   return time.strftime("%M:%S.", time.gmtime(d)) + ("%03i" % millis)
 
 
+def FormatResources(output):
+  if output is None or output.resources is None:
+    return ""
+  r = output.resources
+  return "[user %s, sys %s, rss %7.1f MB, ctxsw %i/%i] " % (
+      FormatTime(r.user_time), FormatTime(r.system_time),
+      r.max_rss / 1024.0, r.voluntary_switches, r.involuntary_switches)
+
+
 def PrintTestDurations(suites, overall_time):
     # Write the times to stderr to make it easy to separate from the
     # test output.
@@ -95,5 +104,7 @@ def PrintTestDurations(suites, overall_time):
     index = 1
     for entry in timed_tests[:20]:
       t = FormatTime(entry.duration)
-      sys.stderr.write("%4i (%s) %s\n" % (index, t, entry.GetLabel()))
+      sys.stderr.write("%4i (%s) %s%s\n" % (index, t,
+                                             FormatResources(entry.output),
+                                             entry.GetLabel()))
       index += 1
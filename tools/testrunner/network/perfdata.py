@@ -32,19 +32,34 @@ import threading
 
 
 class PerfDataEntry(object):
+  # Class-level defaults for entries that were stored before resource usage
+  # was recorded.
+  rss_avg = 0.0
+  rss_count = 0
+
   def __init__(self):
     self.avg = 0.0
     self.count = 0
+    self.rss_avg = 0.0
+    self.rss_count = 0
 
-  def AddResult(self, result):
+  @staticmethod
+  def _Learn(avg, count, result):
     kLearnRateLimiter = 99  # Greater value means slower learning.
     # We use an approximation of the average of the last 100 results here:
     # The existing average is weighted with kLearnRateLimiter (or less
     # if there are fewer data points).
-    effective_count = min(self.count, kLearnRateLimiter)
-    self.avg = self.avg * effective_count + result
-    self.count = effective_count + 1
-    self.avg /= self.count
+    effective_count = min(count, kLearnRateLimiter)
+    avg = avg * effective_count + result
+    count = effective_count + 1
+    return (avg / count, count)
+
+  def AddResult(self, result):
+    (self.avg, self.count) = PerfDataEntry._Learn(self.avg, self.count, result)
+
+  def AddMaxRss(self, max_rss):
+    (self.rss_avg, self.rss_count) = PerfDataEntry._Learn(
+        self.rss_avg, self.rss_count, max_rss)
 
 
 class PerfDataStore(object):
@@ -74,21 +89,61 @@ class PerfDataStore(object):
       return self.database[key].avg
     return None
 
+  def FetchMaxRss(self, test):
+    """Returns the observed peak memory use in KB for |test|, if known."""
+    key = self.GetKey(test)
+    if key in self.database:
+      entry = self.database[key]
+      if entry.rss_count > 0:
+        return entry.rss_avg
+    return None
+
   def UpdatePerfData(self, test):
-    """Updates the persisted value in the store with test.duration."""
+    """Updates the persisted values in the store with test.duration and the
+    peak memory use of the test, if available."""
     testkey = self.GetKey(test)
-    self.RawUpdatePerfData(testkey, test.duration)
+    max_rss = None
+    if test.output is not None and test.output.resources is not None:
+      max_rss = test.output.resources.max_rss
+    self.RawUpdatePerfData(testkey, test.duration, max_rss)
 
-  def RawUpdatePerfData(self, testkey, duration):
+  def RawUpdatePerfData(self, testkey, duration, max_rss=None):
     with self.lock:
       if testkey in self.database:
         entry = self.database[testkey]
       else:
         entry = PerfDataEntry()
       entry.AddResult(duration)
+      if max_rss is not None:
+        entry.AddMaxRss(max_rss)
       self.database[testkey] = entry
 
 
+class NullPerfDataStore(object):
+  """Store that knows nothing and forgets all updates, for throwaway
+  tests."""
+
+  def close(self):
+    pass
+
+  def FetchPerfData(self, test):
+    return None
+
+  def FetchMaxRss(self, test):
+    return None
+
+  def UpdatePerfData(self, test):
+    pass
+
+
+class NullPerfDataManager(object):
+  def close(self):
+    pass
+
+  def GetStore(self, arch, mode):
+    return NullPerfDataStore()
+
+
 class PerfDataManager(object):
   def __init__(self, datadir):
     self.datadir = os.path.abspath(datadir)
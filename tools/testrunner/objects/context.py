@@ -28,7 +28,8 @@
 
 class Context():
   def __init__(self, arch, mode, shell_dir, mode_flags, verbose, timeout,
-               isolates, command_prefix, extra_flags, noi18n):
+               isolates, command_prefix, extra_flags, noi18n, adaptive_jobs,
+               memory_budget, batch_tests, cpus, benchmark_results):
     self.arch = arch
     self.mode = mode
     self.shell_dir = shell_dir
@@ -39,6 +40,12 @@ class Context():
     self.command_prefix = command_prefix
     self.extra_flags = extra_flags
     self.noi18n = noi18n
+    self.adaptive_jobs = adaptive_jobs
+    self.memory_budget = memory_budget  # In KB, 0 means unlimited.
+    self.batch_tests = batch_tests
+    self.cpus = cpus  # CPUs to pin the workers to, none if empty.
+    # Whether benchmarks print their results for run-benchmarks.py.
+    self.benchmark_results = benchmark_results
 
   def Pack(self):
     return [self.arch, self.mode, self.mode_flags, self.timeout, self.isolates,
@@ -48,4 +55,5 @@ class Context():
   def Unpack(packed):
     # For the order of the fields, refer to Pack() above.
     return Context(packed[0], packed[1], None, packed[2], False,
-                   packed[3], packed[4], packed[5], packed[6], packed[7])
+                   packed[3], packed[4], packed[5], packed[6], packed[7],
+                   False, 0, False, [], False)
@@ -30,13 +30,49 @@ import signal
 
 from ..local import utils
 
+class ResourceUsage(object):
+  """CPU time, peak memory and context switches of a finished process."""
+
+  def __init__(self, user_time, system_time, max_rss, voluntary_switches,
+               involuntary_switches):
+    self.user_time = user_time  # float, seconds
+    self.system_time = system_time  # float, seconds
+    self.max_rss = max_rss  # int, peak resident set size in KB
+    self.voluntary_switches = voluntary_switches
+    self.involuntary_switches = involuntary_switches
+
+  @staticmethod
+  def FromRusage(rusage):
+    """Creates a ResourceUsage object from the result of os.wait4()."""
+    max_rss = rusage.ru_maxrss
+    if utils.GuessOS() == "macos":
+      max_rss /= 1024  # Reported in bytes instead of KB.
+    return ResourceUsage(rusage.ru_utime, rusage.ru_stime, max_rss,
+                         rusage.ru_nvcsw, rusage.ru_nivcsw)
+
+  def CpuTime(self):
+    return self.user_time + self.system_time
+
+  def Pack(self):
+    return [self.user_time, self.system_time, self.max_rss,
+            self.voluntary_switches, self.involuntary_switches]
+
+  @staticmethod
+  def Unpack(packed):
+    # For the order of the fields, refer to Pack() above.
+    if packed is None:
+      return None
+    return ResourceUsage(packed[0], packed[1], packed[2], packed[3], packed[4])
+
+
 class Output(object):
 
-  def __init__(self, exit_code, timed_out, stdout, stderr):
+  def __init__(self, exit_code, timed_out, stdout, stderr, resources=None):
     self.exit_code = exit_code
     self.timed_out = timed_out
     self.stdout = stdout
     self.stderr = stderr
+    self.resources = resources  # ResourceUsage, None if not supported
 
   def HasCrashed(self):
     if utils.IsWindows():
@@ -52,9 +88,17 @@ class Output(object):
     return self.timed_out
 
   def Pack(self):
-    return [self.exit_code, self.timed_out, self.stdout, self.stderr]
+    resources = None
+    if self.resources is not None:
+      resources = self.resources.Pack()
+    return [self.exit_code, self.timed_out, self.stdout, self.stderr,
+            resources]
 
   @staticmethod
   def Unpack(packed):
     # For the order of the fields, refer to Pack() above.
-    return Output(packed[0], packed[1], packed[2], packed[3])
+    # Peers running an older version don't send resource usage.
+    resources = None
+    if len(packed) > 4:
+      resources = ResourceUsage.Unpack(packed[4])
+    return Output(packed[0], packed[1], packed[2], packed[3], resources)
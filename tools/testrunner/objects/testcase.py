@@ -38,10 +38,12 @@ class TestCase(object):
     self.output = None
     self.id = None  # int, used to map result back to TestCase instance
     self.duration = None  # assigned during execution
+    self.shell_dir = None  # overrides the context's shell_dir if set
 
   def CopyAddingFlags(self, flags):
     copy = TestCase(self.suite, self.path, self.flags + flags, self.dependency)
     copy.outcomes = self.outcomes
+    copy.shell_dir = self.shell_dir
     return copy
 
   def PackTask(self):